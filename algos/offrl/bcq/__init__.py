@@ -1,3 +1,3 @@
-from .storage import ReplayBuffer
+from algos.utils.replay_buffer import ReplayBuffer
 from .module import BCQ_Model
 from .bcq import BCQ
\ No newline at end of file
@@ -6,8 +6,8 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 
-from bidexhands.algorithms.offrl.bcq import BCQ_Model
-from bidexhands.algorithms.offrl.bcq import ReplayBuffer
+from algos.offrl.bcq.module import BCQ_Model
+from algos.utils.replay_buffer import ReplayBuffer
 
 class BCQ:
 
@@ -18,6 +18,8 @@ class BCQ:
                 tau = 0.005,
                 lmbda = 0.75,
                 phi = 0.05,
+                num_candidates = 100,
+                select_chunk_size = None,
                 batch_size = 100,
                 max_timesteps = 1000000,
                 iterations =  10000,
@@ -33,6 +35,8 @@ class BCQ:
         self.tau = tau
         self.lmbda = lmbda
         self.phi = phi
+        self.num_candidates = num_candidates
+        self.select_chunk_size = select_chunk_size
         self.batch_size = batch_size
         self.max_timesteps = max_timesteps
         self.iterations = iterations
@@ -57,7 +61,8 @@ class BCQ:
         action_dim = self.action_space.shape[0] 
         max_action = float(self.action_space.high[0])
 
-        policy = BCQ_Model(state_dim, action_dim, max_action, self.device, self.discount, self.tau, self.lmbda, self.phi)
+        policy = BCQ_Model(state_dim, action_dim, max_action, self.device, self.discount, self.tau, self.lmbda, self.phi,
+                           self.num_candidates, self.select_chunk_size)
 
         replay_buffer = ReplayBuffer(state_dim, action_dim, self.device)
         replay_buffer.convert(self.data_dir)
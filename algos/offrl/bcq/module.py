@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from algos.utils.ensemble import EnsembleMLP, soft_update
+
 class Actor(nn.Module):
 	def __init__(self, state_dim, action_dim, max_action, phi=0.05):
 		super(Actor, self).__init__()
@@ -23,29 +25,15 @@ class Actor(nn.Module):
 class Critic(nn.Module):
 	def __init__(self, state_dim, action_dim):
 		super(Critic, self).__init__()
-		self.l1 = nn.Linear(state_dim + action_dim, 400)
-		self.l2 = nn.Linear(400, 300)
-		self.l3 = nn.Linear(300, 1)
-
-		self.l4 = nn.Linear(state_dim + action_dim, 400)
-		self.l5 = nn.Linear(400, 300)
-		self.l6 = nn.Linear(300, 1)
+		#* both Q heads, evaluated with one batched matmul per layer
+		self.q = EnsembleMLP(2, state_dim + action_dim, [400, 300], 1)
 
 	def forward(self, state, action):
-		q1 = F.relu(self.l1(torch.cat([state, action], 1)))
-		q1 = F.relu(self.l2(q1))
-		q1 = self.l3(q1)
-
-		q2 = F.relu(self.l4(torch.cat([state, action], 1)))
-		q2 = F.relu(self.l5(q2))
-		q2 = self.l6(q2)
+		q1, q2 = self.q(torch.cat([state, action], 1))
 		return q1, q2
 
 	def q1(self, state, action):
-		q1 = F.relu(self.l1(torch.cat([state, action], 1)))
-		q1 = F.relu(self.l2(q1))
-		q1 = self.l3(q1)
-		return q1
+		return self.q(torch.cat([state, action], 1), members=slice(0, 1))[0]
 
 class VAE(nn.Module):
 	def __init__(self, state_dim, action_dim, latent_dim, max_action, device):
@@ -85,7 +73,13 @@ class VAE(nn.Module):
 		return self.max_action * torch.tanh(self.d3(a))
 
 class BCQ_Model(object):
-	def __init__(self, state_dim, action_dim, max_action, device, discount=0.99, tau=0.005, lmbda=0.75, phi=0.05):
+	def __init__(self, state_dim, action_dim, max_action, device, discount=0.99, tau=0.005, lmbda=0.75, phi=0.05,
+				 num_candidates=100, select_chunk_size=None):
+		"""
+		Args:
+			num_candidates: number of VAE actions scored by q1 per state in `select_action`
+			select_chunk_size: max number of states whose candidates are evaluated at once, None for all
+		"""
 		latent_dim = action_dim * 2
 
 		self.actor = Actor(state_dim, action_dim, max_action, phi).to(device)
@@ -105,18 +99,27 @@ class BCQ_Model(object):
 		self.tau = tau
 		self.lmbda = lmbda
 		self.device = device
+		self.num_candidates = num_candidates
+		self.select_chunk_size = select_chunk_size
 
 
-	def select_action(self, state):		
+	def select_action(self, state):
 		with torch.no_grad():
-			lenth = state.shape[0]
-			state = state.unsqueeze(1).repeat(1,100, 1).reshape(-1,state.shape[-1])
-			action = self.actor(state, self.vae.decode(state))
-			q1 = self.critic.q1(state, action).reshape(lenth,100,1)
-			ind = q1.argmax(1)
-			action = action.reshape(lenth,100,action.shape[-1])
-			action = torch.stack([action[i][ind[i]] for i in range(lenth)]).squeeze(1)
-		return action
+			if self.select_chunk_size is None or state.shape[0] <= self.select_chunk_size:
+				return self._select_action(state)
+			#* bounds the [chunk * num_candidates, 750] activations of the VAE decoder for large env counts
+			return torch.cat([self._select_action(chunk) for chunk in state.split(self.select_chunk_size)])
+
+
+	def _select_action(self, state):
+		lenth = state.shape[0]
+		state = state.repeat_interleave(self.num_candidates, 0)
+		action = self.actor(state, self.vae.decode(state))
+		q1 = self.critic.q1(state, action).view(lenth, self.num_candidates)
+		ind = q1.argmax(1)
+		action = action.view(lenth, self.num_candidates, -1)
+		# best candidate of every state with one gather
+		return action.gather(1, ind.view(lenth, 1, 1).expand(lenth, 1, action.shape[-1])).squeeze(1)
 
 
 	def train(self, replay_buffer, iterations, batch_size=100):
@@ -157,8 +160,4 @@ class BCQ_Model(object):
 			actor_loss.backward()
 			self.actor_optimizer.step()
 
-			for param, target_param in zip(self.critic.parameters(), self.critic_target.parameters()):
-				target_param.data.copy_(self.tau * param.data + (1 - self.tau) * target_param.data)
-
-			for param, target_param in zip(self.actor.parameters(), self.actor_target.parameters()):
-				target_param.data.copy_(self.tau * param.data + (1 - self.tau) * target_param.data)
\ No newline at end of file
+			soft_update([self.critic_target, self.actor_target], [self.critic, self.actor], self.tau)
\ No newline at end of file
@@ -1,3 +1,3 @@
-from .storage import ReplayBuffer
+from algos.utils.replay_buffer import ReplayBuffer
 from .module import IQL_Model
 from .iql import IQL
\ No newline at end of file
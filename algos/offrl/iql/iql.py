@@ -6,8 +6,8 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 
-from bidexhands.algorithms.offrl.iql import IQL_Model
-from bidexhands.algorithms.offrl.iql import ReplayBuffer
+from algos.offrl.iql.module import IQL_Model
+from algos.utils.replay_buffer import ReplayBuffer
 
 class IQL:
 
@@ -7,6 +7,8 @@ import numpy as np
 
 from copy import deepcopy
 
+from algos.utils.ensemble import EnsembleMLP, soft_update
+
 class TDNetwork(nn.Module):
     def __init__(self, state_dim, action_dim, net_type):
         super().__init__()
@@ -93,13 +95,12 @@ class IQL_Model():
         self.action_dim = action_dim
         self.max_action = max_action
 
-        self.q_net_1 = TDNetwork(self.state_dim,self.action_dim,'Q').to(self.device)
-        self.target_q_net_1 = deepcopy(self.q_net_1)
-        self.q_net_2 = TDNetwork(self.state_dim,self.action_dim,'Q').to(self.device)
-        self.target_q_net_2 = deepcopy(self.q_net_2)
-
-        self.q_optimizer_1 = torch.optim.Adam(self.q_net_1.parameters(), lr=3e-4)
-        self.q_optimizer_2 = torch.optim.Adam(self.q_net_2.parameters(), lr=3e-4)
+        #* the twin Q networks (TDNetwork 'Q' architecture) as one ensemble with a shared optimizer,
+        #* Adam is elementwise so this is the same update as one optimizer per network
+        self.q_net = EnsembleMLP(2, self.state_dim + self.action_dim, [256, 256], 1,
+                                 weight_init=lambda weight: nn.init.orthogonal_(weight, gain=np.sqrt(2))).to(self.device)
+        self.target_q_net = deepcopy(self.q_net)
+        self.q_optimizer = torch.optim.Adam(self.q_net.parameters(), lr=3e-4)
 
         self.v_net = TDNetwork(self.state_dim,self.action_dim,'V').to(self.device)
         self.v_optimizer = torch.optim.Adam(self.v_net.parameters(), lr=3e-4)
@@ -119,24 +120,26 @@ class IQL_Model():
     def square_loss(self, value, mean_prediction):
         return torch.mean(torch.square(value - mean_prediction))
 
+    def target_Q(self, states, actions):
+        with torch.no_grad():
+            return self.target_q_net(torch.cat([states, actions], dim=-1)).min(0)[0]
+
     def L_V(self, states, actions):
-        Q_input = torch.cat([states, actions], dim=-1)
-        Q_1 = self.target_q_net_1.forward(Q_input)
-        Q_2 = self.target_q_net_2.forward(Q_input)
-        Q_values = torch.minimum(Q_1, Q_2)
+        Q_values = self.target_Q(states, actions)
         V_values = self.v_net.forward(states)
         return self.expectile_loss(Q_values, V_values)
 
-    def L_Q(self, q_net, states, actions, rewards, next_states, terminals):
-        Q_values = q_net.forward(torch.cat([states, actions], dim=-1)).squeeze(-1)
-        V_values = self.v_net.forward(next_states).squeeze(-1) * (terminals)
-        return self.square_loss(rewards + self.discount * V_values, Q_values)
+    def L_Q(self, states, actions, rewards, next_states, terminals):
+        """ Sum of the square losses of the Q networks, the gradient of each network is that of its own loss
+        """
+        Q_values = self.q_net(torch.cat([states, actions], dim=-1)).squeeze(-1)
+        with torch.no_grad():
+            V_values = self.v_net.forward(next_states).squeeze(-1) * (terminals)
+        target = rewards + self.discount * V_values
+        return sum(self.square_loss(target, Q) for Q in Q_values)
 
     def target_update(self):
-        for target_param, param in zip(self.target_q_net_1.parameters(), self.q_net_1.parameters()):
-            target_param.data.copy_((1.0 - self.tau) * target_param.data + self.tau * param.data)
-        for target_param, param in zip(self.target_q_net_2.parameters(), self.q_net_2.parameters()):
-            target_param.data.copy_((1.0 - self.tau) * target_param.data + self.tau * param.data)
+        soft_update(self.target_q_net, self.q_net, self.tau)
 
     def TD_networks_update(self, states, actions, rewards, next_states, terminals):
         
@@ -145,24 +148,16 @@ class IQL_Model():
         L_V.backward()
         self.v_optimizer.step()
 
-        L_Q_1 = self.L_Q(self.q_net_1, states, actions, rewards, next_states, terminals)
-        self.q_optimizer_1.zero_grad()
-        L_Q_1.backward()
-        self.q_optimizer_1.step()
-
-        L_Q_2 = self.L_Q(self.q_net_2, states, actions, rewards, next_states, terminals)
-        self.q_optimizer_2.zero_grad()
-        L_Q_2.backward()
-        self.q_optimizer_2.step()
+        L_Q = self.L_Q(states, actions, rewards, next_states, terminals)
+        self.q_optimizer.zero_grad()
+        L_Q.backward()
+        self.q_optimizer.step()
 
         self.target_update()
 
     def L_pi(self, states, actions):
 
-        Q_input = torch.cat([states, actions], dim=-1)
-        Q_1 = self.target_q_net_1.forward(Q_input)
-        Q_2 = self.target_q_net_2.forward(Q_input)
-        Q_values = torch.minimum(Q_1, Q_2)
+        Q_values = self.target_Q(states, actions)
         V_values = self.v_net.forward(states)
         exp_advantages = torch.clip(torch.exp(self.beta * (Q_values - V_values)), max=100)
         action_log_probs = self.policy_net.forward_dist(states).log_prob(torch.clamp(actions, min=-0.99, max=0.99))
@@ -1,3 +1,4 @@
 from .storage import RolloutStorage
 from .module import ActorCritic
 from .ppo_collect import PPO
+from .parallel import collect_shards
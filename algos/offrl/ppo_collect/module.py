@@ -1,8 +1,10 @@
+from typing import Optional, Tuple
+import math
+import warnings
 import numpy as np
 
 import torch
 import torch.nn as nn
-from torch.distributions import MultivariateNormal
 
 
 class ActorCritic(nn.Module):
@@ -21,6 +23,11 @@ class ActorCritic(nn.Module):
             critic_hidden_dim = model_cfg['vf_hid_sizes']
             activation = get_activation(model_cfg['activation'])
 
+        # Execution mode of act / act_inference / evaluate, can be none, jit (TorchScript) or compile (torch.compile)
+        self.compile_mode = 'none' if model_cfg is None else model_cfg.get('compile', 'none')
+        if self.compile_mode not in ('none', 'jit', 'compile'):
+            raise NotImplementedError(f"Unsupported compile mode: {self.compile_mode}")
+
         # Policy
         actor_layers = []
         actor_layers.append(nn.Linear(*obs_shape, actor_hidden_dim[0]))
@@ -70,14 +77,73 @@ class ActorCritic(nn.Module):
     def forward(self):
         raise NotImplementedError
 
+    def action_log_scale(self):
+        """ Log of the per-dimension scale of the independent Gaussian policy.
+
+        The former MultivariateNormal head passed diag(exp(log_std) ** 2) as `scale_tril`,
+        i.e. the actual scale is exp(2 * log_std). Kept as is so that `log_std` of existing
+        checkpoints gives the same policy.
+        """
+        return 2 * self.log_std
+
+    def _compiled_kernels(self):
+        """ Build the compiled `PolicyKernels` on first use, None if disabled or unavailable.
+
+        The kernels share the parameters of `actor` / `critic` and are not registered as a submodule,
+        so `state_dict`, optimizers and `.to()` only see the eager modules.
+        """
+        if self.compile_mode == 'none':
+            return None
+        kernels = self.__dict__.get('_kernels')
+        if kernels is None:
+            try:
+                kernels = PolicyKernels(self.actor, self.critic, self.asymmetric)
+                if self.compile_mode == 'jit':
+                    kernels = torch.jit.script(kernels)
+                else:
+                    if not hasattr(torch, 'compile'):
+                        raise RuntimeError(f"torch.compile is not available in torch {torch.__version__}")
+                    kernels = CompiledKernels(kernels)
+            except Exception as e:
+                return self._disable_compile(e)
+            self.__dict__['_kernels'] = kernels
+        return kernels
+
+    def _disable_compile(self, error):
+        warnings.warn(f"Compiled policy ({self.compile_mode}) unavailable, fall back to eager: {error}")
+        self.compile_mode = 'none'
+        self.__dict__.pop('_kernels', None)
+        return None
+
+    def _run_compiled(self, name, *args):
+        """ Run a compiled kernel, returns None if the eager path must be used instead
+        """
+        kernels = self._compiled_kernels()
+        if kernels is None:
+            return None
+        try:
+            return getattr(kernels, name)(*args)
+        except Exception as e:
+            #* compile errors of torch.compile only surface at the first call
+            if self.__dict__.get('_compiled_ok', False):
+                raise
+            return self._disable_compile(e)
+        finally:
+            self.__dict__['_compiled_ok'] = self.compile_mode != 'none'
+
     def act(self, observations, states):
-        actions_mean = self.actor(observations)
+        if self.compile_mode != 'none':
+            with torch.no_grad():
+                outputs = self._run_compiled('act', observations, states, self.log_std)
+            if outputs is not None:
+                return outputs
 
-        covariance = torch.diag(self.log_std.exp() * self.log_std.exp())
-        distribution = MultivariateNormal(actions_mean, scale_tril=covariance)
+        actions_mean = self.actor(observations)
 
-        actions = distribution.sample()
-        actions_log_prob = distribution.log_prob(actions)
+        log_scale = self.action_log_scale()
+        with torch.no_grad():
+            actions = torch.addcmul(actions_mean, log_scale.exp(), torch.randn_like(actions_mean))
+        actions_log_prob = diag_gaussian_log_prob(actions, actions_mean, log_scale)
 
         if self.asymmetric:
             value = self.critic(states)
@@ -87,17 +153,25 @@ class ActorCritic(nn.Module):
         return actions.detach(), actions_log_prob.detach(), value.detach(), actions_mean.detach(), self.log_std.repeat(actions_mean.shape[0], 1).detach()
 
     def act_inference(self, observations):
+        if self.compile_mode != 'none':
+            actions_mean = self._run_compiled('act_inference', observations)
+            if actions_mean is not None:
+                return actions_mean
+
         actions_mean = self.actor(observations)
         return actions_mean
 
     def evaluate(self, observations, states, actions):
-        actions_mean = self.actor(observations)
+        if self.compile_mode != 'none':
+            outputs = self._run_compiled('evaluate', observations, states, actions, self.log_std)
+            if outputs is not None:
+                return outputs
 
-        covariance = torch.diag(self.log_std.exp() * self.log_std.exp())
-        distribution = MultivariateNormal(actions_mean, scale_tril=covariance)
+        actions_mean = self.actor(observations)
 
-        actions_log_prob = distribution.log_prob(actions)
-        entropy = distribution.entropy()
+        log_scale = self.action_log_scale()
+        actions_log_prob = diag_gaussian_log_prob(actions, actions_mean, log_scale)
+        entropy = diag_gaussian_entropy(log_scale).expand(actions_mean.shape[:-1])
 
         if self.asymmetric:
             value = self.critic(states)
@@ -107,6 +181,73 @@ class ActorCritic(nn.Module):
         return actions_log_prob, entropy, value, actions_mean, self.log_std.repeat(actions_mean.shape[0], 1)
 
 
+class PolicyKernels(nn.Module):
+    """ TorchScript / torch.compile friendly version of `ActorCritic.act`, `act_inference` and `evaluate`,
+        with the diagonal Gaussian math inlined. Holds references to the actor and critic of the policy.
+    """
+    def __init__(self, actor, critic, asymmetric: bool):
+        super(PolicyKernels, self).__init__()
+        self.actor = actor
+        self.critic = critic
+        self.asymmetric = asymmetric
+
+    def _value(self, observations: torch.Tensor, states: Optional[torch.Tensor]) -> torch.Tensor:
+        if self.asymmetric:
+            assert states is not None
+            return self.critic(states)
+        return self.critic(observations)
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        return self.actor(observations)
+
+    @torch.jit.export
+    def act_inference(self, observations: torch.Tensor) -> torch.Tensor:
+        return self.actor(observations)
+
+    @torch.jit.export
+    def act(self, observations: torch.Tensor, states: Optional[torch.Tensor], log_std: torch.Tensor
+            ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        actions_mean = self.actor(observations)
+        log_scale = 2 * log_std  # see `ActorCritic.action_log_scale`
+        actions = actions_mean + torch.exp(log_scale) * torch.randn_like(actions_mean)
+        actions_log_prob = diag_gaussian_log_prob(actions, actions_mean, log_scale)
+        value = self._value(observations, states)
+        return actions, actions_log_prob, value, actions_mean, log_std.repeat(actions_mean.shape[0], 1)
+
+    @torch.jit.export
+    def evaluate(self, observations: torch.Tensor, states: Optional[torch.Tensor], actions: torch.Tensor, log_std: torch.Tensor
+                 ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        actions_mean = self.actor(observations)
+        log_scale = 2 * log_std
+        actions_log_prob = diag_gaussian_log_prob(actions, actions_mean, log_scale)
+        entropy = diag_gaussian_entropy(log_scale).expand(actions_mean.shape[:-1])
+        value = self._value(observations, states)
+        return actions_log_prob, entropy, value, actions_mean, log_std.repeat(actions_mean.shape[0], 1)
+
+
+class CompiledKernels():
+    """ `PolicyKernels` methods wrapped by torch.compile (torch >= 2.0)
+    """
+    def __init__(self, kernels):
+        self.kernels = kernels
+        self.act = torch.compile(kernels.act)
+        self.act_inference = torch.compile(kernels.act_inference)
+        self.evaluate = torch.compile(kernels.evaluate)
+
+
+def diag_gaussian_log_prob(actions, mean, log_scale):
+    """ Closed-form log-density of an independent Gaussian, summed over the last (action) dimension
+    """
+    z = (actions - mean) * torch.exp(-log_scale)
+    return -0.5 * z.pow(2).sum(-1) - log_scale.sum(-1) - 0.5 * mean.shape[-1] * math.log(2 * math.pi)
+
+
+def diag_gaussian_entropy(log_scale):
+    """ Closed-form entropy of an independent Gaussian, summed over the last (action) dimension
+    """
+    return 0.5 * log_scale.shape[-1] * (1.0 + math.log(2 * math.pi)) + log_scale.sum(-1)
+
+
 def get_activation(act_name):
     if act_name == "elu":
         return nn.ELU()
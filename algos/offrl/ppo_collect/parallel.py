@@ -0,0 +1,50 @@
+import os
+
+import torch.multiprocessing as mp
+
+from algos.utils.replay_buffer import TransitionWriter, write_manifest
+
+
+def shard_sizes(data_size, num_workers):
+    """ Split `data_size` transitions as evenly as possible between the workers
+    """
+    return [data_size // num_workers + (worker_id < data_size % num_workers) for worker_id in range(num_workers)]
+
+
+def collect_shards(collect_fn, data_dir, data_size, num_workers):
+    """ Collect an offline dataset with `num_workers` independent processes, one shard each.
+
+    `collect_fn(worker_id, shard_dir, shard_size)` builds its own env and collector and writes `shard_size`
+    transitions to `shard_dir` with a `TransitionWriter`. The workers only meet at the final join, then the
+    shards are described by `{data_dir}/manifest.json`, which `ReplayBuffer.convert(data_dir)` loads.
+    A failed worker leaves a resumable shard, running the collection again only fills the missing rows.
+
+    Args:
+        collect_fn: picklable function run in each (spawned) worker
+        data_dir: directory of the shards and the manifest
+        data_size: total number of transitions
+
+    Return:
+        path of the manifest
+    """
+    shards = [(os.path.join(data_dir, f'shard_{worker_id}'), size) for worker_id, size in enumerate(shard_sizes(data_size, num_workers))]
+    if num_workers == 1:
+        collect_fn(0, *shards[0])
+    else:
+        # Workers are spawned since the envs and CUDA can not be forked
+        ctx = mp.get_context('spawn')
+        workers = [ctx.Process(target=collect_fn, args=(worker_id, shard_dir, size), name=f'collect-worker-{worker_id}')
+                   for worker_id, (shard_dir, size) in enumerate(shards)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    incomplete = []
+    for shard_dir, size in shards:
+        progress = TransitionWriter.read_progress(shard_dir)
+        if progress is None or progress['written'] < size:
+            incomplete.append(shard_dir)
+    if incomplete:
+        raise RuntimeError(f"Collection of {', '.join(incomplete)} did not finish, run it again to resume")
+    return write_manifest(data_dir, [shard_dir for shard_dir, _ in shards])
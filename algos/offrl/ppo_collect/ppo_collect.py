@@ -13,7 +13,8 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.tensorboard import SummaryWriter
 
-from bidexhands.algorithms.offrl.ppo_collect import RolloutStorage
+from algos.offrl.ppo_collect.storage import RolloutStorage
+from algos.utils.replay_buffer import TransitionWriter
 
 
 class PPO:
@@ -118,23 +119,18 @@ class PPO:
         current_obs = self.vec_env.reset()
         current_states = self.vec_env.get_state()
         max_action = float(self.action_space.high[0])
-
-        states_off = []
-        actions_off = []
-        rewards_off = []
-        next_states_off = []
-        dones_off = []
+        state_dim = self.observation_space.shape[0]
+        action_dim = self.action_space.shape[0]
 
         if self.is_testing:
 
-            nums = 0
+            #* transitions are streamed to memory-mapped files of the final size, an interrupted run resumes
+            writer = TransitionWriter(self.data_save, self.data_size, state_dim, action_dim)
             reward_sum = []
             cur_reward_sum = torch.zeros(self.vec_env.num_envs, dtype=torch.float, device=self.device)
             current_obs = self.vec_env.reset()
             current_states = self.vec_env.get_state()
-            while nums<self.data_size:
-                
-                nums += self.vec_env.num_envs
+            while not writer.done:
                 actions, actions_log_prob, values, mu, sigma = self.actor_critic.act(current_obs, current_states)
                 next_obs, rews, dones, infos = self.vec_env.step(actions)
                 next_states = self.vec_env.get_state()
@@ -144,27 +140,14 @@ class PPO:
                 reward_sum.extend(cur_reward_sum[new_ids][:, 0].detach().cpu().numpy().tolist())
                 cur_reward_sum[new_ids] = 0
 
-                states_off.append(current_obs.clone().detach().cpu().numpy())
-                next_states_off.append(next_obs.clone().detach().cpu().numpy())
-                actions_off.append(actions.clone().detach().cpu().numpy().clip(-max_action,max_action))
-                rewards_off.append(rews.clone().detach().cpu().numpy().reshape(-1,1))
-                dones_off.append(dones.clone().detach().cpu().numpy().reshape(-1,1)*1.0)
+                writer.add(current_obs, actions.clamp(-max_action, max_action), next_obs, rews, dones.float())
 
                 current_obs.copy_(next_obs)
                 current_states.copy_(next_states)
 
-            states_off = np.vstack(states_off)
-            next_states_off = np.vstack(next_states_off)
-            actions_off = np.vstack(actions_off)
-            rewards_off = np.vstack(rewards_off)
-            dones_off = np.vstack(dones_off)
-            np.save(self.data_save+'/states.npy',states_off[0:self.data_size])
-            np.save(self.data_save+'/next_states.npy',next_states_off[0:self.data_size])
-            np.save(self.data_save+'/actions.npy',actions_off[0:self.data_size])
-            np.save(self.data_save+'/rewards.npy',rewards_off[0:self.data_size])
-            np.save(self.data_save+'/dones.npy',dones_off[0:self.data_size])
-            
-            print(sum(reward_sum)/len(reward_sum))
+            writer.close()
+            if reward_sum:
+                print(sum(reward_sum)/len(reward_sum))
 
 
         else:
@@ -177,6 +160,13 @@ class PPO:
             episode_length = []
             self.save(os.path.join(self.log_dir, 'model.pt'))
 
+            #* a tenth of the envs is recorded at every step of the first half of the training
+            collect_until = int(num_learning_iterations/2)
+            num_collect_envs = int(self.vec_env.num_envs/10)
+            num_collect_iterations = max(0, collect_until + 1 - self.current_learning_iteration)
+            writer = TransitionWriter(self.log_dir, num_collect_iterations * self.num_transitions_per_env * num_collect_envs,
+                                      state_dim, action_dim, resume=False)
+
             for it in range(self.current_learning_iteration, num_learning_iterations):
                 start = time.time()
                 ep_infos = []
@@ -194,13 +184,10 @@ class PPO:
                     # Step the vec_environment
                     next_obs, rews, dones, infos = self.vec_env.step(actions)
 
-                    if it <= int(num_learning_iterations/2):
-                        index = np.random.choice(self.vec_env.num_envs, int(self.vec_env.num_envs/10), replace=True)
-                        states_off.append(current_obs[index].clone().detach().cpu().numpy())
-                        next_states_off.append(next_obs[index].clone().detach().cpu().numpy())
-                        actions_off.append(actions[index].clone().detach().cpu().numpy().clip(-max_action,max_action))
-                        rewards_off.append(rews[index].clone().detach().cpu().numpy().reshape(-1,1))
-                        dones_off.append(dones[index].clone().detach().cpu().numpy().reshape(-1,1)*1.0)
+                    if it <= collect_until:
+                        index = torch.randint(0, self.vec_env.num_envs, (num_collect_envs,), device=self.device)
+                        writer.add(current_obs[index], actions[index].clamp(-max_action, max_action), next_obs[index],
+                                   rews[index], dones[index].float())
 
                     next_states = self.vec_env.get_state()
                     # Record the transition
@@ -220,17 +207,8 @@ class PPO:
                         cur_reward_sum[new_ids] = 0
                         cur_episode_length[new_ids] = 0
 
-                if it == int(num_learning_iterations/2):
-                    states_off = np.vstack(states_off)
-                    next_states_off = np.vstack(next_states_off)
-                    actions_off = np.vstack(actions_off)
-                    rewards_off = np.vstack(rewards_off)
-                    dones_off = np.vstack(dones_off)
-                    np.save(self.log_dir+'/states.npy',states_off)
-                    np.save(self.log_dir+'/next_states.npy',next_states_off)
-                    np.save(self.log_dir+'/actions.npy',actions_off)
-                    np.save(self.log_dir+'/rewards.npy',rewards_off)
-                    np.save(self.log_dir+'/dones.npy',dones_off)
+                if it == collect_until:
+                    writer.close()
 
                 if self.print_log:
 
@@ -322,27 +300,25 @@ class PPO:
         print(log_string)
 
     def update(self):
-        mean_value_loss = 0
-        mean_surrogate_loss = 0
+        #* losses accumulate on device and are read back once at the end, no host sync per minibatch
+        mean_value_loss = torch.zeros((), device=self.device)
+        mean_surrogate_loss = torch.zeros((), device=self.device)
 
-        batch = self.storage.mini_batch_generator(self.num_mini_batches)
         for epoch in range(self.num_learning_epochs):
-            # for obs_batch, actions_batch, target_values_batch, advantages_batch, returns_batch, old_actions_log_prob_batch \
-            #        in self.storage.mini_batch_generator(self.num_mini_batches):
-
-            for indices in batch:
-                obs_batch = self.storage.observations.view(-1, *self.storage.observations.size()[2:])[indices]
+            for indices in self.storage.mini_batch_generator(self.num_mini_batches):
+                mini_batch = self.storage.get_mini_batch(indices)
+                obs_batch = mini_batch['observations']
                 if self.asymmetric:
-                    states_batch = self.storage.states.view(-1, *self.storage.states.size()[2:])[indices]
+                    states_batch = mini_batch['states']
                 else:
                     states_batch = None
-                actions_batch = self.storage.actions.view(-1, self.storage.actions.size(-1))[indices]
-                target_values_batch = self.storage.values.view(-1, 1)[indices]
-                returns_batch = self.storage.returns.view(-1, 1)[indices]
-                old_actions_log_prob_batch = self.storage.actions_log_prob.view(-1, 1)[indices]
-                advantages_batch = self.storage.advantages.view(-1, 1)[indices]
-                old_mu_batch = self.storage.mu.view(-1, self.storage.actions.size(-1))[indices]
-                old_sigma_batch = self.storage.sigma.view(-1, self.storage.actions.size(-1))[indices]
+                actions_batch = mini_batch['actions']
+                target_values_batch = mini_batch['values']
+                returns_batch = mini_batch['returns']
+                old_actions_log_prob_batch = mini_batch['actions_log_prob']
+                advantages_batch = mini_batch['advantages']
+                old_mu_batch = mini_batch['mu']
+                old_sigma_batch = mini_batch['sigma']
 
                 actions_log_prob_batch, entropy_batch, value_batch, mu_batch, sigma_batch = self.actor_critic.evaluate(obs_batch,
                                                                                                                        states_batch,
@@ -388,11 +364,10 @@ class PPO:
                 nn.utils.clip_grad_norm_(self.actor_critic.parameters(), self.max_grad_norm)
                 self.optimizer.step()
 
-                mean_value_loss += value_loss.item()
-                mean_surrogate_loss += surrogate_loss.item()
+                mean_value_loss += value_loss.detach()
+                mean_surrogate_loss += surrogate_loss.detach()
 
         num_updates = self.num_learning_epochs * self.num_mini_batches
-        mean_value_loss /= num_updates
-        mean_surrogate_loss /= num_updates
+        mean_value_loss, mean_surrogate_loss = (torch.stack([mean_value_loss, mean_surrogate_loss]) / num_updates).tolist()
 
         return mean_value_loss, mean_surrogate_loss
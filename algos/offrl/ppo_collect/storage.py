@@ -1,87 +1,262 @@
+import os
+import tempfile
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import torch
-from torch.utils.data.sampler import BatchSampler, SequentialSampler, SubsetRandomSampler
+
+from algos.utils.util import compute_gae
 
 
 class RolloutStorage:
 
-    def __init__(self, num_envs, num_transitions_per_env, obs_shape, states_shape, actions_shape, device='cpu', sampler='sequential'):
+    def __init__(self, num_envs, num_transitions_per_env, obs_shape, states_shape, actions_shape, device='cpu', sampler='sequential',
+                 store_states=True, constant_sigma=False, input_dtype=torch.float32):
+        """
+        Args:
+            store_states: allocate the critic states, not needed if the policy is not asymmetric
+            constant_sigma: sigma is the same for all steps and envs of a rollout (`log_std` repeated), store it once
+            input_dtype: dtype of the stored observations, states and actions, e.g. torch.bfloat16 or torch.float16,
+                upcast to float32 in `get_mini_batch`
+        """
 
         self.device = device
         self.sampler = sampler
 
         # Core
-        self.observations = torch.zeros(num_transitions_per_env, num_envs, *obs_shape, device=self.device)
-        self.states = torch.zeros(num_transitions_per_env, num_envs, *states_shape, device=self.device)
-        self.rewards = torch.zeros(num_transitions_per_env, num_envs, 1, device=self.device)
-        self.actions = torch.zeros(num_transitions_per_env, num_envs, *actions_shape, device=self.device)
-        self.dones = torch.zeros(num_transitions_per_env, num_envs, 1, device=self.device).byte()
-
-        # For PPO
-        self.actions_log_prob = torch.zeros(num_transitions_per_env, num_envs, 1, device=self.device)
-        self.values = torch.zeros(num_transitions_per_env, num_envs, 1, device=self.device)
-        self.returns = torch.zeros(num_transitions_per_env, num_envs, 1, device=self.device)
-        self.advantages = torch.zeros(num_transitions_per_env, num_envs, 1, device=self.device)
-        self.mu = torch.zeros(num_transitions_per_env, num_envs, *actions_shape, device=self.device)
-        self.sigma = torch.zeros(num_transitions_per_env, num_envs, *actions_shape, device=self.device)
+        self.rewards = self._allocate((num_transitions_per_env, num_envs, 1), torch.float32)
+        self.dones = self._allocate((num_transitions_per_env, num_envs, 1), torch.uint8)
+
+        #* every field read by the PPO update lives in one packed [T, N, F] buffer per dtype, the attributes below
+        #* are views over column ranges of it so that a minibatch is fetched with a single gather per buffer
+        self.fields = {
+            'observations': (obs_shape, input_dtype),
+            'states': (states_shape, input_dtype),
+            'actions': (actions_shape, input_dtype),
+            'values': ((1,), torch.float32),
+            'returns': ((1,), torch.float32),
+            'advantages': ((1,), torch.float32),
+            'actions_log_prob': ((1,), torch.float32),
+            'mu': (actions_shape, torch.float32),
+            'sigma': (actions_shape, torch.float32),
+        }
+        if not store_states:
+            del self.fields['states']
+            self.states = None
+        if constant_sigma:
+            del self.fields['sigma']
+            self.sigma = self._allocate(actions_shape, torch.float32)
+        self.constant_sigma = constant_sigma
+
+        self.field_slices = {}
+        widths = {}
+        for name, (shape, dtype) in self.fields.items():
+            size = int(np.prod(shape))
+            offset = widths.get(dtype, 0)
+            self.field_slices[name] = slice(offset, offset + size)
+            widths[dtype] = offset + size
+        self.packed = {dtype: self._allocate((num_transitions_per_env, num_envs, width), dtype)
+                       for dtype, width in widths.items()}
+        for name, (shape, dtype) in self.fields.items():
+            view = self.packed[dtype][..., self.field_slices[name]].view(num_transitions_per_env, num_envs, *shape)
+            setattr(self, name, view)
 
         self.num_transitions_per_env = num_transitions_per_env
         self.num_envs = num_envs
 
         self.step = 0
 
+    def _allocate(self, shape, dtype):
+        return torch.zeros(*shape, dtype=dtype, device=self.device)
+
     def add_transitions(self, observations, states, actions, rewards, dones, values, actions_log_prob, mu, sigma):
         if self.step >= self.num_transitions_per_env:
             raise AssertionError("Rollout buffer overflow")
 
         self.observations[self.step].copy_(observations)
-        self.states[self.step].copy_(states)
+        if self.states is not None:
+            self.states[self.step].copy_(states)
         self.actions[self.step].copy_(actions)
         self.rewards[self.step].copy_(rewards.view(-1, 1))
         self.dones[self.step].copy_(dones.view(-1, 1))
         self.values[self.step].copy_(values)
         self.actions_log_prob[self.step].copy_(actions_log_prob.view(-1, 1))
         self.mu[self.step].copy_(mu)
-        self.sigma[self.step].copy_(sigma)
+        if not self.constant_sigma:
+            self.sigma[self.step].copy_(sigma)
+        elif self.step == 0:
+            self.sigma.copy_(sigma[0])
 
         self.step += 1
 
     def clear(self):
         self.step = 0
 
+    def share_memory_(self):
+        """ Move all buffers to shared memory, so that a storage sent to another process is written in place
+        """
+        for buffer in list(self.packed.values()) + [self.rewards, self.dones]:
+            buffer.share_memory_()
+        if self.constant_sigma:
+            self.sigma.share_memory_()
+        return self
+
     def compute_returns(self, last_values, gamma, lam):
-        advantage = 0
-        for step in reversed(range(self.num_transitions_per_env)):
-            if step == self.num_transitions_per_env - 1:
-                next_values = last_values
-            else:
-                next_values = self.values[step + 1]
-            next_is_not_terminal = 1.0 - self.dones[step].float()
-            delta = self.rewards[step] + next_is_not_terminal * gamma * next_values - self.values[step]
-            advantage = delta + next_is_not_terminal * gamma * lam * advantage
-            self.returns[step] = advantage + self.values[step]
-
-        # Compute and normalize the advantages
-        self.advantages = self.returns - self.values
-        self.advantages = (self.advantages - self.advantages.mean()) / (self.advantages.std() + 1e-8)
+        compute_gae(self.values, self.rewards, self.dones, last_values, gamma, lam,
+                    returns=self.returns, advantages=self.advantages)
+
+        # Normalize the advantages
+        self.advantages.sub_(self.advantages.mean()).div_(self.advantages.std() + 1e-8)
 
     def get_statistics(self):
-        done = self.dones.cpu()
-        done[-1] = 1
-        flat_dones = done.permute(1, 0, 2).reshape(-1, 1)
-        done_indices = torch.cat((flat_dones.new_tensor([-1], dtype=torch.int64), flat_dones.nonzero(as_tuple=False)[:, 0]))
-        trajectory_lengths = (done_indices[1:] - done_indices[:-1])
-        return trajectory_lengths.float().mean(), self.rewards.mean()
+        #* the last step of every env closes a trajectory segment, so the mean segment length is
+        #* the number of transitions over the number of segments, computed on device
+        num_segments = torch.count_nonzero(self.dones[:-1]) + self.num_envs
+        return self.num_transitions_per_env * self.num_envs / num_segments, self.rewards.mean()
 
     def mini_batch_generator(self, num_mini_batches):
+        """ Yield the minibatch indices of one epoch over the flattened [T * N] transitions,
+            slices for the sequential sampler and a device-side permutation for the random one
+        """
         batch_size = self.num_envs * self.num_transitions_per_env
         mini_batch_size = batch_size // num_mini_batches
 
         if self.sampler == "sequential":
             # For physics-based RL, each environment is already randomized. There is no value to doing random sampling
             # but a lot of CPU overhead during the PPO process. So, we can just switch to a sequential sampler instead
-            subset = SequentialSampler(range(batch_size))
+            for i in range(num_mini_batches):
+                yield slice(i * mini_batch_size, (i + 1) * mini_batch_size)
         elif self.sampler == "random":
-            subset = SubsetRandomSampler(range(batch_size))
+            indices = torch.randperm(batch_size, device=self.device)
+            yield from indices[:num_mini_batches * mini_batch_size].view(num_mini_batches, mini_batch_size)
+        else:
+            raise NotImplementedError(f"Unsupported sampler: {self.sampler}")
+
+    def get_mini_batch(self, indices):
+        """ Fetch all fields of a minibatch with one gather per packed buffer (a plain view for slices)
+
+        Args:
+            indices: slice or index tensor over the flattened [T * N] transitions
+
+        Return:
+            A dict mapping each field name to a float32 [B, *field_shape] tensor
+        """
+        batches = self._gather(indices)
+        mini_batch = {}
+        for name, (shape, dtype) in self.fields.items():
+            batch = batches[dtype]
+            mini_batch[name] = batch[:, self.field_slices[name]].view(batch.size(0), *shape).float()
+        if self.constant_sigma:
+            mini_batch['sigma'] = self.sigma.to(batch.device).expand(batch.size(0), *self.sigma.shape)
+        return mini_batch
+
+    def _gather(self, indices):
+        """ Rows of every packed buffer for the minibatch indices, keyed by dtype
+        """
+        return {dtype: packed.view(-1, packed.size(-1))[indices] for dtype, packed in self.packed.items()}
+
+
+class HostRolloutStorage(RolloutStorage):
+    """ `RolloutStorage` kept in host memory for rollouts that do not fit on the learning device.
+
+    The buffers are pinned (if CUDA is available) or memory-mapped from a file in `mmap_dir`. The inputs of
+    `add_transitions` are copied from the learning device and returns / advantages are computed on the host.
+    `mini_batch_generator` gathers and copies the next minibatch to the learning device in a background
+    thread while the current one is used, `get_mini_batch` returns tensors on the learning device.
+    """
+
+    def __init__(self, num_envs, num_transitions_per_env, obs_shape, states_shape, actions_shape, device='cpu', sampler='sequential',
+                 store_states=True, constant_sigma=False, input_dtype=torch.float32, pin_memory=True, mmap_dir=None, prefetch=True):
+        """
+        Args:
+            device: learning device the minibatches are streamed to, the storage itself stays on the host
+            pin_memory: page-lock the buffers for asynchronous copies, ignored without CUDA or with `mmap_dir`
+            mmap_dir: back the buffers with (unlinked) files in this directory instead of RAM
+            prefetch: copy the next minibatch in a background thread while the current one is used
+        """
+        self.learn_device = torch.device(device)
+        self.mmap_dir = mmap_dir
+        self.pin_memory = pin_memory and mmap_dir is None and torch.cuda.is_available()
+        self.prefetch = prefetch
+        self._executor = None
+        self._stream = None
+        self._staging = None
+        self._staging_size = 0
+        self._prefetched = None
+        super().__init__(num_envs, num_transitions_per_env, obs_shape, states_shape, actions_shape, 'cpu', sampler,
+                         store_states=store_states, constant_sigma=constant_sigma, input_dtype=input_dtype)
+
+    def _allocate(self, shape, dtype):
+        if self.mmap_dir is not None:
+            #* the file is unlinked right away, its pages are released with the tensor
+            fd, path = tempfile.mkstemp(suffix='.rollout', dir=self.mmap_dir)
+            os.close(fd)
+            try:
+                return torch.from_file(path, shared=True, size=int(np.prod(shape)), dtype=dtype).view(*shape)
+            finally:
+                os.unlink(path)
+        return torch.zeros(*shape, dtype=dtype, pin_memory=self.pin_memory)
+
+    def compute_returns(self, last_values, gamma, lam):
+        super().compute_returns(last_values.to(self.device), gamma, lam)
+
+    def mini_batch_generator(self, num_mini_batches):
+        """ Same minibatch indices as `RolloutStorage`, the minibatch after the yielded one is already being copied
+        """
+        if not self.prefetch:
+            yield from super().mini_batch_generator(num_mini_batches)
+            return
+
+        all_indices = list(super().mini_batch_generator(num_mini_batches))
+        if not all_indices:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rollout-prefetch')
+            if self.learn_device.type == 'cuda':
+                self._stream = torch.cuda.Stream(self.learn_device)
+        mini_batch_size = (self.num_envs * self.num_transitions_per_env) // num_mini_batches
+        if self._staging_size != mini_batch_size:
+            #* two staging buffers, one being consumed and one being filled
+            self._staging = [{dtype: torch.empty(mini_batch_size, packed.size(-1), dtype=dtype, pin_memory=self.pin_memory)
+                              for dtype, packed in self.packed.items()} for _ in range(2)]
+            self._staging_size = mini_batch_size
+        consumer_stream = torch.cuda.current_stream(self.learn_device) if self._stream is not None else None
+
+        future = self._executor.submit(self._fetch, all_indices[0], self._staging[0], consumer_stream)
+        try:
+            for i, indices in enumerate(all_indices):
+                self._prefetched = (indices, future)
+                if i + 1 < len(all_indices):
+                    #* the staging buffer of minibatch i - 1 is free, the caller is done with it
+                    future = self._executor.submit(self._fetch, all_indices[i + 1], self._staging[(i + 1) % 2], consumer_stream)
+                yield indices
+        finally:
+            future.result()
+            self._prefetched = None
+
+    def _fetch(self, indices, staging=None, consumer_stream=None):
+        """ Gather the minibatch rows on the host (into `staging` if given) and copy them to the learning device
+        """
+        stream = self._stream if consumer_stream is not None else None
+        with torch.cuda.stream(stream) if stream is not None else nullcontext():
+            batches = {}
+            for dtype, packed in self.packed.items():
+                flat = packed.view(-1, packed.size(-1))
+                if isinstance(indices, slice):
+                    host = flat[indices]
+                elif staging is not None:
+                    host = torch.index_select(flat, 0, indices, out=staging[dtype][:indices.numel()])
+                else:
+                    host = flat[indices]
+                batches[dtype] = host.to(self.learn_device, non_blocking=self.pin_memory)
+        if stream is not None:
+            stream.synchronize()
+            for batch in batches.values():
+                batch.record_stream(consumer_stream)
+        return batches
 
-        batch = BatchSampler(subset, mini_batch_size, drop_last=True)
-        return batch
+    def _gather(self, indices):
+        if self._prefetched is not None and self._prefetched[0] is indices:
+            return self._prefetched[1].result()
+        return self._fetch(indices)
@@ -1,3 +1,3 @@
-from .storage import ReplayBuffer
+from algos.utils.replay_buffer import ReplayBuffer
 from .module import TD3_BC_Model
 from .td3_bc import TD3_BC
\ No newline at end of file
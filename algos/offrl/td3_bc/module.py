@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from algos.utils.ensemble import EnsembleMLP, soft_update
+
 class Actor(nn.Module):
 	def __init__(self, state_dim, action_dim, max_action):
 		super(Actor, self).__init__()
@@ -25,35 +27,17 @@ class Critic(nn.Module):
 	def __init__(self, state_dim, action_dim):
 		super(Critic, self).__init__()
 
-		self.l1 = nn.Linear(state_dim + action_dim, 256)
-		self.l2 = nn.Linear(256, 256)
-		self.l3 = nn.Linear(256, 1)
-
-		self.l4 = nn.Linear(state_dim + action_dim, 256)
-		self.l5 = nn.Linear(256, 256)
-		self.l6 = nn.Linear(256, 1)
+		#* both Q heads, evaluated with one batched matmul per layer
+		self.q = EnsembleMLP(2, state_dim + action_dim, [256, 256], 1)
 
 
 	def forward(self, state, action):
-		sa = torch.cat([state, action], 1)
-
-		q1 = F.relu(self.l1(sa))
-		q1 = F.relu(self.l2(q1))
-		q1 = self.l3(q1)
-
-		q2 = F.relu(self.l4(sa))
-		q2 = F.relu(self.l5(q2))
-		q2 = self.l6(q2)
+		q1, q2 = self.q(torch.cat([state, action], 1))
 		return q1, q2
 
 
 	def Q1(self, state, action):
-		sa = torch.cat([state, action], 1)
-
-		q1 = F.relu(self.l1(sa))
-		q1 = F.relu(self.l2(q1))
-		q1 = self.l3(q1)
-		return q1
+		return self.q(torch.cat([state, action], 1), members=slice(0, 1))[0]
 
 
 class TD3_BC_Model(object):
@@ -131,9 +115,5 @@ class TD3_BC_Model(object):
 				actor_loss.backward()
 				self.actor_optimizer.step()
 
-				for param, target_param in zip(self.critic.parameters(), self.critic_target.parameters()):
-					target_param.data.copy_(self.tau * param.data + (1 - self.tau) * target_param.data)
-
-				for param, target_param in zip(self.actor.parameters(), self.actor_target.parameters()):
-					target_param.data.copy_(self.tau * param.data + (1 - self.tau) * target_param.data)
+				soft_update([self.critic_target, self.actor_target], [self.critic, self.actor], self.tau)
 
@@ -6,8 +6,8 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 
-from bidexhands.algorithms.offrl.td3_bc import TD3_BC_Model
-from bidexhands.algorithms.offrl.td3_bc import ReplayBuffer
+from algos.offrl.td3_bc.module import TD3_BC_Model
+from algos.utils.replay_buffer import ReplayBuffer
 
 class TD3_BC:
 
@@ -7,6 +7,7 @@ from tqdm import tqdm
 from isaacgym import gymapi
 from scipy.spatial.transform import Rotation
 from scipy.spatial.transform import Slerp
+from algos.utils.trajectory import load_trajectory
 
 class APPROACH:
     def __init__(self, vec_env, cfg, save_goal=False, save_video=False):
@@ -15,7 +16,7 @@ class APPROACH:
         self.traj_path = cfg['traj_path']
         self.traj_basedir = os.path.dirname(self.traj_path)
         self.traj_name = os.path.basename(self.traj_path).split('.')[0][7:]
-        self.dummy_traj = pickle.load(open(self.traj_path, 'rb'))['trajectory']
+        self.dummy_traj = load_trajectory(self.traj_path)
         self.save_goal = save_goal
         self.save_video = save_video
         self.FSM_STATE = 'FREE'  ## StateDict: {'FREE', 'APPROACH', 'ATTACH'}
@@ -4,6 +4,7 @@ import numpy as np
 from isaacgym import gymapi
 from scipy.spatial.transform import Rotation
 from scipy.spatial.transform import Slerp
+from algos.utils.trajectory import load_trajectory
 
 class BASE:
     def __init__(self, vec_env, cfg, ):
@@ -12,7 +13,7 @@ class BASE:
         self.traj_path = cfg['traj_path']
         self.traj_basedir = os.path.dirname(self.traj_path)
         self.traj_name = os.path.basename(self.traj_path).split('.')[0][7:]
-        self.dummy_traj = pickle.load(open(self.traj_path, 'rb'))['trajectory']
+        self.dummy_traj = load_trajectory(self.traj_path)
 
     def transfer(self, env_id=0):
         if self.env_name in ['frankakitchen_v1@gripper_open_hingecabinet_left', 'frankakitchen_v1@gripper_close_hingecabinet_left', 
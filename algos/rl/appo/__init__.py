@@ -0,0 +1,2 @@
+from .cpu_env import CpuVecEnv
+from .appo import APPO
@@ -0,0 +1,345 @@
+import os
+import time
+import queue
+import traceback
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+from algos.rl.ppo import PPO
+from algos.rl.ppo import RolloutStorage
+from algos.rl.ppo import ActorCritic
+from algos.utils.util import compute_vtrace, EpisodeTracker, InfoAccumulator
+
+
+class EnvSpec:
+    """ Spaces and total number of envs of the rollout workers, stands in for the vec env in `PPO.__init__`
+    """
+    def __init__(self, observation_space, state_space, action_space, num_envs):
+        self.observation_space = observation_space
+        self.state_space = state_space
+        self.action_space = action_space
+        self.num_envs = num_envs
+
+
+class WorkerEpisodeStatistics:
+    """ Latest `EpisodeTracker.statistics` of every rollout worker, merged into one
+    """
+    def __init__(self):
+        self.latest = {}
+
+    def update(self, worker_id, statistics):
+        self.latest[worker_id] = statistics
+
+    def statistics(self):
+        count = sum(stats[0] for stats in self.latest.values())
+        if count == 0:
+            return 0, 0., 0.
+        mean_reward = sum(stats[0] * stats[1] for stats in self.latest.values()) / count
+        mean_length = sum(stats[0] * stats[2] for stats in self.latest.values()) / count
+        return count, mean_reward, mean_length
+
+
+def rollout_worker(worker_id, env_fn, cfg_train, command_queue, ready_queue, version):
+    """ Rollout loop of an APPO worker process.
+
+    Builds its own vec env, reports the spaces, then receives the shared policy weights and its two
+    shared-memory rollout slots. Every slot index received on `command_queue` is filled with `nsteps`
+    transitions of the latest published policy and handed back on `ready_queue`; `None` stops the worker.
+
+    Args:
+        worker_id: index of the worker
+        env_fn: picklable callable, `env_fn(worker_id)` returns the vec env of the worker
+        cfg_train: algo config, used for the policy of the worker
+        command_queue: queue of the worker, receives the shared state and then the free slot indices
+        ready_queue: queue shared by all workers, receives the specs, finished rollouts and errors
+        version: shared counter of the published policy weights, its lock guards the weights
+    """
+    try:
+        env = env_fn(worker_id)
+        ready_queue.put(('spec', worker_id, (env.observation_space, env.state_space, env.action_space, env.num_envs)))
+        shared = command_queue.get()
+        if shared is None:
+            return
+        params, slots, asymmetric = shared
+
+        device = getattr(env, 'rl_device', 'cpu')
+        actor_critic = ActorCritic(env.observation_space.shape, env.state_space.shape, env.action_space.shape,
+                                   cfg_train["learn"].get("init_noise_std", 0.3), cfg_train["policy"], asymmetric=asymmetric)
+        actor_critic.to(device)
+        actor_critic.eval()
+        policy_version = -1
+
+        current_obs = env.reset()
+        current_states = env.get_state()
+        episode_tracker = EpisodeTracker(env.num_envs, capacity=100, device=device)
+        ep_infos = InfoAccumulator(device=device)
+        while True:
+            slot = command_queue.get()
+            if slot is None:
+                return
+            # Fetch the latest weights, the lock keeps the learner from publishing during the copy
+            with version.get_lock():
+                if version.value != policy_version:
+                    vector_to_parameters(params.to(device, copy=True), actor_critic.parameters())
+                    policy_version = version.value
+
+            storage = slots[slot]['storage']
+            storage.clear()
+            with torch.no_grad():
+                for _ in range(storage.num_transitions_per_env):
+                    actions, actions_log_prob, values, mu, sigma = actor_critic.act(current_obs, current_states)
+                    next_obs, rews, dones, infos = env.step(actions)
+                    next_states = env.get_state()
+                    storage.add_transitions(current_obs, current_states, actions, rews, dones, values, actions_log_prob, mu, sigma)
+                    current_obs.copy_(next_obs)
+                    current_states.copy_(next_states)
+                    ep_infos.add(infos)
+                    episode_tracker.step(rews, dones)
+            slots[slot]['last_observations'].copy_(current_obs)
+            slots[slot]['last_states'].copy_(current_states)
+
+            ep_means, _ = ep_infos.statistics()
+            ep_infos.clear()
+            ready_queue.put(('rollout', worker_id, (slot, policy_version, episode_tracker.statistics(), ep_means)))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        ready_queue.put(('error', worker_id, traceback.format_exc()))
+    finally:
+        ready_queue.cancel_join_thread()
+
+
+class APPO(PPO):
+    """ Asynchronous actor-learner PPO.
+
+    `num_workers` rollout processes each own a vec env built by `env_fn` and write into a shared-memory
+    `RolloutStorage` double buffer, so the simulators keep stepping while the learner updates. The learner
+    gathers `rollouts_per_update` finished rollouts into its own storage, publishes the new weights after
+    every update, and drops rollouts of a policy more than `max_policy_lag` updates old. The remaining
+    off-policyness is corrected with V-trace targets (`correction: vtrace`) or left to the PPO clip with
+    the behaviour log-probabilities (`correction: ppo`); in both cases the values are re-evaluated by the
+    learner's critic.
+    """
+    def __init__(self,
+                 env_fn,
+                 cfg_train,
+                 device='cpu',
+                 sampler='sequential',
+                 log_dir='run',
+                 print_log=True,
+                 asymmetric=None
+                 ):
+        learn_cfg = cfg_train["learn"]
+        self.num_workers = learn_cfg.get("num_workers", 2)
+        self.rollouts_per_update = learn_cfg.get("rollouts_per_update", self.num_workers)
+        self.max_policy_lag = learn_cfg.get("max_policy_lag", 1)
+        self.correction = learn_cfg.get("correction", "vtrace")
+        if self.correction not in ('vtrace', 'ppo'):
+            raise NotImplementedError(f"Unsupported correction: {self.correction}")
+        self.rho_bar = learn_cfg.get("vtrace_rho_bar", 1.0)
+        self.c_bar = learn_cfg.get("vtrace_c_bar", 1.0)
+        self.worker_timeout = learn_cfg.get("worker_timeout", 600)
+
+        # Rollout workers, spawned since the envs and CUDA can not be forked
+        ctx = mp.get_context('spawn')
+        self.ready_queue = ctx.Queue()
+        self.command_queues = [ctx.Queue() for _ in range(self.num_workers)]
+        self.version = ctx.Value('l', 0)
+        self.workers = [ctx.Process(target=rollout_worker, name=f'appo-worker-{worker_id}', daemon=True,
+                                    args=(worker_id, env_fn, cfg_train, self.command_queues[worker_id], self.ready_queue, self.version))
+                        for worker_id in range(self.num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+        specs = {}
+        while len(specs) < self.num_workers:
+            _, worker_id, spec = self._receive()
+            specs[worker_id] = spec
+        observation_space, state_space, action_space, num_envs = specs[0]
+        for worker_id, (obs_space, st_space, act_space, n) in specs.items():
+            if (obs_space.shape, st_space.shape, act_space.shape, n) != (observation_space.shape, state_space.shape, action_space.shape, num_envs):
+                raise ValueError(f"Rollout worker {worker_id} has different spaces or number of envs than worker 0")
+        self.worker_num_envs = num_envs
+        if asymmetric is None:
+            asymmetric = int(np.prod(state_space.shape)) > 0
+
+        super().__init__(EnvSpec(observation_space, state_space, action_space, num_envs * self.rollouts_per_update),
+                         cfg_train, device=device, sampler=sampler, log_dir=log_dir, is_testing=False,
+                         print_log=print_log, apply_reset=False, asymmetric=asymmetric)
+
+        # Shared state: flat policy weights and two rollout slots per worker with the same layout as self.storage
+        self.params = parameters_to_vector(self.actor_critic.parameters()).detach().cpu().share_memory_()
+        self.policy_version = 0
+        self.slots = [[self._make_slot() for _ in range(2)] for _ in range(self.num_workers)]
+        self.last_observations = torch.zeros(self.vec_env.num_envs, *self.observation_space.shape, device=self.device)
+        self.last_states = torch.zeros(self.vec_env.num_envs, *self.state_space.shape, device=self.device)
+        for command_queue, slots in zip(self.command_queues, self.slots):
+            command_queue.put((self.params, slots, asymmetric))
+            command_queue.put(0)
+            command_queue.put(1)
+
+    def _make_slot(self):
+        storage = RolloutStorage(self.worker_num_envs, self.num_transitions_per_env, self.observation_space.shape,
+                                 self.state_space.shape, self.action_space.shape, 'cpu',
+                                 store_states=self.storage.states is not None,
+                                 constant_sigma=self.storage.constant_sigma,
+                                 input_dtype=self.storage.fields['observations'][1])
+        return {
+            'storage': storage.share_memory_(),
+            'last_observations': torch.zeros(self.worker_num_envs, *self.observation_space.shape).share_memory_(),
+            'last_states': torch.zeros(self.worker_num_envs, *self.state_space.shape).share_memory_(),
+        }
+
+    def _receive(self):
+        """ Next message of the workers, raises if a worker failed, died or stalled
+        """
+        waited = 0
+        while True:
+            try:
+                kind, worker_id, payload = self.ready_queue.get(timeout=1.0)
+            except queue.Empty:
+                waited += 1
+                for worker_id, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        raise RuntimeError(f"Rollout worker {worker_id} exited with code {worker.exitcode}")
+                if waited > self.worker_timeout:
+                    raise RuntimeError(f"No rollout received for {self.worker_timeout}s")
+                continue
+            if kind == 'error':
+                raise RuntimeError(f"Rollout worker {worker_id} failed:\n{payload}")
+            return kind, worker_id, payload
+
+    def publish_weights(self):
+        """ Copy the learner's weights to the shared vector and bump the policy version
+        """
+        flat_params = parameters_to_vector(self.actor_critic.parameters()).detach().cpu()
+        with self.version.get_lock():
+            self.params.copy_(flat_params)
+            self.version.value += 1
+            self.policy_version = self.version.value
+
+    def load(self, path):
+        super().load(path)
+        self.publish_weights()
+
+    def test(self, path):
+        raise NotImplementedError("APPO only supports training, test the checkpoint with PPO")
+
+    def gather_rollout(self, index, slot):
+        """ Copy a finished worker rollout into the env columns [index * n, (index + 1) * n) of self.storage.
+            The copies are blocking since the slot is handed back to the worker right after.
+        """
+        envs = slice(index * self.worker_num_envs, (index + 1) * self.worker_num_envs)
+        rollout = slot['storage']
+        for dtype, packed in rollout.packed.items():
+            self.storage.packed[dtype][:, envs].copy_(packed)
+        self.storage.rewards[:, envs].copy_(rollout.rewards)
+        self.storage.dones[:, envs].copy_(rollout.dones)
+        if self.storage.constant_sigma:
+            self.storage.sigma.copy_(rollout.sigma)
+        self.last_observations[envs].copy_(slot['last_observations'])
+        self.last_states[envs].copy_(slot['last_states'])
+
+    def compute_targets(self):
+        """ Re-evaluate the gathered rollouts with the learner's policy, then compute the value targets and
+            normalized advantages with V-trace, or with GAE for the PPO-clip correction
+        """
+        storage = self.storage
+        storage.step = self.num_transitions_per_env
+        batch_size = self.num_transitions_per_env * self.vec_env.num_envs
+        chunk_size = -(-batch_size // self.num_mini_batches)
+        log_rhos = torch.zeros_like(storage.rewards)
+        with torch.no_grad():
+            for begin in range(0, batch_size, chunk_size):
+                indices = slice(begin, min(begin + chunk_size, batch_size))
+                mini_batch = storage.get_mini_batch(indices)
+                actions_log_prob, _, values, _, _ = self.actor_critic.evaluate(
+                    mini_batch['observations'], mini_batch['states'] if self.asymmetric else None, mini_batch['actions'])
+                log_rhos.view(-1)[indices] = actions_log_prob - mini_batch['actions_log_prob'].view(-1)
+                storage.values.view(-1, 1)[indices] = values
+            _, _, last_values, _, _ = self.actor_critic.act(self.last_observations, self.last_states)
+
+        if self.correction == 'vtrace':
+            vs, advantages = compute_vtrace(storage.values, storage.rewards, storage.dones, last_values, log_rhos,
+                                            self.gamma, self.lam, self.rho_bar, self.c_bar)
+            storage.returns.copy_(vs)
+            storage.advantages.copy_(advantages)
+            storage.advantages.sub_(storage.advantages.mean()).div_(storage.advantages.std() + 1e-8)
+        else:
+            storage.compute_returns(last_values, self.gamma, self.lam)
+
+    def run(self, num_learning_iterations, log_interval=1):
+        try:
+            self._run(num_learning_iterations, log_interval)
+        finally:
+            self.close()
+
+    def _run(self, num_learning_iterations, log_interval):
+        episode_tracker = WorkerEpisodeStatistics()
+        ep_infos = InfoAccumulator(device=self.device)
+        best_mean_reward = -np.inf
+        for it in range(self.current_learning_iteration, num_learning_iterations):
+            start = time.time()
+
+            # Gather rollouts, the workers keep stepping into their other slot meanwhile
+            policy_lags = []
+            num_dropped = 0
+            while len(policy_lags) < self.rollouts_per_update:
+                _, worker_id, (slot, policy_version, episode_statistics, ep_means) = self._receive()
+                episode_tracker.update(worker_id, episode_statistics)
+                ep_infos.add({key: torch.tensor(value) for key, value in ep_means.items()})
+                policy_lag = self.policy_version - policy_version
+                if policy_lag > self.max_policy_lag:
+                    num_dropped += 1
+                else:
+                    self.gather_rollout(len(policy_lags), self.slots[worker_id][slot])
+                    policy_lags.append(policy_lag)
+                self.command_queues[worker_id].put(slot)
+            stop = time.time()
+            collection_time = stop - start
+
+            mean_trajectory_length, mean_reward = self.storage.get_statistics()
+
+            # only save ckpt when mean reward is better
+            if mean_reward > best_mean_reward:
+                best_mean_reward = mean_reward
+                self.save_async(os.path.join(self.log_dir, 'model_best.pt'))
+            if it % (log_interval) == 0:
+                self.save_async(os.path.join(self.log_dir, 'model_{}.pt'.format(it)))
+
+            # Learning step
+            start = stop
+            self.compute_targets()
+            mean_value_loss, mean_surrogate_loss, mean_gradient_norm, mean_gradient_norm_clip, mean_learning_rate = self.update()
+            self.storage.clear()
+            self.publish_weights()
+            stop = time.time()
+            learn_time = stop - start
+            mean_policy_lag = float(np.mean(policy_lags))
+            if self.print_log:
+                self.log(locals())
+
+            ep_infos.clear()
+        self.save_async(os.path.join(self.log_dir, 'model_{}.pt'.format(num_learning_iterations)))
+        self.io_writer.flush()
+
+    def log(self, locs, width=80, pad=35):
+        self.io_writer.add_scalar('Async/mean_policy_lag', locs['mean_policy_lag'], locs['it'])
+        self.io_writer.add_scalar('Async/dropped_rollouts', locs['num_dropped'], locs['it'])
+        self.io_writer.add_scalar('Async/wait_time', locs['collection_time'], locs['it'])
+        self.io_writer.add_scalar('Async/learn_time', locs['learn_time'], locs['it'])
+        super().log(locs, width, pad)
+        print(f"""{'Mean policy lag:':>{pad}} {locs['mean_policy_lag']:.2f} ({locs['num_dropped']} stale rollouts dropped)\n""")
+
+    def close(self):
+        """ Stop the rollout workers
+        """
+        for command_queue in self.command_queues:
+            command_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
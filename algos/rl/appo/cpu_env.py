@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+import torch
+from gym import spaces
+
+
+class CpuVecEnv():
+    """ Pure-CPU stand-in for `VecTask`, a batch of point masses that have to reach a random goal.
+
+    Exposes the subset of the `VecTask` interface used by the PPO trainers (spaces, `num_envs`,
+    `reset`, `step`, `get_state`), so the trainers can be run and profiled without a simulator.
+    `step_time` adds a fixed sleep per step to emulate the cost of a physics step.
+    """
+    def __init__(self, num_envs=64, dim=2, max_episode_length=100, goal_radius=0.05, step_time=0., seed=0, rl_device='cpu'):
+        """
+        Args:
+            num_envs: number of parallel envs
+            dim: dimension of the point mass, observations are [position, goal], actions are velocities
+            max_episode_length: steps before timeout
+            goal_radius: success distance to the goal
+            step_time: seconds slept in every step
+            seed: random seed of the goals and initial positions
+            rl_device: device of the returned tensors
+        """
+        self.num_environments = num_envs
+        self.dim = dim
+        self.max_episode_length = max_episode_length
+        self.goal_radius = goal_radius
+        self.step_time = step_time
+        self.rl_device = rl_device
+        self.generator = torch.Generator().manual_seed(seed)
+
+        self.num_observations = 2 * dim
+        self.num_states = 0
+        self.num_actions = dim
+        self.obs_space = spaces.Box(np.ones(self.num_observations) * -np.Inf, np.ones(self.num_observations) * np.Inf)
+        self.state_space = spaces.Box(np.ones(self.num_states) * -np.Inf, np.ones(self.num_states) * np.Inf)
+        self.act_space = spaces.Box(np.ones(self.num_actions) * -1., np.ones(self.num_actions) * 1.)
+
+        self.pos = torch.zeros(num_envs, dim)
+        self.goal = torch.zeros(num_envs, dim)
+        self.progress_buf = torch.zeros(num_envs, dtype=torch.long)
+        self.reset_buf = torch.ones(num_envs, dtype=torch.long)
+        self.extras = {}
+
+    @property
+    def observation_space(self):
+        return self.obs_space
+
+    @property
+    def action_space(self):
+        return self.act_space
+
+    @property
+    def num_envs(self):
+        return self.num_environments
+
+    def _reset_idx(self, env_ids):
+        self.pos[env_ids] = torch.rand(len(env_ids), self.dim, generator=self.generator) * 2 - 1
+        self.goal[env_ids] = torch.rand(len(env_ids), self.dim, generator=self.generator) * 2 - 1
+        self.progress_buf[env_ids] = 0
+        self.reset_buf[env_ids] = 0
+
+    def _obs(self):
+        return torch.cat([self.pos, self.goal], dim=-1).to(self.rl_device)
+
+    def reset(self):
+        self._reset_idx(torch.arange(self.num_envs))
+        return self._obs()
+
+    def get_state(self):
+        return torch.zeros(self.num_envs, self.num_states, device=self.rl_device)
+
+    def step(self, actions):
+        if self.step_time > 0:
+            time.sleep(self.step_time)
+        actions = actions.detach().cpu().clamp(-1., 1.)
+        self.pos += 0.1 * actions
+        dist = torch.norm(self.pos - self.goal, dim=-1)
+        success = dist < self.goal_radius
+        rewards = -dist + 10. * success.float()
+
+        self.progress_buf += 1
+        self.reset_buf = (success | (self.progress_buf >= self.max_episode_length)).long()
+        self.extras['success_scores'] = success.float().mean().unsqueeze(0)
+        env_ids = self.reset_buf.nonzero(as_tuple=False).squeeze(-1)
+        dones = self.reset_buf.clone()
+        if len(env_ids) > 0:
+            self._reset_idx(env_ids)
+        return self._obs(), rewards.to(self.rl_device), dones.to(self.rl_device), self.extras
@@ -1,3 +1,4 @@
-from .storage import RolloutStorage
+from .storage import RolloutStorage, HostRolloutStorage
 from .module import ActorCritic
 from .ppo import PPO
+from .multi_seed import MultiSeedPPO
@@ -0,0 +1,242 @@
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from algos.rl.ppo.ppo import PPO
+from algos.rl.ppo.module import diag_gaussian_log_prob, diag_gaussian_entropy
+from algos.utils.util import EpisodeTracker, InfoAccumulator
+
+
+class EnvSlice:
+    """ Contiguous slice of the envs of a vec env, the env view of one seed of `MultiSeedPPO`
+    """
+    def __init__(self, vec_env, num_envs):
+        self.vec_env = vec_env
+        self.observation_space = vec_env.observation_space
+        self.state_space = vec_env.state_space
+        self.action_space = vec_env.action_space
+        self.num_envs = num_envs
+
+    @property
+    def task(self):
+        return self.vec_env.task
+
+
+class StackedActorCritic:
+    """ Runs S `ActorCritic` with the same architecture as one batched matmul per layer.
+
+    The weights of every layer are stacked on each call, so the gradients flow back to the parameters of
+    each seed, which keep their own optimizers and checkpoints. Inputs and outputs have a leading seed axis.
+    """
+    def __init__(self, models):
+        self.models = models
+        self.asymmetric = models[0].asymmetric
+
+    @staticmethod
+    def _forward(sequentials, x):
+        for layers in zip(*sequentials):
+            if isinstance(layers[0], nn.Linear):
+                weight = torch.stack([layer.weight for layer in layers])
+                bias = torch.stack([layer.bias for layer in layers])
+                x = torch.baddbmm(bias.unsqueeze(1), x, weight.transpose(1, 2))
+            else:
+                x = layers[0](x)  # activations are elementwise and have no parameters
+        return x
+
+    def _value(self, observations, states):
+        critics = [model.critic for model in self.models]
+        if self.asymmetric:
+            return self._forward(critics, states)
+        return self._forward(critics, observations)
+
+    def _log_std(self):
+        return torch.stack([model.log_std for model in self.models]).unsqueeze(1)
+
+    def act(self, observations, states):
+        with torch.no_grad():
+            actions_mean = self._forward([model.actor for model in self.models], observations)
+            log_std = self._log_std()
+            log_scale = 2 * log_std  # see ActorCritic.action_log_scale
+            actions = torch.addcmul(actions_mean, log_scale.exp(), torch.randn_like(actions_mean))
+            actions_log_prob = diag_gaussian_log_prob(actions, actions_mean, log_scale)
+            value = self._value(observations, states)
+        return actions, actions_log_prob, value, actions_mean, log_std.expand_as(actions_mean)
+
+    def evaluate(self, observations, states, actions):
+        actions_mean = self._forward([model.actor for model in self.models], observations)
+        log_std = self._log_std()
+        log_scale = 2 * log_std
+        actions_log_prob = diag_gaussian_log_prob(actions, actions_mean, log_scale)
+        entropy = diag_gaussian_entropy(log_scale).expand(actions_mean.shape[:-1])
+        value = self._value(observations, states)
+        return actions_log_prob, entropy, value, actions_mean, log_std.expand_as(actions_mean)
+
+
+class MultiSeedPPO:
+    """ Trains `num_seeds` independent PPO agents in one process, on disjoint env slices of one vec env.
+
+    Each seed is a `PPO` with its own `ActorCritic`, optimizer, storage and log dir ({log_dir}.{seed}).
+    Rollouts and updates run the S policies together with `StackedActorCritic`, one backward pass
+    computes the gradients of all seeds, then every seed clips and steps its own optimizer.
+    """
+    def __init__(self,
+                 vec_env,
+                 cfg_train,
+                 seeds,
+                 device='cpu',
+                 sampler='sequential',
+                 log_dir='run',
+                 print_log=True,
+                 asymmetric=False
+                 ):
+        """
+        Args:
+            seeds: seed of every agent, used for its initialization and log dir
+            log_dir: log dir prefix, the agent of seed s logs to {log_dir}.{s}
+        """
+        self.vec_env = vec_env
+        self.num_seeds = len(seeds)
+        if vec_env.num_envs % self.num_seeds != 0:
+            raise ValueError(f"{vec_env.num_envs} envs can not be split evenly between {self.num_seeds} seeds")
+        self.num_envs_per_seed = vec_env.num_envs // self.num_seeds
+        self.seeds = seeds
+        self.device = device
+        self.print_log = print_log
+
+        self.agents = []
+        for seed in seeds:
+            torch.manual_seed(seed)
+            self.agents.append(PPO(EnvSlice(vec_env, self.num_envs_per_seed), cfg_train, device=device, sampler=sampler,
+                                   log_dir=f'{log_dir}.{seed}', is_testing=False, print_log=print_log, asymmetric=asymmetric))
+        self.policy = StackedActorCritic([agent.actor_critic for agent in self.agents])
+        self.num_transitions_per_env = self.agents[0].num_transitions_per_env
+        self.num_learning_epochs = self.agents[0].num_learning_epochs
+        self.num_mini_batches = self.agents[0].num_mini_batches
+        self.current_learning_iteration = 0
+
+    def load(self, paths):
+        for agent, path in zip(self.agents, paths):
+            agent.load(path)
+        self.current_learning_iteration = self.agents[0].current_learning_iteration
+
+    def _split(self, tensor):
+        """ [N, ...] -> [S, N / S, ...]
+        """
+        return tensor.view(self.num_seeds, self.num_envs_per_seed, *tensor.shape[1:])
+
+    def run(self, num_learning_iterations, log_interval=1):
+        current_obs = self.vec_env.reset()
+        current_states = self.vec_env.get_state()
+
+        episode_trackers = [EpisodeTracker(self.num_envs_per_seed, capacity=100, device=self.device) for _ in self.agents]
+        #* the extras are means over all envs, shared by the seeds
+        ep_infos = InfoAccumulator(device=self.device)
+        best_mean_rewards = [-np.inf] * self.num_seeds
+        for it in range(self.current_learning_iteration, num_learning_iterations):
+            start = time.time()
+
+            # Rollout
+            for _ in range(self.num_transitions_per_env):
+                obs, states = self._split(current_obs), self._split(current_states)
+                actions, actions_log_prob, values, mu, sigma = self.policy.act(obs, states)
+                next_obs, rews, dones, infos = self.vec_env.step(actions.view(self.vec_env.num_envs, -1))
+                next_states = self.vec_env.get_state()
+                rews, dones = self._split(rews), self._split(dones)
+                for s, agent in enumerate(self.agents):
+                    agent.storage.add_transitions(obs[s], states[s], actions[s], rews[s], dones[s], values[s],
+                                                  actions_log_prob[s], mu[s], sigma[s])
+                    if self.print_log:
+                        episode_trackers[s].step(rews[s], dones[s])
+                current_obs.copy_(next_obs)
+                current_states.copy_(next_states)
+                ep_infos.add(infos)
+
+            _, _, last_values, _, _ = self.policy.act(self._split(current_obs), self._split(current_states))
+            stop = time.time()
+            collection_time = stop - start
+
+            statistics = []
+            for s, agent in enumerate(self.agents):
+                mean_trajectory_length, mean_reward = agent.storage.get_statistics()
+                statistics.append((mean_trajectory_length, mean_reward))
+                # only save ckpt when mean reward is better
+                if mean_reward > best_mean_rewards[s]:
+                    best_mean_rewards[s] = mean_reward
+                    agent.save_async(os.path.join(agent.log_dir, 'model_best.pt'))
+                if it % (log_interval) == 0:
+                    agent.save_async(os.path.join(agent.log_dir, 'model_{}.pt'.format(it)))
+
+            # Learning step
+            start = stop
+            for s, agent in enumerate(self.agents):
+                agent.storage.compute_returns(last_values[s], agent.gamma, agent.lam)
+            losses = self.update()
+            for agent in self.agents:
+                agent.storage.clear()
+            stop = time.time()
+            learn_time = stop - start
+
+            if self.print_log:
+                for s, agent in enumerate(self.agents):
+                    mean_value_loss, mean_surrogate_loss, mean_gradient_norm, mean_gradient_norm_clip, mean_learning_rate = losses[s]
+                    mean_trajectory_length, mean_reward = statistics[s]
+                    print(f'Seed {self.seeds[s]}:')
+                    agent.log({
+                        'it': it,
+                        'num_learning_iterations': num_learning_iterations,
+                        'collection_time': collection_time,
+                        'learn_time': learn_time,
+                        'episode_tracker': episode_trackers[s],
+                        'ep_infos': ep_infos,
+                        'mean_value_loss': mean_value_loss,
+                        'mean_surrogate_loss': mean_surrogate_loss,
+                        'mean_gradient_norm': mean_gradient_norm,
+                        'mean_gradient_norm_clip': mean_gradient_norm_clip,
+                        'mean_learning_rate': mean_learning_rate,
+                        'mean_trajectory_length': mean_trajectory_length,
+                        'mean_reward': mean_reward,
+                    })
+            ep_infos.clear()
+        for agent in self.agents:
+            agent.save_async(os.path.join(agent.log_dir, 'model_{}.pt'.format(num_learning_iterations)))
+            agent.io_writer.flush()
+
+    def update(self):
+        """ `PPO.update` of all seeds with one stacked forward and backward per minibatch
+
+        Return:
+            the `PPO.update` metrics of every seed
+        """
+        metrics = torch.zeros(self.num_seeds, 4, device=self.device)
+        mean_learning_rates = [0.] * self.num_seeds
+
+        for epoch in range(self.num_learning_epochs):
+            generators = [agent.storage.mini_batch_generator(self.num_mini_batches) for agent in self.agents]
+            for indices in zip(*generators):
+                mini_batches = [agent.storage.get_mini_batch(idx) for agent, idx in zip(self.agents, indices)]
+                obs_batch = torch.stack([mini_batch['observations'] for mini_batch in mini_batches])
+                states_batch = torch.stack([mini_batch['states'] for mini_batch in mini_batches]) if self.policy.asymmetric else None
+                actions_batch = torch.stack([mini_batch['actions'] for mini_batch in mini_batches])
+                evaluation = self.policy.evaluate(obs_batch, states_batch, actions_batch)
+
+                #* the seeds share no parameters, the gradient of the summed loss is the gradient of each seed's loss
+                total_loss = 0
+                for s, agent in enumerate(self.agents):
+                    loss, value_loss, surrogate_loss = agent.compute_loss(mini_batches[s], *[output[s] for output in evaluation])
+                    total_loss = total_loss + loss
+                    metrics[s, 0] += value_loss.detach()
+                    metrics[s, 1] += surrogate_loss.detach()
+                    agent.optimizer.zero_grad()
+                total_loss.backward()
+                for s, agent in enumerate(self.agents):
+                    grad_norm, grad_norm_clip, learning_rate = agent.step_optimizer()
+                    metrics[s, 2] += grad_norm
+                    metrics[s, 3] += grad_norm_clip
+                    mean_learning_rates[s] += learning_rate
+
+        num_updates = self.num_learning_epochs * self.num_mini_batches
+        metrics = (metrics / num_updates).tolist()
+        return [tuple(metrics[s]) + (mean_learning_rates[s] / num_updates,) for s in range(self.num_seeds)]
@@ -1,5 +1,6 @@
 from datetime import datetime
 import os
+import json
 import time
 import cv2
 from gym.spaces import Space
@@ -7,9 +8,6 @@ import gym
 from gym.wrappers.monitoring.video_recorder import VideoRecorder
 
 import numpy as np
-import statistics
-import pickle
-from collections import deque
 
 import torch
 import torch.nn as nn
@@ -17,8 +15,11 @@ import torch.optim as optim
 from torch.utils.tensorboard import SummaryWriter
 import wandb
 
-from algos.rl.ppo import RolloutStorage
+from algos.rl.ppo import RolloutStorage, HostRolloutStorage
 from algos.rl.ppo import ActorCritic
+from algos.utils.util import EpisodeTracker, InfoAccumulator, EpisodeEvaluator
+from algos.utils.writer import BackgroundWriter
+from algos.utils.trajectory import TrajectoryRecorder
 
 import copy
 
@@ -64,8 +65,22 @@ class PPO:
         self.actor_critic = ActorCritic(self.observation_space.shape, self.state_space.shape, self.action_space.shape,
                                                self.init_noise_std, self.model_cfg, asymmetric=asymmetric)
         self.actor_critic.to(self.device)
-        self.storage = RolloutStorage(self.vec_env.num_envs, self.num_transitions_per_env, self.observation_space.shape,
-                                      self.state_space.shape, self.action_space.shape, self.device, sampler)
+        #* compact storage skips the critic states of symmetric policies and stores the constant sigma once
+        compact_storage = learn_cfg.get("compact_storage", False)
+        storage_kwargs = dict(store_states=asymmetric or not compact_storage,
+                              constant_sigma=compact_storage,
+                              input_dtype=getattr(torch, learn_cfg.get("storage_dtype", "float32")))
+        storage_device = learn_cfg.get("storage_device", "device")
+        if storage_device == "device":
+            storage_cls = RolloutStorage
+        elif storage_device == "host":
+            #* rollouts larger than the device memory stay on the host, minibatches are streamed to the device
+            storage_cls = HostRolloutStorage
+            storage_kwargs.update(mmap_dir=learn_cfg.get("storage_mmap_dir", None))
+        else:
+            raise NotImplementedError(f"Unsupported storage device: {storage_device}")
+        self.storage = storage_cls(self.vec_env.num_envs, self.num_transitions_per_env, self.observation_space.shape,
+                                   self.state_space.shape, self.action_space.shape, self.device, sampler, **storage_kwargs)
         self.optimizer = optim.Adam(self.actor_critic.parameters(), lr=self.learning_rate)
     
         # PPO parameters
@@ -85,6 +100,8 @@ class PPO:
         self.log_dir = log_dir
         self.print_log = print_log
         self.writer = SummaryWriter(log_dir=self.log_dir, flush_secs=10)
+        #* checkpoints and metrics are written by a background worker, the training loop never waits on disk or network
+        self.io_writer = BackgroundWriter(self.writer)
         self.tot_timesteps = 0
         self.tot_time = 0
         self.is_testing = is_testing
@@ -96,6 +113,7 @@ class PPO:
     def test(self, path):
         self.actor_critic.load_state_dict(torch.load(path))
         self.actor_critic.eval()
+        self.model_path = path
         self.model_basedir = os.path.dirname(path)
         self.model_name = os.path.basename(path)
 
@@ -107,62 +125,48 @@ class PPO:
     def save(self, path):
         torch.save(self.actor_critic.state_dict(), path)
 
+    def save_async(self, path):
+        self.io_writer.save_state_dict(self.actor_critic.state_dict(), path)
+
     def run(self, num_learning_iterations, log_interval=1, ckpt=None):
         current_obs = self.vec_env.reset()
         current_states = self.vec_env.get_state()
 
         if self.is_testing:
             if self.save_traj:
-                assert current_obs.shape[0] == 1, "Saving trajectory only works with one environment"
-                trajectory = []
-                scores = []
-                visual_reward = []
                 self.actor_critic.load_state_dict(torch.load(ckpt))
 
                 self.actor_critic.eval()
-                while True:
-                    with torch.no_grad():
-                        actions = self.actor_critic.act_inference(current_obs)
-                        next_obs, rews, dones, infos = self.vec_env.step(actions)
-                        current_obs.copy_(next_obs)
-                        trajectory.append(self.vec_env.task.get_states())
-                        scores.append(infos['success_scores'].cpu().item())
-                        visual_reward.append(rews.cpu().numpy())
-                        
-                    if self.vec_env.task.reset_buf.sum() > 0.:
-                        break
-                
-                # save trajectory with pickle
-                absres_path = os.path.join(self.model_basedir, f'absres_{os.path.splitext(self.model_name)[0][6:]}.pkl')
-                absres = {
-                    'trajectory': trajectory,
-                    'scores': scores,
-                    'visual_reward': visual_reward
-                }
-                pickle.dump(absres, open(absres_path, 'wb'))
-                print(f'Save trajectory to {absres_path}')
+                #* the episodes of all envs are recorded at once, each streamed to a columnar, chunk-compressed file
+                absres_prefix = os.path.join(self.model_basedir, f'absres_{os.path.splitext(self.model_name)[0][6:]}')
+                task = self.vec_env.task
+                recorder = TrajectoryRecorder(absres_prefix, self.vec_env.num_envs,
+                                              num_trajectories=self.cfg_train.get("num_trajs", 1),
+                                              top_k=self.cfg_train.get("traj_topk", None),
+                                              body_handles=getattr(task, 'trajectory_body_handles', None))
+                try:
+                    while not recorder.done:
+                        with torch.no_grad():
+                            actions = self.actor_critic.act_inference(current_obs)
+                            next_obs, rews, dones, infos = self.vec_env.step(actions)
+                            current_obs.copy_(next_obs)
+                            #* per-env scores of the task, the extras only hold their mean
+                            scores = getattr(task, 'success_scores', infos['success_scores'].expand(self.vec_env.num_envs))
+                            recorder.add(task.get_states(), task.reset_buf, scores, rews)
+                finally:
+                    kept = recorder.close()
+                print(f'Save {len(kept)} trajectories to {absres_prefix}*, best score {kept[0][0] if kept else float("nan"):.4f}')
             else:
-                while True:
-                    with torch.no_grad():
-                        if self.apply_reset:
-                            current_obs = self.vec_env.reset()
-                        # Compute the action
-                        actions = self.actor_critic.act_inference(current_obs)
-                        # Step the vec_environment
-                        next_obs, rews, dones, infos = self.vec_env.step(actions)
-                        current_obs.copy_(next_obs)
+                checkpoints = [self.model_path] + self.cfg_train.get("eval_models", []) if hasattr(self, 'model_path') else None
+                self.evaluate(checkpoints, num_episodes=self.cfg_train.get("eval_episodes", 100))
         else:
-            rewbuffer = deque(maxlen=100)  #! length of rewbuffer matters?
-            lenbuffer = deque(maxlen=100)
-            cur_reward_sum = torch.zeros(self.vec_env.num_envs, dtype=torch.float, device=self.device)
-            cur_episode_length = torch.zeros(self.vec_env.num_envs, dtype=torch.float, device=self.device)
-
-            reward_sum = []
-            episode_length = []
+            #* returns and lengths of the last 100 episodes stay on device, read once per iteration in log()
+            episode_tracker = EpisodeTracker(self.vec_env.num_envs, capacity=100, device=self.device)
+            #* extras are reduced as they arrive instead of keeping every per-step dict until log()
+            ep_infos = InfoAccumulator(device=self.device)
             best_mean_reward = -np.inf
             for it in range(self.current_learning_iteration, num_learning_iterations):
                 start = time.time()
-                ep_infos = []
 
                 # Rollout
                 for _ in range(self.num_transitions_per_env):
@@ -179,23 +183,10 @@ class PPO:
                     current_obs.copy_(next_obs)
                     current_states.copy_(next_states)
                     # Book keeping
-                    ep_infos.append(infos)
+                    ep_infos.add(infos)
 
                     if self.print_log:
-                        cur_reward_sum[:] += rews
-                        cur_episode_length[:] += 1
-
-                        new_ids = (dones > 0).nonzero(as_tuple=False)
-                        reward_sum.extend(cur_reward_sum[new_ids][:, 0].cpu().numpy().tolist())
-                        episode_length.extend(cur_episode_length[new_ids][:, 0].cpu().numpy().tolist())
-                        cur_reward_sum[new_ids] = 0
-                        cur_episode_length[new_ids] = 0
-
-                if self.print_log:
-                    # reward_sum = [x[0] for x in reward_sum]
-                    # episode_length = [x[0] for x in episode_length]
-                    rewbuffer.extend(reward_sum)
-                    lenbuffer.extend(episode_length)
+                        episode_tracker.step(rews, dones)
 
                 _, _, last_values, _, _ = self.actor_critic.act(current_obs, current_states)
                 stop = time.time()
@@ -206,10 +197,10 @@ class PPO:
                 # only save ckpt when mean reward is better
                 if mean_reward > best_mean_reward:
                     best_mean_reward = mean_reward
-                    self.save(os.path.join(self.log_dir, 'model_best.pt'.format(it)))
+                    self.save_async(os.path.join(self.log_dir, 'model_best.pt'))
                     # self.save(os.path.join(self.log_dir, 'model_{}.pt'.format(it)))
                 if it % (log_interval) == 0:
-                    self.save(os.path.join(self.log_dir, 'model_{}.pt'.format(it)))
+                    self.save_async(os.path.join(self.log_dir, 'model_{}.pt'.format(it)))
 
                 # Learning step
                 start = stop
@@ -222,32 +213,103 @@ class PPO:
                     self.log(locals())
                 
                 ep_infos.clear()
-            self.save(os.path.join(self.log_dir, 'model_{}.pt'.format(num_learning_iterations)))
+            self.save_async(os.path.join(self.log_dir, 'model_{}.pt'.format(num_learning_iterations)))
+            self.io_writer.flush()
+
+    def evaluate(self, checkpoints=None, num_episodes=100, summary_path=None, check_interval=16):
+        """ Run exactly `num_episodes` episodes of every checkpoint and write a JSON summary.
+
+        The envs are split into one contiguous shard per checkpoint, so several checkpoints are evaluated
+        by the same simulator at once. Returns, lengths, success scores, successes and smoothness are
+        accumulated on the device; the loop stops once every shard finished its episodes.
+
+        Args:
+            checkpoints: list of checkpoint paths, the current policy if None
+            num_episodes: number of episodes per checkpoint
+            summary_path: output JSON file, next to the first checkpoint (or in log_dir) by default
+            check_interval: steps between two checks of the stopping condition, each one syncs with the device
+
+        Return:
+            the summary dict
+        """
+        if checkpoints:
+            policies = []
+            for path in checkpoints:
+                policy = ActorCritic(self.observation_space.shape, self.state_space.shape, self.action_space.shape,
+                                     self.init_noise_std, self.model_cfg, asymmetric=self.asymmetric)
+                policy.load_state_dict(torch.load(path, map_location=self.device))
+                policies.append(policy.to(self.device).eval())
+        else:
+            policies = [self.actor_critic.eval()]
+        num_envs = self.vec_env.num_envs
+        if num_envs < len(policies):
+            raise ValueError(f"Can not evaluate {len(policies)} checkpoints with {num_envs} envs")
+        bounds = [num_envs * i // len(policies) for i in range(len(policies) + 1)]
+        group_ids = torch.repeat_interleave(torch.arange(len(policies)), torch.tensor(np.diff(bounds)))
+        evaluator = EpisodeEvaluator(group_ids, num_episodes, device=self.device)
+        task = getattr(self.vec_env, 'task', None)
+
+        start = time.time()
+        num_steps = 0
+        current_obs = self.vec_env.reset()
+        with torch.no_grad():
+            while True:
+                actions = torch.cat([policy.act_inference(current_obs[lo:hi])
+                                     for policy, lo, hi in zip(policies, bounds[:-1], bounds[1:])])
+                next_obs, rews, dones, infos = self.vec_env.step(actions)
+                current_obs.copy_(next_obs)
+                #* per-env scores of the task, the extras only hold their mean
+                scores = getattr(task, 'success_scores', None)
+                if scores is None:
+                    scores = infos['success_scores'].expand(num_envs)
+                evaluator.step(actions, rews, dones, scores, getattr(task, 'successes', None))
+                num_steps += 1
+                if num_steps % check_interval == 0 and evaluator.finished():
+                    break
+
+        summary = {
+            'num_envs': num_envs,
+            'num_steps': num_steps,
+            'time': time.time() - start,
+            'results': [dict(checkpoint=path, num_envs=hi - lo, **stats) for path, lo, hi, stats in
+                        zip(checkpoints or ['current'], bounds[:-1], bounds[1:], evaluator.summary())],
+        }
+        if summary_path is None:
+            if checkpoints:
+                name = os.path.splitext(os.path.basename(checkpoints[0]))[0] if len(checkpoints) == 1 else 'summary'
+                summary_path = os.path.join(os.path.dirname(checkpoints[0]), f'eval_{name}.json')
+            else:
+                summary_path = os.path.join(self.log_dir, 'eval_current.json')
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(json.dumps(summary, indent=2))
+        print(f'Save evaluation summary to {summary_path}')
+        return summary
 
     def log(self, locs, width=80, pad=35):
         self.tot_timesteps += self.num_transitions_per_env * self.vec_env.num_envs
         self.tot_time += locs['collection_time'] + locs['learn_time']
         iteration_time = locs['collection_time'] + locs['learn_time']
 
+        num_episodes, mean_episode_reward, mean_episode_length = locs['episode_tracker'].statistics()
+
         ep_string = f''
-        if locs['ep_infos']:
-            for key in locs['ep_infos'][0]:
-                infotensor = torch.tensor([], device=self.device)
-                for ep_info in locs['ep_infos']:
-                    infotensor = torch.cat((infotensor, ep_info[key].to(self.device)))
-                value = torch.mean(infotensor)
-                self.writer.add_scalar('Episode/' + key, value, locs['it'])
+        if len(locs['ep_infos']) > 0:
+            ep_means, ep_maxs = locs['ep_infos'].statistics()
+            for key, value in ep_means.items():
+                self.io_writer.add_scalar('Episode/' + key, value, locs['it'])
+                self.io_writer.add_scalar('Episode_max/' + key, ep_maxs[key], locs['it'])
                 if wandb.run is not None:
-                    wandb.log({'Episode/' + key: value}, step=locs['it'])
+                    self.io_writer.wandb_log({'Episode/' + key: value}, step=locs['it'])
                     # wandb.log({'Episode/' + key: value}, )
                 ep_string += f"""{f'Mean episode {key}:':>{pad}} {value:.4f}\n"""
         mean_std = self.actor_critic.log_std.exp().mean()
 
-        self.writer.add_scalar('Loss/value_function', locs['mean_value_loss'], locs['it'])
-        self.writer.add_scalar('Loss/surrogate', locs['mean_surrogate_loss'], locs['it'])
-        self.writer.add_scalar('Policy/mean_noise_std', mean_std.item(), locs['it'])
+        self.io_writer.add_scalar('Loss/value_function', locs['mean_value_loss'], locs['it'])
+        self.io_writer.add_scalar('Loss/surrogate', locs['mean_surrogate_loss'], locs['it'])
+        self.io_writer.add_scalar('Policy/mean_noise_std', mean_std.item(), locs['it'])
         if wandb.run is not None:
-            wandb.log({
+            self.io_writer.wandb_log({
                 'Loss/value_function': locs['mean_value_loss'],
                 'Loss/surrogate': locs['mean_surrogate_loss'],
                 'Policy/mean_noise_std': mean_std.item(),
@@ -257,23 +319,23 @@ class PPO:
                 'Optim/mean_learning_rate': locs['mean_learning_rate'],
             }, step=locs['it'])
         
-        if len(locs['rewbuffer']) > 0:
-            self.writer.add_scalar('Train/mean_reward', statistics.mean(locs['rewbuffer']), locs['it'])
-            self.writer.add_scalar('Train/mean_episode_length', statistics.mean(locs['lenbuffer']), locs['it'])
-            self.writer.add_scalar('Train/mean_reward/time', statistics.mean(locs['rewbuffer']), self.tot_time)
-            self.writer.add_scalar('Train/mean_episode_length/time', statistics.mean(locs['lenbuffer']), self.tot_time)
+        if num_episodes > 0:
+            self.io_writer.add_scalar('Train/mean_reward', mean_episode_reward, locs['it'])
+            self.io_writer.add_scalar('Train/mean_episode_length', mean_episode_length, locs['it'])
+            self.io_writer.add_scalar('Train/mean_reward/time', mean_episode_reward, self.tot_time)
+            self.io_writer.add_scalar('Train/mean_episode_length/time', mean_episode_length, self.tot_time)
             if wandb.run is not None:
-                wandb.log({
-                    'Train/mean_reward': statistics.mean(locs['rewbuffer']),
-                    'Train/mean_episode_length': statistics.mean(locs['lenbuffer']),
+                self.io_writer.wandb_log({
+                    'Train/mean_reward': mean_episode_reward,
+                    'Train/mean_episode_length': mean_episode_length,
                 }, step=locs['it'])
                 # wandb.log({
-                #     'Train/mean_reward/time': statistics.mean(locs['rewbuffer']),
-                #     'Train/mean_episode_length/time': statistics.mean(locs['lenbuffer']),
+                #     'Train/mean_reward/time': mean_episode_reward,
+                #     'Train/mean_episode_length/time': mean_episode_length,
                 # }, step=int(self.tot_time))
 
-        self.writer.add_scalar('Train2/mean_reward/step', locs['mean_reward'], locs['it'])
-        self.writer.add_scalar('Train2/mean_episode_length/episode', locs['mean_trajectory_length'], locs['it'])
+        self.io_writer.add_scalar('Train2/mean_reward/step', locs['mean_reward'], locs['it'])
+        self.io_writer.add_scalar('Train2/mean_episode_length/episode', locs['mean_trajectory_length'], locs['it'])
         # if wandb.run is not None:
         #     wandb.log({
         #         'Train2/mean_reward/step': locs['mean_reward'],
@@ -284,7 +346,7 @@ class PPO:
 
         str = f" \033[1m Learning iteration {locs['it']}/{locs['num_learning_iterations']} \033[0m "
 
-        if len(locs['rewbuffer']) > 0:
+        if num_episodes > 0:
             log_string = (f"""{'#' * width}\n"""
                           f"""{str.center(width, ' ')}\n\n"""
                           f"""{'Computation:':>{pad}} {fps:.0f} steps/s (collection: {locs[
@@ -292,8 +354,8 @@ class PPO:
                           f"""{'Value function loss:':>{pad}} {locs['mean_value_loss']:.4f}\n"""
                           f"""{'Surrogate loss:':>{pad}} {locs['mean_surrogate_loss']:.4f}\n"""
                           f"""{'Mean action noise std:':>{pad}} {mean_std.item():.2f}\n"""
-                          f"""{'Mean reward:':>{pad}} {statistics.mean(locs['rewbuffer']):.2f}\n"""
-                          f"""{'Mean episode length:':>{pad}} {statistics.mean(locs['lenbuffer']):.2f}\n"""
+                          f"""{'Mean reward:':>{pad}} {mean_episode_reward:.2f}\n"""
+                          f"""{'Mean episode length:':>{pad}} {mean_episode_length:.2f}\n"""
                           f"""{'Mean reward/step:':>{pad}} {locs['mean_reward']:.2f}\n"""
                           f"""{'Mean episode length/episode:':>{pad}} {locs['mean_trajectory_length']:.2f}\n""")
         else:
@@ -317,106 +379,110 @@ class PPO:
         print(log_string)
 
     def update(self):
-        mean_value_loss = 0
-        mean_surrogate_loss = 0
-        mean_gradient_norm = 0
-        mean_gradient_norm_clip = 0
+        #* metrics accumulate on device and are read back once at the end, no host sync per minibatch
+        mean_value_loss = torch.zeros((), device=self.device)
+        mean_surrogate_loss = torch.zeros((), device=self.device)
+        mean_gradient_norm = torch.zeros((), device=self.device)
+        mean_gradient_norm_clip = torch.zeros((), device=self.device)
         mean_learning_rate = 0
 
-        batch = self.storage.mini_batch_generator(self.num_mini_batches)
         for epoch in range(self.num_learning_epochs):
-            # for obs_batch, actions_batch, target_values_batch, advantages_batch, returns_batch, old_actions_log_prob_batch \
-            #        in self.storage.mini_batch_generator(self.num_mini_batches):
-
-            for indices in batch:
-                obs_batch = self.storage.observations.view(-1, *self.storage.observations.size()[2:])[indices]
+            for indices in self.storage.mini_batch_generator(self.num_mini_batches):
+                mini_batch = self.storage.get_mini_batch(indices)
                 if self.asymmetric:
-                    states_batch = self.storage.states.view(-1, *self.storage.states.size()[2:])[indices]
+                    states_batch = mini_batch['states']
                 else:
                     states_batch = None
-                actions_batch = self.storage.actions.view(-1, self.storage.actions.size(-1))[indices]
-                target_values_batch = self.storage.values.view(-1, 1)[indices]
-                returns_batch = self.storage.returns.view(-1, 1)[indices]
-                old_actions_log_prob_batch = self.storage.actions_log_prob.view(-1, 1)[indices]
-                advantages_batch = self.storage.advantages.view(-1, 1)[indices]
-                old_mu_batch = self.storage.mu.view(-1, self.storage.actions.size(-1))[indices]
-                old_sigma_batch = self.storage.sigma.view(-1, self.storage.actions.size(-1))[indices]
-
-                actions_log_prob_batch, entropy_batch, value_batch, mu_batch, sigma_batch = self.actor_critic.evaluate(obs_batch,
-                                                                                                                       states_batch,
-                                                                                                                       actions_batch)
-
-                # KL
-                if self.desired_kl != None and self.schedule == 'adaptive':
-
-                    kl = torch.sum(
-                        sigma_batch - old_sigma_batch + (torch.square(old_sigma_batch.exp()) + torch.square(old_mu_batch - mu_batch)) / (2.0 * torch.square(sigma_batch.exp())) - 0.5, axis=-1)
-                    kl_mean = torch.mean(kl)
-
-                    if kl_mean > self.desired_kl * 2.0:
-                        self.step_size = max(1e-5, self.step_size / 1.5)
-                    elif kl_mean < self.desired_kl / 2.0 and kl_mean > 0.0:
-                        self.step_size = min(1e-2, self.step_size * 1.5)
-
-                    for param_group in self.optimizer.param_groups:
-                        param_group['lr'] = self.step_size
-
-                # Surrogate loss
-                ratio = torch.exp(actions_log_prob_batch - torch.squeeze(old_actions_log_prob_batch))
-                surrogate = -torch.squeeze(advantages_batch) * ratio
-                surrogate_clipped = -torch.squeeze(advantages_batch) * torch.clamp(ratio, 1.0 - self.clip_param,
-                                                                                   1.0 + self.clip_param)
-                surrogate_loss = torch.max(surrogate, surrogate_clipped).mean()
-
-                # Value function loss
-                if self.use_clipped_value_loss:
-                    value_clipped = target_values_batch + (value_batch - target_values_batch).clamp(-self.clip_param,
-                                                                                                    self.clip_param)
-                    value_losses = (value_batch - returns_batch).pow(2)
-                    value_losses_clipped = (value_clipped - returns_batch).pow(2)
-                    value_loss = torch.max(value_losses, value_losses_clipped).mean()
-                else:
-                    value_loss = (returns_batch - value_batch).pow(2).mean()
 
-                loss = surrogate_loss + self.value_loss_coef * value_loss - self.entropy_coef * entropy_batch.mean()
-                # scaling loss
-                loss = self.total_loss_coef * loss
+                evaluation = self.actor_critic.evaluate(mini_batch['observations'], states_batch, mini_batch['actions'])
+                loss, value_loss, surrogate_loss = self.compute_loss(mini_batch, *evaluation)
 
                 # Gradient step
                 self.optimizer.zero_grad()
                 loss.backward()
+                grad_norm, grad_norm_clip, learning_rate = self.step_optimizer()
 
-                # Compute the gradient norm before clip
-                grad_norm = 0
-                for p in self.actor_critic.parameters():
-                    param_norm = p.grad.data.norm(2)
-                    grad_norm += param_norm.item() ** 2
-                grad_norm = grad_norm ** (1. / 2)
                 mean_gradient_norm += grad_norm
-
-                nn.utils.clip_grad_norm_(self.actor_critic.parameters(), self.max_grad_norm)
-                
-                # Compute the gradient norm after clip
-                grad_norm_clip = 0
-                for p in self.actor_critic.parameters():
-                    param_norm = p.grad.data.norm(2)
-                    grad_norm_clip += param_norm.item() ** 2
-                grad_norm_clip = grad_norm_clip ** (1. / 2)
                 mean_gradient_norm_clip += grad_norm_clip
-
-                # Record the learning rate
-                mean_learning_rate += self.optimizer.param_groups[0]['lr']
-                
-                self.optimizer.step()
-
-                mean_value_loss += value_loss.item()
-                mean_surrogate_loss += surrogate_loss.item()
+                mean_learning_rate += learning_rate
+                mean_value_loss += value_loss.detach()
+                mean_surrogate_loss += surrogate_loss.detach()
 
         num_updates = self.num_learning_epochs * self.num_mini_batches
-        mean_value_loss /= num_updates
-        mean_surrogate_loss /= num_updates
-        mean_gradient_norm /= num_updates
-        mean_gradient_norm_clip /= num_updates
+        mean_value_loss, mean_surrogate_loss, mean_gradient_norm, mean_gradient_norm_clip = \
+            (torch.stack([mean_value_loss, mean_surrogate_loss, mean_gradient_norm, mean_gradient_norm_clip]) / num_updates).tolist()
         mean_learning_rate /= num_updates
 
         return mean_value_loss, mean_surrogate_loss, mean_gradient_norm, mean_gradient_norm_clip, mean_learning_rate
+
+    def compute_loss(self, mini_batch, actions_log_prob_batch, entropy_batch, value_batch, mu_batch, sigma_batch):
+        """ PPO loss of a minibatch, also adapts the learning rate to the KL for the adaptive schedule
+
+        Args:
+            mini_batch: dict returned by `RolloutStorage.get_mini_batch`
+            actions_log_prob_batch, entropy_batch, value_batch, mu_batch, sigma_batch: `ActorCritic.evaluate` of the minibatch
+
+        Return:
+            the total loss, the value loss and the surrogate loss
+        """
+        target_values_batch = mini_batch['values']
+        returns_batch = mini_batch['returns']
+        old_actions_log_prob_batch = mini_batch['actions_log_prob']
+        advantages_batch = mini_batch['advantages']
+        old_mu_batch = mini_batch['mu']
+        old_sigma_batch = mini_batch['sigma']
+
+        # KL
+        if self.desired_kl != None and self.schedule == 'adaptive':
+
+            kl = torch.sum(
+                sigma_batch - old_sigma_batch + (torch.square(old_sigma_batch.exp()) + torch.square(old_mu_batch - mu_batch)) / (2.0 * torch.square(sigma_batch.exp())) - 0.5, axis=-1)
+            kl_mean = torch.mean(kl)
+
+            if kl_mean > self.desired_kl * 2.0:
+                self.step_size = max(1e-5, self.step_size / 1.5)
+            elif kl_mean < self.desired_kl / 2.0 and kl_mean > 0.0:
+                self.step_size = min(1e-2, self.step_size * 1.5)
+
+            for param_group in self.optimizer.param_groups:
+                param_group['lr'] = self.step_size
+
+        # Surrogate loss
+        ratio = torch.exp(actions_log_prob_batch - torch.squeeze(old_actions_log_prob_batch))
+        surrogate = -torch.squeeze(advantages_batch) * ratio
+        surrogate_clipped = -torch.squeeze(advantages_batch) * torch.clamp(ratio, 1.0 - self.clip_param,
+                                                                           1.0 + self.clip_param)
+        surrogate_loss = torch.max(surrogate, surrogate_clipped).mean()
+
+        # Value function loss
+        if self.use_clipped_value_loss:
+            value_clipped = target_values_batch + (value_batch - target_values_batch).clamp(-self.clip_param,
+                                                                                            self.clip_param)
+            value_losses = (value_batch - returns_batch).pow(2)
+            value_losses_clipped = (value_clipped - returns_batch).pow(2)
+            value_loss = torch.max(value_losses, value_losses_clipped).mean()
+        else:
+            value_loss = (returns_batch - value_batch).pow(2).mean()
+
+        loss = surrogate_loss + self.value_loss_coef * value_loss - self.entropy_coef * entropy_batch.mean()
+        # scaling loss
+        loss = self.total_loss_coef * loss
+        return loss, value_loss, surrogate_loss
+
+    def step_optimizer(self):
+        """ Clip the gradients and step the optimizer
+
+        Return:
+            the gradient norm before and after clipping (device tensors) and the learning rate
+        """
+        # Gradient norm before clip, returned by clip_grad_norm_
+        grad_norm = nn.utils.clip_grad_norm_(self.actor_critic.parameters(), self.max_grad_norm)
+
+        # Gradient norm after clip, the gradients were scaled by min(max_norm / (norm + 1e-6), 1)
+        grad_norm_clip = grad_norm * torch.clamp(self.max_grad_norm / (grad_norm + 1e-6), max=1.0)
+
+        # Record the learning rate
+        learning_rate = self.optimizer.param_groups[0]['lr']
+
+        self.optimizer.step()
+        return grad_norm, grad_norm_clip, learning_rate
@@ -0,0 +1,90 @@
+import math
+
+import torch
+import torch.nn as nn
+
+
+class EnsembleLinear(nn.Module):
+    """ `num_members` independent linear layers evaluated with one batched matmul.
+
+    The weight is stored as [E, in, out] and the bias as [E, 1, out], the input is [E, B, in].
+    Every member is initialized like its own `nn.Linear`, or with `weight_init` on its [out, in] weight.
+    """
+    def __init__(self, num_members, in_features, out_features, weight_init=None):
+        super().__init__()
+        self.num_members = num_members
+        self.in_features = in_features
+        self.out_features = out_features
+        self.weight = nn.Parameter(torch.empty(num_members, in_features, out_features))
+        self.bias = nn.Parameter(torch.empty(num_members, 1, out_features))
+        self.reset_parameters(weight_init)
+
+    def reset_parameters(self, weight_init=None):
+        with torch.no_grad():
+            for member in range(self.num_members):
+                weight = torch.empty(self.out_features, self.in_features)
+                if weight_init is None:
+                    nn.init.kaiming_uniform_(weight, a=math.sqrt(5))
+                else:
+                    weight_init(weight)
+                self.weight[member].copy_(weight.t())
+            bound = 1 / math.sqrt(self.in_features)
+            nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(self, x, members=slice(None)):
+        """
+        Args:
+            x: [E', B, in] input of the selected members
+            members: slice of the members to evaluate
+        """
+        return torch.baddbmm(self.bias[members], x, self.weight[members])
+
+    def extra_repr(self):
+        return f'num_members={self.num_members}, in_features={self.in_features}, out_features={self.out_features}'
+
+
+class EnsembleMLP(nn.Module):
+    """ MLP ensemble (e.g. the twin Q heads of a critic) with one batched matmul per layer for all members
+    """
+    def __init__(self, num_members, input_dim, hidden_sizes, output_dim, activation=nn.ReLU, weight_init=None):
+        super().__init__()
+        self.num_members = num_members
+        sizes = [input_dim] + list(hidden_sizes) + [output_dim]
+        self.layers = nn.ModuleList([EnsembleLinear(num_members, sizes[i], sizes[i + 1], weight_init) for i in range(len(sizes) - 1)])
+        self.activation = activation()
+
+    def forward(self, x, members=slice(None)):
+        """
+        Args:
+            x: [B, in] input shared by the members or [E', B, in] input of each selected member
+            members: slice of the members to evaluate, e.g. slice(0, 1) for the first Q head only
+
+        Return:
+            [E', B, out] outputs of the selected members
+        """
+        if x.dim() == 2:
+            x = x.expand(len(range(self.num_members)[members]), *x.shape)
+        for i, layer in enumerate(self.layers):
+            x = layer(x, members)
+            if i < len(self.layers) - 1:
+                x = self.activation(x)
+        return x
+
+
+def soft_update(targets, sources, tau):
+    """ Polyak averaging target <- target + tau * (source - target) of all parameters with fused foreach ops
+
+    Args:
+        targets, sources: module or list of modules with the same parameters
+    """
+    if isinstance(targets, nn.Module):
+        targets, sources = [targets], [sources]
+    target_params = [param for module in targets for param in module.parameters()]
+    source_params = [param for module in sources for param in module.parameters()]
+    with torch.no_grad():
+        if hasattr(torch, '_foreach_lerp_'):
+            torch._foreach_lerp_(target_params, source_params, tau)
+        else:
+            #* torch < 2.0 has no foreach lerp
+            torch._foreach_mul_(target_params, 1.0 - tau)
+            torch._foreach_add_(target_params, source_params, alpha=tau)
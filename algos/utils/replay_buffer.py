@@ -0,0 +1,240 @@
+import os
+import json
+
+import numpy as np
+import torch
+
+
+class ReplayBuffer:
+    """ Offline transitions of BCQ / IQL / TD3+BC, stored once as float32 on the training device.
+
+    All fields live in one packed [size, F] tensor, `sample` draws the indices with `torch.randint` on the
+    device and fetches a batch with a single gather, the returned fields are column views of it.
+    """
+
+    #* .npy file of every packed field, in column order
+    FILES = ('states', 'actions', 'next_states', 'rewards', 'dones')
+
+    def __init__(self, state_dim, action_dim, device, max_size=int(1e6)):
+        """
+        Args:
+            max_size: kept for compatibility, the buffer is sized by the loaded data
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.widths = [state_dim, action_dim, state_dim, 1, 1]
+        self.device = device
+        #* allocated by `convert`, the memory of an empty buffer is not reserved up front
+        self.data = torch.zeros(0, sum(self.widths), device=self.device)
+
+    @property
+    def state(self):
+        return self.data[:self.size, self._columns(0)]
+
+    @property
+    def action(self):
+        return self.data[:self.size, self._columns(1)]
+
+    @property
+    def next_state(self):
+        return self.data[:self.size, self._columns(2)]
+
+    @property
+    def reward(self):
+        return self.data[:self.size, self._columns(3)]
+
+    @property
+    def not_done(self):
+        return self.data[:self.size, self._columns(4)]
+
+    def _columns(self, field):
+        offset = sum(self.widths[:field])
+        return slice(offset, offset + self.widths[field])
+
+    def sample(self, batch_size):
+        """ Uniformly sample `batch_size` transitions
+
+        Return:
+            state, action, next_state, reward, not_done as [batch_size, F] float32 tensors on the device
+        """
+        ind = torch.randint(0, self.size, (batch_size,), device=self.device)
+        return tuple(torch.index_select(self.data, 0, ind).split(self.widths, dim=1))
+
+    def convert(self, data_dir, chunk_size=65536):
+        """ Load the states / actions / next_states / rewards / dones .npy files of `data_dir`, or of all
+            the shards listed by its `manifest.json`
+
+        The files are memory-mapped and copied to the device in float32 chunks of `chunk_size` rows,
+        so the host never holds more than one chunk of the (float64) data. Only the rows written so far
+        are loaded from a dataset of `TransitionWriter`.
+        """
+        manifest = read_manifest(data_dir)
+        if manifest is not None:
+            shard_dirs = [os.path.join(data_dir, shard['path']) for shard in manifest['shards']]
+        else:
+            shard_dirs = [data_dir]
+
+        shards = []
+        for shard_dir in shard_dirs:
+            arrays = [np.load(os.path.join(shard_dir, f'{name}.npy'), mmap_mode='r') for name in self.FILES]
+            progress = TransitionWriter.read_progress(shard_dir)
+            size = progress['written'] if progress is not None else arrays[0].shape[0]
+            for name, array, width in zip(self.FILES, arrays, self.widths):
+                if array.shape[0] < size or int(np.prod(array.shape[1:])) != width:
+                    raise ValueError(f"{os.path.join(shard_dir, name)}.npy has shape {array.shape}, expected ({size}, {width})")
+            shards.append((arrays, size))
+
+        self.data = torch.empty(sum(size for _, size in shards), sum(self.widths), device=self.device)
+        row = 0
+        for arrays, size in shards:
+            for field, array in enumerate(arrays):
+                columns = self._columns(field)
+                for start in range(0, size, chunk_size):
+                    chunk = np.array(array[start:min(start + chunk_size, size)], dtype=np.float32).reshape(-1, self.widths[field])
+                    self.data[row + start:row + start + chunk.shape[0], columns].copy_(torch.from_numpy(chunk))
+            row += size
+        self.size = row
+        # dones -> not_done in place
+        self.not_done.neg_().add_(1.)
+
+
+MANIFEST = 'manifest.json'
+
+
+def write_manifest(data_dir, shard_dirs):
+    """ Describe the shards of a dataset collected in parallel in `{data_dir}/manifest.json`
+
+    Args:
+        shard_dirs: directories of the shards, each written by a `TransitionWriter`
+
+    Return:
+        path of the manifest
+    """
+    shards = []
+    for shard_dir in shard_dirs:
+        progress = TransitionWriter.read_progress(shard_dir)
+        shards.append({'path': os.path.relpath(shard_dir, data_dir), 'size': progress['written'], 'widths': progress['widths']})
+    path = os.path.join(data_dir, MANIFEST)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'size': sum(shard['size'] for shard in shards), 'shards': shards}, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def read_manifest(data_dir):
+    """ Manifest of the sharded dataset in `data_dir`, None if it is not sharded
+    """
+    path = os.path.join(data_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class TransitionWriter:
+    """ Streams transitions into preallocated float32 .npy files in the layout read by `ReplayBuffer.convert`.
+
+    The five files of `data_dir` are preallocated at their final size of `size` rows, every `add` makes one
+    device-to-host copy of the packed step and writes its rows in place with `os.pwrite` (not through a memory
+    map, whose dirty pages would count towards the process memory), so the memory does not grow with the
+    dataset. The number of rows written is recorded in `progress.json` at every `flush`, a writer opened on
+    an unfinished dataset of the same shapes resumes after the last flushed row.
+    """
+
+    PROGRESS = 'progress.json'
+
+    def __init__(self, data_dir, size, state_dim, action_dim, resume=True, flush_interval=100):
+        """
+        Args:
+            size: number of transitions of the finished dataset
+            resume: continue an unfinished dataset of `data_dir` instead of starting over
+            flush_interval: number of `add` calls between two flushes of the files and the progress
+        """
+        self.data_dir = data_dir
+        self.size = size
+        self.widths = [state_dim, action_dim, state_dim, 1, 1]
+        self.flush_interval = flush_interval
+        self._adds = 0
+        self._host = None
+        os.makedirs(data_dir, exist_ok=True)
+
+        progress = self.read_progress(data_dir) if resume else None
+        shapes_match = progress is not None and progress['size'] == size and progress['widths'] == self.widths and \
+            all(os.path.exists(os.path.join(data_dir, f'{name}.npy')) for name in ReplayBuffer.FILES)
+        self.written = progress['written'] if shapes_match else 0
+        #* file descriptor and byte offset of the data of every .npy file
+        self.files = []
+        for name, width in zip(ReplayBuffer.FILES, self.widths):
+            path = os.path.join(data_dir, f'{name}.npy')
+            if shapes_match:
+                array = np.load(path, mmap_mode='r')
+            else:
+                array = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(size, width))
+            if array.shape != (size, width) or array.dtype != np.float32:
+                raise ValueError(f"{path} has shape {array.shape} and dtype {array.dtype}, expected ({size}, {width}) float32")
+            self.files.append((os.open(path, os.O_WRONLY), array.offset))
+            del array
+        if self.written > 0:
+            print(f'Resume {data_dir} at {self.written}/{size} transitions')
+        self._write_progress()
+
+    @staticmethod
+    def read_progress(data_dir):
+        """ Progress of the dataset in `data_dir`, None if there is none
+        """
+        path = os.path.join(data_dir, TransitionWriter.PROGRESS)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @property
+    def done(self):
+        return self.written >= self.size
+
+    def add(self, states, actions, next_states, rewards, dones):
+        """ Append a batch of transitions (device tensors), rows beyond `size` are dropped
+
+        Return:
+            the number of transitions written
+        """
+        num = min(states.shape[0], self.size - self.written)
+        if num <= 0:
+            return 0
+        #* one packed device-side copy, then a single transfer to the (pinned) host staging buffer
+        packed = torch.cat([states.reshape(states.shape[0], -1), actions.reshape(states.shape[0], -1),
+                            next_states.reshape(states.shape[0], -1), rewards.reshape(-1, 1), dones.reshape(-1, 1)], dim=1)[:num]
+        if self._host is None or self._host.shape[0] < num:
+            self._host = torch.empty(num, packed.shape[1], pin_memory=torch.cuda.is_available())
+        host = self._host[:num]
+        host.copy_(packed)
+        host = host.numpy()
+
+        column = 0
+        for (fd, offset), width in zip(self.files, self.widths):
+            rows = np.ascontiguousarray(host[:, column:column + width])
+            os.pwrite(fd, rows, offset + self.written * width * rows.itemsize)
+            column += width
+        self.written += num
+
+        self._adds += 1
+        if self._adds % self.flush_interval == 0 or self.done:
+            self.flush()
+        return num
+
+    def flush(self):
+        for fd, _ in self.files:
+            os.fsync(fd)
+        self._write_progress()
+
+    def close(self):
+        self.flush()
+        for fd, _ in self.files:
+            os.close(fd)
+        self.files = []
+
+    def _write_progress(self):
+        path = os.path.join(self.data_dir, self.PROGRESS)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'size': self.size, 'written': self.written, 'widths': self.widths}, f)
+        os.replace(f'{path}.tmp', path)
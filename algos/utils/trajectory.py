@@ -0,0 +1,389 @@
+import os
+import json
+import heapq
+import zlib
+import pickle
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+MAGIC = b'AG2XTRJ1'
+FOOTER = struct.Struct('<Q8s')
+
+
+def _to_numpy(value):
+    if torch.is_tensor(value):
+        return value.detach().cpu().numpy()
+    return np.asarray(value)
+
+
+def _encode(array, level):
+    """ Byte-shuffle (all first bytes of the elements, then all second bytes, ...) and zlib-compress,
+        the shuffle groups the slowly varying exponent bytes of floats and compresses them much better
+    """
+    array = np.ascontiguousarray(array)
+    shuffled = np.frombuffer(array.tobytes(), dtype=np.uint8).reshape(-1, array.dtype.itemsize).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+
+def _decode(data, dtype, shape):
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(shuffled.T).view(dtype).reshape(shape)
+
+
+class TrajectoryWriter:
+    """ Streaming columnar writer of the `--save_traj` trajectories (absres files).
+
+    Every step is split into per-field columns that are compressed and appended to the file in chunks of
+    `chunk_size` steps while the episode runs. Fields listed in `static_keys` (e.g. `attach_info`) are
+    stored once, and `rigid_bodies` only keeps the bodies in `body_handles`. The index of the chunks is
+    written as a footer by `close`, until then the file lives under a temporary name.
+    """
+    def __init__(self, path, body_handles=None, chunk_size=64, compress_level=3, static_keys=('attach_info',)):
+        """
+        Args:
+            path: output file
+            body_handles: rigid body handles kept from the `rigid_bodies` states, all bodies if None
+            chunk_size: steps per compressed chunk
+            compress_level: zlib compression level
+            static_keys: state fields that do not change over the episode, stored once
+        """
+        self.path = path
+        self.body_handles = None if body_handles is None else np.asarray(sorted(set(int(h) for h in body_handles)), dtype=np.int64)
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+        self.static_keys = set(static_keys)
+        self.static = {}
+        self.fields = OrderedDict()
+        self.pending = {}
+        self.num_steps = 0
+        self.num_bodies = None
+        self._tmp_path = f'{path}.{os.getpid()}.tmp'
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(MAGIC)
+
+    def add(self, states, **columns):
+        """ Append one step
+
+        Args:
+            states: dict returned by `task.get_states()` (a single array is stored as `states`)
+            columns: additional per-step values, e.g. scores and visual_reward
+        """
+        if not isinstance(states, dict):
+            states = {'states': states}
+        step = {}
+        for key, value in list(states.items()) + list(columns.items()):
+            if key in self.static_keys:
+                self.static.setdefault(key, value)
+                continue
+            value = _to_numpy(value)
+            if key == 'rigid_bodies' and self.body_handles is not None:
+                self.num_bodies = value.shape[1]
+                value = value[:, self.body_handles]
+            step[key] = value
+
+        for key, value in step.items():
+            if key not in self.fields:
+                if self.num_steps > 0:
+                    raise ValueError(f"Field {key} appears after the first step")
+                self.fields[key] = {'dtype': value.dtype.str, 'shape': value.shape, 'chunks': []}
+                self.pending[key] = []
+            elif value.shape != self.fields[key]['shape']:
+                raise ValueError(f"Field {key} changed shape from {self.fields[key]['shape']} to {value.shape}")
+            self.pending[key].append(value)
+        self.num_steps += 1
+        if self.num_steps % self.chunk_size == 0:
+            self._flush()
+
+    def _flush(self):
+        for key, values in self.pending.items():
+            if len(values) == 0:
+                continue
+            data = _encode(np.stack(values), self.compress_level)
+            self.fields[key]['chunks'].append((self._file.tell(), len(data), len(values)))
+            self._file.write(data)
+            values.clear()
+
+    def close(self, **metadata):
+        """ Write the remaining steps and the footer, then move the file into place
+
+        Args:
+            metadata: picklable values stored with the trajectory
+        """
+        if self._file is None:
+            return
+        self._flush()
+        footer = pickle.dumps({
+            'num_steps': self.num_steps,
+            'fields': self.fields,
+            'static': self.static,
+            'body_handles': self.body_handles,
+            'num_bodies': self.num_bodies,
+            'metadata': metadata,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(footer)
+        self._file.write(FOOTER.pack(len(footer), MAGIC))
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def abort(self):
+        """ Discard the trajectory and its temporary file
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._tmp_path)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class BodyStates:
+    """ `rigid_bodies` states of one step restricted to the stored bodies, indexed with the original
+        [env, body handle, ...] layout
+    """
+    def __init__(self, states, body_index):
+        self.states = states
+        self.body_index = body_index
+
+    @property
+    def shape(self):
+        return (self.states.shape[0], len(self.body_index)) + self.states.shape[2:]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 1:
+            column = self.body_index[key[1]]
+            if np.any(column < 0):
+                raise KeyError(f"Rigid body {key[1]} was not saved in the trajectory")
+            key = (key[0], column) + key[2:]
+        return self.states[key]
+
+
+class TrajectoryStep:
+    """ Lazy view of one step of a `TrajectoryReader`, reads like the dicts of `task.get_states()`
+    """
+    def __init__(self, reader, index):
+        self.reader = reader
+        self.index = index
+
+    def keys(self):
+        return list(self.reader.fields.keys()) + list(self.reader.static.keys())
+
+    def __contains__(self, key):
+        return key in self.reader.fields or key in self.reader.static
+
+    def __getitem__(self, key):
+        if key in self.reader.static:
+            return self.reader.static[key]
+        value = self.reader.get(key, self.index)
+        if key == 'rigid_bodies' and self.reader.body_index is not None:
+            return BodyStates(value, self.reader.body_index)
+        return value
+
+
+class TrajectoryReader:
+    """ Lazy reader of the files written by `TrajectoryWriter`.
+
+    Only the footer is read on open; a chunk of a field is decompressed the first time one of its steps
+    is accessed and the last `cache_chunks` chunks are kept. Iterating yields `TrajectoryStep` views.
+    """
+    def __init__(self, path, cache_chunks=16):
+        self.path = path
+        self._file = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+        self._file.seek(-FOOTER.size, os.SEEK_END)
+        footer_size, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is truncated")
+        self._file.seek(-FOOTER.size - footer_size, os.SEEK_END)
+        footer = pickle.loads(self._file.read(footer_size))
+        self.num_steps = footer['num_steps']
+        self.fields = footer['fields']
+        self.static = footer['static']
+        self.metadata = footer['metadata']
+        self.body_index = None
+        if footer['body_handles'] is not None:
+            #* maps an original body handle to its column in the stored rigid_bodies, -1 if not stored
+            self.body_index = np.full(footer['num_bodies'], -1, dtype=np.int64)
+            self.body_index[footer['body_handles']] = np.arange(len(footer['body_handles']))
+        self._chunk_starts = {key: np.cumsum([0] + [n for _, _, n in field['chunks']]) for key, field in self.fields.items()}
+        self._cache = OrderedDict()
+        self.cache_chunks = cache_chunks
+
+    def __len__(self):
+        return self.num_steps
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.num_steps
+        if not 0 <= index < self.num_steps:
+            raise IndexError(f"Step {index} out of range for a trajectory of {self.num_steps} steps")
+        return TrajectoryStep(self, index)
+
+    def __iter__(self):
+        for index in range(self.num_steps):
+            yield TrajectoryStep(self, index)
+
+    def _chunk(self, key, chunk_id):
+        cache_key = (key, chunk_id)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+        field = self.fields[key]
+        offset, size, num_steps = field['chunks'][chunk_id]
+        self._file.seek(offset)
+        chunk = _decode(self._file.read(size), field['dtype'], (num_steps,) + tuple(field['shape']))
+        self._cache[cache_key] = chunk
+        if len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return chunk
+
+    def get(self, key, index):
+        """ Value of field `key` at step `index`
+        """
+        chunk_id = int(np.searchsorted(self._chunk_starts[key], index, side='right')) - 1
+        return self._chunk(key, chunk_id)[index - self._chunk_starts[key][chunk_id]]
+
+    def column(self, key):
+        """ Whole field `key` as a [T, ...] array
+        """
+        field = self.fields[key]
+        if len(field['chunks']) == 0:
+            return np.zeros((0,) + tuple(field['shape']), dtype=field['dtype'])
+        return np.concatenate([self._chunk(key, chunk_id) for chunk_id in range(len(field['chunks']))])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def load_trajectory(path):
+    """ Open an absres trajectory, a `TrajectoryReader` for the columnar format and the list of
+        step dicts for the former pickle files
+    """
+    with open(path, 'rb') as f:
+        is_columnar = f.read(len(MAGIC)) == MAGIC
+    if is_columnar:
+        return TrajectoryReader(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)['trajectory']
+
+
+class TrajectoryRecorder:
+    """ Records the episodes of all envs of a vec env in parallel, one `TrajectoryWriter` file per episode.
+
+    The states of every step are split per env (keeping a leading env axis of size 1, so the planners read
+    them with env_id 0), an episode ends at the step where the env's `reset_buf` is set. Exactly
+    `num_trajectories` episodes are recorded; with `top_k` only the k best by final score are kept on disk.
+    """
+    def __init__(self, path_prefix, num_envs, num_trajectories=1, top_k=None, body_handles=None, **writer_kwargs):
+        """
+        Args:
+            path_prefix: path of the files without extension, episodes are saved to {path_prefix}_env{i}_ep{j}.traj
+                (to {path_prefix}.traj for a single trajectory) and indexed in {path_prefix}.json
+            num_envs: number of envs of the vec env
+            num_trajectories: number of episodes to record
+            top_k: number of best episodes kept, all if None
+            body_handles, writer_kwargs: passed to `TrajectoryWriter`
+        """
+        self.path_prefix = path_prefix
+        self.num_envs = num_envs
+        self.num_trajectories = num_trajectories
+        self.top_k = top_k
+        self.body_handles = body_handles
+        self.writer_kwargs = writer_kwargs
+        self.static_keys = set(writer_kwargs.get('static_keys', ('attach_info',)))
+        self.writers = [None] * num_envs
+        self.episode_counts = [0] * num_envs
+        self.num_started = 0
+        self.num_finished = 0
+        self.kept = []  # min-heap of (score, episode id, path)
+        for env_id in range(num_envs):
+            self._start(env_id)
+
+    def _start(self, env_id):
+        if self.num_started >= self.num_trajectories:
+            self.writers[env_id] = None
+            return
+        if self.num_trajectories == 1:
+            path = f'{self.path_prefix}.traj'
+        else:
+            path = f'{self.path_prefix}_env{env_id}_ep{self.episode_counts[env_id]}.traj'
+        self.writers[env_id] = TrajectoryWriter(path, body_handles=self.body_handles, **self.writer_kwargs)
+        self.episode_counts[env_id] += 1
+        self.num_started += 1
+
+    @property
+    def done(self):
+        return self.num_finished >= self.num_trajectories
+
+    def add(self, states, dones, scores, visual_reward):
+        """ Append one step of all envs
+
+        Args:
+            states: dict returned by `task.get_states()`, fields with a leading [N] env axis are split per env
+            dones: [N] episode ends, e.g. `task.reset_buf`
+            scores: [N] success scores
+            visual_reward: [N] rewards
+        Return:
+            True once all trajectories are recorded
+        """
+        if not isinstance(states, dict):
+            states = {'states': states}
+        states = {key: value if key in self.static_keys else _to_numpy(value) for key, value in states.items()}
+        dones = _to_numpy(dones).reshape(-1)
+        scores = _to_numpy(scores).reshape(-1)
+        visual_reward = _to_numpy(visual_reward).reshape(-1)
+        for env_id, writer in enumerate(self.writers):
+            if writer is None:
+                continue
+            env_states = {key: value[env_id:env_id + 1] if isinstance(value, np.ndarray) and value.ndim > 0 and value.shape[0] == self.num_envs
+                          else value for key, value in states.items()}
+            writer.add(env_states, scores=scores[env_id], visual_reward=visual_reward[env_id:env_id + 1])
+            if dones[env_id]:
+                self._finish(env_id, float(scores[env_id]))
+                self._start(env_id)
+        return self.done
+
+    def _finish(self, env_id, score):
+        writer = self.writers[env_id]
+        writer.close(env_id=env_id, episode=self.episode_counts[env_id] - 1, score=score)
+        self.num_finished += 1
+        heapq.heappush(self.kept, (score, self.num_finished, writer.path))
+        if self.top_k is not None and len(self.kept) > self.top_k:
+            _, _, path = heapq.heappop(self.kept)
+            os.remove(path)
+
+    def close(self):
+        """ Drop the unfinished episodes and write the index of the kept trajectories, best first
+
+        Return:
+            list of (score, path) of the kept trajectories
+        """
+        for writer in self.writers:
+            if writer is not None:
+                writer.abort()
+        self.writers = [None] * self.num_envs
+        kept = [(score, path) for score, _, path in sorted(self.kept, reverse=True)]
+        with open(f'{self.path_prefix}.json', 'w') as f:
+            json.dump([{'score': score, 'path': os.path.basename(path)} for score, path in kept], f, indent=2)
+        return kept
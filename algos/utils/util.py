@@ -15,3 +15,284 @@ def get_clones(module, N):
 def check(input):
     output = torch.from_numpy(input) if type(input) == np.ndarray else input
     return output
+
+def compute_gae(values, rewards, dones, last_values, gamma, lam, returns=None, advantages=None, use_scan=None):
+    """ Generalized advantage estimation over a whole [T, N, 1] rollout block,
+        adv[t] = delta[t] + gamma * lam * (1 - dones[t]) * adv[t + 1].
+
+    On CUDA the recursion is solved as a reverse associative scan in log2(T) vectorized passes,
+    which removes the per-step kernel launches. On CPU every pass over the block is memory bound,
+    so a fused loop of two in-place ops per step over preallocated buffers is used instead.
+
+    Args:
+        values: [T, N, 1] value predictions
+        rewards: [T, N, 1] rewards
+        dones: [T, N, 1] done flags of any dtype
+        last_values: [N, 1] value prediction of the observation after the last step
+        gamma: discount factor
+        lam: GAE lambda
+        returns: optional [T, N, 1] output buffer of the returns
+        advantages: optional [T, N, 1] output buffer of the (unnormalized) advantages
+        use_scan: force the scan (True) or the fused loop (False), default to the scan on CUDA only
+
+    Return:
+        returns and advantages
+    """
+    if returns is None:
+        returns = torch.empty_like(values)
+    if advantages is None:
+        advantages = torch.empty_like(values)
+    num_steps = values.shape[0]
+
+    #* returns holds the continuation mask until the end, converting dones once into an existing buffer
+    not_done = returns
+    not_done.copy_(dones).neg_().add_(1.0)
+    torch.sub(rewards, values, out=advantages)
+
+    if use_scan is None:
+        use_scan = values.is_cuda
+    if use_scan:
+        #* x[t] = a[t] * x[t + 1] + b[t], after the pass with offset k: x[t] = a[t] * x[t + 2k] + b[t]
+        advantages[:-1].addcmul_(not_done[:-1], values[1:], value=gamma)
+        advantages[-1].addcmul_(not_done[-1], last_values, value=gamma)
+        a = not_done * (gamma * lam)
+        k = 1
+        while k < num_steps:
+            advantages[:-k].add_(a[:-k] * advantages[k:])
+            a[:-k] = a[:-k] * a[k:]
+            k *= 2
+    else:
+        #* bootstrap[t] = values[t + 1] + lam * adv[t + 1], so adv[t] = delta'[t] + gamma * (1 - dones[t]) * bootstrap[t]
+        bootstrap = torch.empty_like(last_values)
+        advantages[-1].addcmul_(not_done[-1], last_values, value=gamma)
+        for step in reversed(range(num_steps - 1)):
+            torch.add(values[step + 1], advantages[step + 1], alpha=lam, out=bootstrap)
+            advantages[step].addcmul_(not_done[step], bootstrap, value=gamma)
+
+    torch.add(advantages, values, out=returns)
+    return returns, advantages
+
+
+def compute_vtrace(values, rewards, dones, last_values, log_rhos, gamma, lam=1.0, rho_bar=1.0, c_bar=1.0):
+    """ V-trace targets and policy-gradient advantages (IMPALA, Espeholt et al. 2018) of a [T, N, 1] block
+        generated by a behaviour policy that lags behind the learner.
+
+    Args:
+        values: [T, N, 1] value predictions of the learner
+        rewards: [T, N, 1] rewards
+        dones: [T, N, 1] done flags of any dtype
+        last_values: [N, 1] learner value of the observation after the last step
+        log_rhos: [T, N, 1] log importance ratios, learner log-prob minus behaviour log-prob
+        gamma: discount factor
+        lam: lambda of the trace, c_t = lam * min(c_bar, rho_t)
+        rho_bar: truncation of the importance weights of the temporal differences and advantages
+        c_bar: truncation of the trace coefficients
+
+    Return:
+        value targets vs and advantages rho_t * (r_t + gamma * vs_{t+1} - V(x_t))
+    """
+    rhos = torch.exp(log_rhos)
+    clipped_rhos = torch.clamp(rhos, max=rho_bar)
+    cs = lam * torch.clamp(rhos, max=c_bar)
+    not_done = 1.0 - dones.float()
+
+    next_values = torch.cat([values[1:], last_values.unsqueeze(0)], dim=0)
+    deltas = clipped_rhos * (rewards + gamma * not_done * next_values - values)
+
+    #* vs_t - V(x_t) = delta_t + gamma * c_t * (vs_{t+1} - V(x_{t+1}))
+    vs_minus_v = torch.empty_like(values)
+    vs_minus_v[-1] = deltas[-1]
+    for step in reversed(range(values.shape[0] - 1)):
+        torch.addcmul(deltas[step], gamma * not_done[step] * cs[step], vs_minus_v[step + 1], out=vs_minus_v[step])
+    vs = values + vs_minus_v
+
+    next_vs = torch.cat([vs[1:], last_values.unsqueeze(0)], dim=0)
+    advantages = clipped_rhos * (rewards + gamma * not_done * next_vs - values)
+    return vs, advantages
+
+
+class EpisodeTracker:
+    """ Device-resident returns and lengths of the last `capacity` completed episodes.
+
+    `step` only runs masked device ops, so the rollout loop never waits on the device;
+    `statistics` reads everything back with a single transfer.
+    """
+    def __init__(self, num_envs, capacity=100, device='cpu'):
+        self.capacity = capacity
+        self.cur_reward_sum = torch.zeros(num_envs, dtype=torch.float, device=device)
+        self.cur_episode_length = torch.zeros(num_envs, dtype=torch.float, device=device)
+        #* one extra trash slot at the end receives the writes of envs that are not done
+        self.reward_buffer = torch.zeros(capacity + 1, dtype=torch.float, device=device)
+        self.length_buffer = torch.zeros(capacity + 1, dtype=torch.float, device=device)
+        self.ptr = torch.zeros((), dtype=torch.long, device=device)
+        self.count = torch.zeros((), dtype=torch.long, device=device)
+
+    def step(self, rewards, dones):
+        """
+        Args:
+            rewards: [N] rewards of the current step
+            dones: [N] done flags of the current step
+        """
+        self.cur_reward_sum += rewards.view(-1)
+        self.cur_episode_length += 1
+
+        done = dones.view(-1) > 0
+        rank = torch.cumsum(done, dim=0)
+        num_done = rank[-1]
+        #* only the last `capacity` episodes finished at this step are kept, as a deque(maxlen=capacity) would
+        keep = done & (num_done - rank < self.capacity)
+        slots = torch.where(keep, (self.ptr + rank - 1 - (num_done - self.capacity).clamp(min=0)) % self.capacity,
+                            torch.full_like(rank, self.capacity))
+        self.reward_buffer.index_put_((slots,), self.cur_reward_sum)
+        self.length_buffer.index_put_((slots,), self.cur_episode_length)
+        self.ptr = (self.ptr + num_done) % self.capacity
+        self.count = torch.clamp(self.count + num_done, max=self.capacity)
+
+        self.cur_reward_sum.masked_fill_(done, 0)
+        self.cur_episode_length.masked_fill_(done, 0)
+
+    def statistics(self):
+        """ Return the number of tracked episodes, their mean return and mean length
+        """
+        stats = torch.stack([self.count.float(), self.reward_buffer[:-1].sum(), self.length_buffer[:-1].sum()]).tolist()
+        count = int(stats[0])
+        if count == 0:
+            return 0, 0., 0.
+        return count, stats[1] / count, stats[2] / count
+
+
+class InfoAccumulator:
+    """ Running sum, count and max per key of the `extras` dicts returned by the env steps.
+
+    Replaces keeping every per-step dict alive until the end of the iteration: each step is
+    reduced on arrival on the device, and `statistics` reads all keys back with one transfer.
+    """
+    def __init__(self, device='cpu'):
+        self.device = device
+        self.sums = {}
+        self.counts = {}
+        self.maxs = {}
+
+    def __len__(self):
+        return len(self.sums)
+
+    def add(self, infos):
+        """
+        Args:
+            infos: dict of tensors, e.g. `extras` of the vec env step
+        """
+        for key, value in infos.items():
+            if not torch.is_tensor(value):
+                continue
+            value = value.detach().to(self.device, torch.float)
+            if value.numel() == 0:
+                continue
+            if key not in self.sums:
+                self.sums[key] = torch.zeros((), device=self.device)
+                self.counts[key] = 0
+                self.maxs[key] = torch.full((), -float('inf'), device=self.device)
+            self.sums[key] += value.sum()
+            self.counts[key] += value.numel()
+            self.maxs[key] = torch.maximum(self.maxs[key], value.max())
+
+    def statistics(self):
+        """ Return two dicts mapping each key to the mean and to the max over all accumulated elements
+        """
+        if len(self.sums) == 0:
+            return {}, {}
+        keys = list(self.sums.keys())
+        sums = torch.stack([self.sums[key] for key in keys]).tolist()
+        maxs = torch.stack([self.maxs[key] for key in keys]).tolist()
+        means = {key: s / self.counts[key] for key, s in zip(keys, sums)}
+        return means, dict(zip(keys, maxs))
+
+    def clear(self):
+        self.sums.clear()
+        self.counts.clear()
+        self.maxs.clear()
+
+
+class EpisodeEvaluator:
+    """ Device-resident statistics of exactly `num_episodes` evaluation episodes per group of envs.
+
+    The episodes of a group are dealt round robin over its envs (an env with quota q contributes its first
+    q episodes), so short episodes are not over-represented. `step` only runs device ops; `finished` and
+    `summary` read back with a single transfer each.
+    """
+    FIELDS = ('return', 'length', 'success_score', 'success', 'smoothness')
+
+    def __init__(self, group_ids, num_episodes, device='cpu'):
+        """
+        Args:
+            group_ids: [N] group (e.g. checkpoint) of every env
+            num_episodes: number of episodes evaluated per group
+        """
+        self.group_ids = torch.as_tensor(group_ids, dtype=torch.long, device=device)
+        self.num_groups = int(self.group_ids.max()) + 1
+        num_envs = self.group_ids.numel()
+        one_hot = nn.functional.one_hot(self.group_ids, self.num_groups)
+        rank = (torch.cumsum(one_hot, dim=0) * one_hot).sum(dim=1) - 1
+        group_size = one_hot.sum(dim=0)[self.group_ids]
+        self.quota = num_episodes // group_size + (rank < num_episodes % group_size).long()
+        self.num_episodes = num_episodes
+
+        self.episode_count = torch.zeros(num_envs, dtype=torch.long, device=device)
+        self.cur_return = torch.zeros(num_envs, device=device)
+        self.cur_length = torch.zeros(num_envs, device=device)
+        self.cur_action_change = torch.zeros(num_envs, device=device)
+        self.prev_actions = None
+        self.sums = torch.zeros(self.num_groups, len(self.FIELDS), device=device)
+        self.has_success = False
+
+    def step(self, actions, rewards, dones, scores, successes=None):
+        """
+        Args:
+            actions: [N, A] actions of the step
+            rewards: [N] rewards
+            dones: [N] episode ends
+            scores: [N] success scores, read at the episode end
+            successes: [N] success flags, read at the episode end, optional
+        """
+        if self.prev_actions is None:
+            self.prev_actions = actions.clone()
+        #* smoothness is the mean squared action change between consecutive steps of an episode
+        self.cur_action_change += torch.where(self.cur_length > 0, (actions - self.prev_actions).pow(2).sum(dim=-1),
+                                              torch.zeros_like(self.cur_length))
+        self.prev_actions.copy_(actions)
+        self.cur_return += rewards.view(-1)
+        self.cur_length += 1
+
+        done = dones.view(-1) > 0
+        accept = done & (self.episode_count < self.quota)
+        if successes is None:
+            successes = torch.zeros_like(self.cur_length)
+        else:
+            self.has_success = True
+        values = torch.stack([self.cur_return, self.cur_length, scores.view(-1).float(), successes.view(-1).float(),
+                              self.cur_action_change / (self.cur_length - 1).clamp(min=1)], dim=-1)
+        self.sums.index_add_(0, self.group_ids, values * accept.unsqueeze(-1))
+        self.episode_count += done.long()
+
+        self.cur_return.masked_fill_(done, 0)
+        self.cur_length.masked_fill_(done, 0)
+        self.cur_action_change.masked_fill_(done, 0)
+
+    def finished(self):
+        return bool((self.episode_count >= self.quota).all())
+
+    def summary(self):
+        """ Return one dict per group with the number of episodes and the mean of every statistic
+        """
+        counts = torch.zeros(self.num_groups, dtype=torch.long, device=self.sums.device)
+        counts.index_add_(0, self.group_ids, torch.minimum(self.episode_count, self.quota))
+        stats = torch.cat([counts.unsqueeze(-1).float(), self.sums], dim=-1).tolist()
+        summary = []
+        for row in stats:
+            count = int(row[0])
+            group = {'episodes': count}
+            for name, value in zip(self.FIELDS, row[1:]):
+                if name == 'success' and not self.has_success:
+                    continue
+                group[f'mean_{name}' if name != 'success' else 'success_rate'] = value / max(count, 1)
+            summary.append(group)
+        return summary
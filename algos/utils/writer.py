@@ -0,0 +1,120 @@
+import os
+import queue
+import atexit
+import threading
+
+import torch
+
+
+def atomic_save(obj, path):
+    """ torch.save to a temp file in the same directory, then rename over `path`,
+        so a crash never leaves a truncated checkpoint behind
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class BackgroundWriter:
+    """ Background I/O worker of the trainers, writes checkpoints and metrics off the training thread.
+
+    Checkpoints are snapshotted with a device-side clone on the caller thread and copied to the host,
+    saved and renamed into place by the worker. A checkpoint submitted for a path that is still
+    waiting in the queue replaces the pending snapshot, so a burst of `model_best.pt` saves only
+    writes the latest one. TensorBoard and wandb calls are replayed by the worker in submission order.
+    `close` (also registered at exit) drains the queue before returning.
+    """
+    def __init__(self, summary_writer=None, max_pending_checkpoints=4):
+        """
+        Args:
+            summary_writer: tensorboard SummaryWriter used by `add_scalar`
+            max_pending_checkpoints: number of distinct checkpoints queued before the caller blocks
+        """
+        self.summary_writer = summary_writer
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._slots = threading.Semaphore(max_pending_checkpoints)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='background-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                kind, payload = item
+                if kind == 'checkpoint':
+                    with self._lock:
+                        state_dict = self._pending.pop(payload)
+                    try:
+                        atomic_save({k: v.cpu() for k, v in state_dict.items()}, payload)
+                    finally:
+                        self._slots.release()
+                else:
+                    fn, args, kwargs = payload
+                    fn(*args, **kwargs)
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Background writer failed") from error
+        if self._closed:
+            raise RuntimeError("Background writer is closed")
+
+    def save_state_dict(self, state_dict, path):
+        """ Queue an atomic save of a snapshot of `state_dict` to `path`
+        """
+        self._check()
+        snapshot = {k: v.detach().clone() if torch.is_tensor(v) else v for k, v in state_dict.items()}
+        with self._lock:
+            if path in self._pending:
+                self._pending[path] = snapshot  # coalesce, the queued entry writes the newest snapshot
+                return
+        self._slots.acquire()
+        with self._lock:
+            self._pending[path] = snapshot
+        self._queue.put(('checkpoint', path))
+
+    def submit(self, fn, *args, **kwargs):
+        """ Run `fn(*args, **kwargs)` on the worker thread
+        """
+        self._check()
+        self._queue.put(('call', (fn, args, kwargs)))
+
+    def add_scalar(self, tag, value, step):
+        if self.summary_writer is not None:
+            self.submit(self.summary_writer.add_scalar, tag, value, step)
+
+    def wandb_log(self, data, step=None):
+        import wandb
+        if wandb.run is not None:
+            self.submit(wandb.log, data, step=step)
+
+    def flush(self):
+        """ Block until every queued item is written
+        """
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self.summary_writer is not None:
+            self.summary_writer.flush()
+        atexit.unregister(self.close)
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Background writer failed") from error
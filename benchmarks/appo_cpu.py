@@ -0,0 +1,84 @@
+""" Throughput of synchronous PPO against asynchronous APPO on the pure-CPU `CpuVecEnv`,
+    `--step_time` emulates the cost of a simulator step.
+
+Usage (from the repository root):
+    python -m benchmarks.appo_cpu --step_time 0.002 --iterations 20 --workers 2
+"""
+import json
+import time
+import argparse
+import functools
+import tempfile
+
+import torch
+import yaml
+
+from algos.rl.ppo import PPO
+from algos.rl.appo import APPO, CpuVecEnv
+
+
+def make_env(worker_id, num_envs, step_time):
+    return CpuVecEnv(num_envs=num_envs, step_time=step_time, seed=worker_id)
+
+
+def make_cfg(args: argparse.Namespace, correction: str = 'vtrace') -> dict:
+    with open('cfgs/algo/appo/config.yaml') as f:
+        cfg = yaml.safe_load(f)
+    cfg['policy'].update(pi_hid_sizes=args.hidden, vf_hid_sizes=args.hidden)
+    cfg['learn'].update(nsteps=args.nsteps, noptepochs=args.epochs, nminibatches=args.minibatches,
+                        num_workers=args.workers, rollouts_per_update=args.workers, correction=correction,
+                        max_policy_lag=args.max_policy_lag)
+    return cfg
+
+
+def mean_reward_per_step(algo) -> float:
+    return algo.storage.rewards.mean().item()
+
+
+def benchmark_ppo(args: argparse.Namespace) -> dict:
+    torch.manual_seed(args.seed)
+    env = CpuVecEnv(num_envs=args.envs * args.workers, step_time=args.step_time, seed=args.seed)
+    with tempfile.TemporaryDirectory() as log_dir:
+        algo = PPO(env, make_cfg(args), log_dir=log_dir, print_log=False)
+        t = time.perf_counter()
+        algo.run(args.iterations, log_interval=args.iterations)
+        elapsed = time.perf_counter() - t
+        algo.io_writer.close()
+    steps = args.iterations * args.nsteps * env.num_envs
+    return {'algo': 'ppo', 'steps_per_s': steps / elapsed, 'time_s': elapsed, 'last_reward_per_step': mean_reward_per_step(algo)}
+
+
+def benchmark_appo(args: argparse.Namespace, correction: str) -> dict:
+    torch.manual_seed(args.seed)
+    env_fn = functools.partial(make_env, num_envs=args.envs, step_time=args.step_time)
+    with tempfile.TemporaryDirectory() as log_dir:
+        algo = APPO(env_fn, make_cfg(args, correction), log_dir=log_dir, print_log=False)
+        t = time.perf_counter()
+        algo.run(args.iterations, log_interval=args.iterations)
+        elapsed = time.perf_counter() - t
+        algo.io_writer.close()
+    steps = args.iterations * args.nsteps * algo.vec_env.num_envs
+    return {'algo': f'appo-{correction}', 'steps_per_s': steps / elapsed, 'time_s': elapsed, 'last_reward_per_step': mean_reward_per_step(algo)}
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Synchronous PPO against asynchronous APPO on a CPU stand-in env')
+    parser.add_argument('--step_time', type=float, default=0.002, help='seconds slept per env step')
+    parser.add_argument('--envs', type=int, default=256, help='envs per worker, PPO runs workers * envs envs')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--nsteps', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--minibatches', type=int, default=4)
+    parser.add_argument('--max_policy_lag', type=int, default=1)
+    parser.add_argument('--hidden', type=int, nargs='+', default=[128, 128, 128])
+    parser.add_argument('--corrections', type=str, nargs='+', default=['vtrace', 'ppo'])
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    print(json.dumps(benchmark_ppo(args)))
+    for correction in args.corrections:
+        print(json.dumps(benchmark_appo(args, correction)))
@@ -0,0 +1,76 @@
+""" Latency of `BCQ_Model.select_action` against the original per-env selection loop.
+
+Usage (from the repository root):
+    python -m benchmarks.bcq_select --envs 1024 16384 --chunk 0 4096
+"""
+import json
+import time
+import argparse
+
+import torch
+
+from algos.offrl.bcq import BCQ_Model
+
+
+def reference_select_action(model: BCQ_Model, state: torch.Tensor) -> torch.Tensor:
+    """ The original `select_action`: 100 candidates and one indexing op per env
+    """
+    with torch.no_grad():
+        lenth = state.shape[0]
+        state = state.unsqueeze(1).repeat(1, 100, 1).reshape(-1, state.shape[-1])
+        action = model.actor(state, model.vae.decode(state))
+        q1 = model.critic.q1(state, action).reshape(lenth, 100, 1)
+        ind = q1.argmax(1)
+        action = action.reshape(lenth, 100, action.shape[-1])
+        action = torch.stack([action[i][ind[i]] for i in range(lenth)]).squeeze(1)
+    return action
+
+
+def timeit(fn, repeat: int, device: torch.device) -> float:
+    fn()  # warmup
+    best = float('inf')
+    for _ in range(repeat):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        t = time.perf_counter()
+        fn()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='BCQ action selection latency')
+    parser.add_argument('--envs', type=int, nargs='+', default=[1024, 16384])
+    parser.add_argument('--chunk', type=int, nargs='+', default=[0], help='select_chunk_size values, 0 disables chunking')
+    parser.add_argument('--state_dim', type=int, default=64)
+    parser.add_argument('--action_dim', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no_reference', action='store_true', help='skip the original per-env loop')
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    model = BCQ_Model(args.state_dim, args.action_dim, 1.0, device)
+    for num_envs in args.envs:
+        state = torch.randn(num_envs, args.state_dim, device=device)
+        if not args.no_reference:
+            ms = timeit(lambda: reference_select_action(model, state), args.repeat, device) * 1e3
+            print(json.dumps({'impl': 'reference', 'envs': num_envs, 'ms': ms}))
+        for chunk in args.chunk:
+            model.select_chunk_size = chunk or None
+            ms = timeit(lambda: model.select_action(state), args.repeat, device) * 1e3
+            print(json.dumps({'impl': 'gather', 'envs': num_envs, 'chunk': chunk, 'ms': ms}))
+
+    #* same candidates for the same RNG state, the selected actions must match
+    state = torch.randn(min(*args.envs, 1024), args.state_dim, device=device)
+    model.select_chunk_size = None
+    torch.manual_seed(1)
+    expected = reference_select_action(model, state)
+    torch.manual_seed(1)
+    assert torch.equal(model.select_action(state), expected)
@@ -0,0 +1,73 @@
+""" Micro-benchmark of the eager, TorchScript and torch.compile execution modes of `ActorCritic`
+    (`policy.compile` in the algo config) for `act_inference`, `act` and `evaluate` + backward.
+
+Usage (from the repository root):
+    python -m benchmarks.compiled_policy --batch 1 16 256 4096 16384 --modes none jit compile
+"""
+import json
+import time
+import warnings
+import argparse
+
+import torch
+
+from algos.rl.ppo.module import ActorCritic
+
+
+def timeit(fn, repeat: int, device: torch.device) -> float:
+    for _ in range(3):
+        fn()  # warmup, includes tracing / compilation of a new shape
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - t) / repeat
+
+
+def benchmark(mode: str, batch_size: int, args: argparse.Namespace) -> dict:
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    model_cfg = {'pi_hid_sizes': args.hidden, 'vf_hid_sizes': args.hidden, 'activation': args.activation, 'compile': mode}
+    model = ActorCritic((args.obs,), (0,), (args.actions,), args.init_noise_std, model_cfg).to(device)
+    observations = torch.randn(batch_size, args.obs, device=device)
+    states = torch.zeros(batch_size, 0, device=device)
+    actions = torch.randn(batch_size, args.actions, device=device)
+
+    def evaluate_backward():
+        model.zero_grad()
+        log_prob, entropy, value, _, _ = model.evaluate(observations, states, actions)
+        (log_prob.mean() + entropy.mean() + value.mean()).backward()
+
+    result = {'mode': mode, 'batch': batch_size}
+    with torch.no_grad():
+        result['act_inference_us'] = 1e6 * timeit(lambda: model.act_inference(observations), args.repeat, device)
+    result['act_us'] = 1e6 * timeit(lambda: model.act(observations, states), args.repeat, device)
+    result['evaluate_backward_us'] = 1e6 * timeit(evaluate_backward, args.repeat, device)
+    result['effective_mode'] = model.compile_mode  # 'none' if the requested mode fell back to eager
+    return result
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the compiled ActorCritic execution modes')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 16, 256, 4096, 16384])
+    parser.add_argument('--modes', type=str, nargs='+', default=['none', 'jit', 'compile'])
+    parser.add_argument('--obs', type=int, default=64, help='observation dim')
+    parser.add_argument('--actions', type=int, default=12, help='action dim')
+    parser.add_argument('--hidden', type=int, nargs='+', default=[128, 128, 128])
+    parser.add_argument('--activation', type=str, default='elu')
+    parser.add_argument('--init_noise_std', type=float, default=0.8)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    warnings.simplefilter('once')
+    for batch_size in args.batch:
+        for mode in args.modes:
+            print(json.dumps(benchmark(mode, batch_size, args)))
@@ -0,0 +1,87 @@
+""" CPU benchmark of the GAE kernel used by `RolloutStorage.compute_returns`.
+
+Usage (from the repository root):
+    python -m benchmarks.gae --steps 75 1000 --envs 1024 16384
+"""
+import json
+import time
+import argparse
+
+import torch
+
+from algos.utils.util import compute_gae
+
+
+def reference_gae(values, rewards, dones, last_values, gamma, lam):
+    """ Per-step loop of the original `RolloutStorage.compute_returns`
+    """
+    returns = torch.zeros_like(values)
+    advantage = 0
+    num_steps = values.shape[0]
+    for step in reversed(range(num_steps)):
+        if step == num_steps - 1:
+            next_values = last_values
+        else:
+            next_values = values[step + 1]
+        next_is_not_terminal = 1.0 - dones[step].float()
+        delta = rewards[step] + next_is_not_terminal * gamma * next_values - values[step]
+        advantage = delta + next_is_not_terminal * gamma * lam * advantage
+        returns[step] = advantage + values[step]
+    return returns, returns - values
+
+
+def timeit(fn, repeat: int) -> float:
+    fn()  # warmup
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def benchmark(num_steps: int, num_envs: int, args: argparse.Namespace) -> dict:
+    g = torch.Generator().manual_seed(args.seed)
+    values = torch.randn(num_steps, num_envs, 1, generator=g)
+    rewards = torch.randn(num_steps, num_envs, 1, generator=g)
+    dones = (torch.rand(num_steps, num_envs, 1, generator=g) < args.done_prob).byte()
+    last_values = torch.randn(num_envs, 1, generator=g)
+    returns = torch.zeros_like(values)
+    advantages = torch.zeros_like(values)
+
+    ref_returns, ref_advantages = reference_gae(values, rewards, dones, last_values, args.gamma, args.lam)
+    result = {'steps': num_steps, 'envs': num_envs}
+    for name, use_scan in (('loop', False), ('scan', True)):
+        compute_gae(values, rewards, dones, last_values, args.gamma, args.lam,
+                    returns=returns, advantages=advantages, use_scan=use_scan)
+        result[f'{name}_max_abs_err'] = max((returns - ref_returns).abs().max().item(),
+                                            (advantages - ref_advantages).abs().max().item())
+        result[f'{name}_ms'] = 1e3 * timeit(lambda: compute_gae(
+            values, rewards, dones, last_values, args.gamma, args.lam,
+            returns=returns, advantages=advantages, use_scan=use_scan), args.repeat)
+    result['reference_ms'] = 1e3 * timeit(
+        lambda: reference_gae(values, rewards, dones, last_values, args.gamma, args.lam), args.repeat)
+    result['loop_speedup'] = result['reference_ms'] / result['loop_ms']
+    return result
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='CPU benchmark of the vectorized GAE kernel')
+    parser.add_argument('--steps', type=int, nargs='+', default=[75, 1000], help='rollout lengths T')
+    parser.add_argument('--envs', type=int, nargs='+', default=[1024, 16384], help='numbers of envs N')
+    parser.add_argument('--gamma', type=float, default=0.96)
+    parser.add_argument('--lam', type=float, default=0.95)
+    parser.add_argument('--done_prob', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    for num_steps in args.steps:
+        for num_envs in args.envs:
+            print(json.dumps(benchmark(num_steps, num_envs, args)))
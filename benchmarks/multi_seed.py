@@ -0,0 +1,76 @@
+""" Wall-clock of S seeds trained one after the other against `MultiSeedPPO` training them together,
+    on the pure-CPU `CpuVecEnv` with `--envs` envs per seed.
+
+Usage (from the repository root):
+    python -m benchmarks.multi_seed --seeds 3 --envs 256 --iterations 10
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import torch
+import yaml
+
+from algos.rl.ppo import PPO, MultiSeedPPO
+from algos.rl.appo import CpuVecEnv
+
+
+def make_cfg(args: argparse.Namespace) -> dict:
+    with open('cfgs/algo/ppo/config.yaml') as f:
+        cfg = yaml.safe_load(f)
+    cfg['policy'].update(pi_hid_sizes=args.hidden, vf_hid_sizes=args.hidden)
+    cfg['learn'].update(nsteps=args.nsteps, noptepochs=args.epochs, nminibatches=args.minibatches)
+    return cfg
+
+
+def benchmark_sequential(args: argparse.Namespace) -> dict:
+    elapsed = 0.
+    for seed in range(args.seeds):
+        torch.manual_seed(seed)
+        env = CpuVecEnv(num_envs=args.envs, step_time=args.step_time, seed=seed)
+        with tempfile.TemporaryDirectory() as log_dir:
+            algo = PPO(env, make_cfg(args), device=args.device, log_dir=log_dir, print_log=False)
+            t = time.perf_counter()
+            algo.run(args.iterations, log_interval=args.iterations)
+            elapsed += time.perf_counter() - t
+            algo.io_writer.close()
+    steps = args.seeds * args.iterations * args.nsteps * args.envs
+    return {'algo': 'sequential', 'steps_per_s': steps / elapsed, 'time_s': elapsed}
+
+
+def benchmark_multi_seed(args: argparse.Namespace) -> dict:
+    env = CpuVecEnv(num_envs=args.envs * args.seeds, step_time=args.step_time, seed=0)
+    with tempfile.TemporaryDirectory() as log_dir:
+        seeds = list(range(args.seeds))
+        for seed in seeds:
+            os.makedirs(f'{log_dir}/run.{seed}')
+        algo = MultiSeedPPO(env, make_cfg(args), seeds, device=args.device, log_dir=f'{log_dir}/run', print_log=False)
+        t = time.perf_counter()
+        algo.run(args.iterations, log_interval=args.iterations)
+        elapsed = time.perf_counter() - t
+        for agent in algo.agents:
+            agent.io_writer.close()
+    steps = args.seeds * args.iterations * args.nsteps * args.envs
+    return {'algo': 'multi_seed', 'steps_per_s': steps / elapsed, 'time_s': elapsed}
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Sequential seeds against vectorized multi-seed PPO on a CPU stand-in env')
+    parser.add_argument('--seeds', type=int, default=3)
+    parser.add_argument('--envs', type=int, default=256, help='envs per seed')
+    parser.add_argument('--step_time', type=float, default=0.0, help='seconds slept per env step')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--nsteps', type=int, default=16)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--minibatches', type=int, default=4)
+    parser.add_argument('--hidden', type=int, nargs='+', default=[256, 256, 256])
+    parser.add_argument('--device', type=str, default='cpu')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    print(json.dumps(benchmark_sequential(args)))
+    print(json.dumps(benchmark_multi_seed(args)))
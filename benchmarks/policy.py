@@ -0,0 +1,96 @@
+""" Throughput benchmark of `ActorCritic.act` / `evaluate`, closed-form diagonal Gaussian head
+    against the former `MultivariateNormal` head.
+
+Usage (from the repository root):
+    python -m benchmarks.policy --batch 1024 16384 --actions 12
+"""
+import json
+import time
+import argparse
+
+import torch
+from torch.distributions import MultivariateNormal
+
+from algos.rl.ppo.module import ActorCritic
+
+
+def reference_act(model, observations):
+    actions_mean = model.actor(observations)
+    covariance = torch.diag(model.log_std.exp() * model.log_std.exp())
+    distribution = MultivariateNormal(actions_mean, scale_tril=covariance)
+    actions = distribution.sample()
+    return actions, distribution.log_prob(actions), model.critic(observations)
+
+
+def reference_evaluate(model, observations, actions):
+    actions_mean = model.actor(observations)
+    covariance = torch.diag(model.log_std.exp() * model.log_std.exp())
+    distribution = MultivariateNormal(actions_mean, scale_tril=covariance)
+    return distribution.log_prob(actions), distribution.entropy(), model.critic(observations)
+
+
+def timeit(fn, repeat: int, device: torch.device) -> float:
+    fn()  # warmup
+    best = float('inf')
+    for _ in range(repeat):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        t = time.perf_counter()
+        fn()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def benchmark(batch_size: int, args: argparse.Namespace) -> dict:
+    device = torch.device(args.device)
+    model_cfg = {'pi_hid_sizes': args.hidden, 'vf_hid_sizes': args.hidden, 'activation': 'elu'}
+    model = ActorCritic((args.obs,), (0,), (args.actions,), args.init_noise_std, model_cfg).to(device)
+    observations = torch.randn(batch_size, args.obs, device=device)
+    actions = torch.randn(batch_size, args.actions, device=device)
+
+    #* same log-density and entropy as the MultivariateNormal head
+    ref_log_prob, ref_entropy, _ = reference_evaluate(model, observations, actions)
+    log_prob, entropy, _, _, _ = model.evaluate(observations, None, actions)
+    result = {
+        'batch': batch_size,
+        'log_prob_max_abs_err': (log_prob - ref_log_prob).abs().max().item(),
+        'entropy_max_abs_err': (entropy - ref_entropy).abs().max().item(),
+    }
+
+    def evaluate_backward(fn):
+        model.zero_grad()
+        log_prob, entropy, value = fn()[:3]
+        (log_prob.mean() + entropy.mean() + value.mean()).backward()
+
+    with torch.no_grad():
+        result['act_reference_ms'] = 1e3 * timeit(lambda: reference_act(model, observations), args.repeat, device)
+        result['act_ms'] = 1e3 * timeit(lambda: model.act(observations, None), args.repeat, device)
+    result['evaluate_reference_ms'] = 1e3 * timeit(
+        lambda: evaluate_backward(lambda: reference_evaluate(model, observations, actions)), args.repeat, device)
+    result['evaluate_ms'] = 1e3 * timeit(
+        lambda: evaluate_backward(lambda: model.evaluate(observations, None, actions)), args.repeat, device)
+    result['act_speedup'] = result['act_reference_ms'] / result['act_ms']
+    result['evaluate_speedup'] = result['evaluate_reference_ms'] / result['evaluate_ms']
+    return result
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Throughput benchmark of the ActorCritic policy head')
+    parser.add_argument('--batch', type=int, nargs='+', default=[256, 1024, 16384])
+    parser.add_argument('--obs', type=int, default=64, help='observation dim')
+    parser.add_argument('--actions', type=int, default=12, help='action dim')
+    parser.add_argument('--hidden', type=int, nargs='+', default=[128, 128, 128])
+    parser.add_argument('--init_noise_std', type=float, default=0.8)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    torch.manual_seed(args.seed)
+    for batch_size in args.batch:
+        print(json.dumps(benchmark(batch_size, args)))
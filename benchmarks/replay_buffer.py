@@ -0,0 +1,89 @@
+""" Load time and sampling cost of the offline `ReplayBuffer` against the original numpy buffer of BCQ / IQL / TD3+BC,
+    on a synthetic float64 dataset written to a temporary directory.
+
+Usage (from the repository root):
+    python -m benchmarks.replay_buffer --transitions 1000000 --state_dim 64 --batch_size 100 256
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+from algos.utils.replay_buffer import ReplayBuffer
+
+
+class ReferenceReplayBuffer:
+    """ The original per-algorithm buffer: float64 numpy arrays, numpy indices and five host-to-device copies
+    """
+    def __init__(self, device):
+        self.device = device
+
+    def sample(self, batch_size):
+        ind = np.random.randint(0, self.size, size=batch_size)
+        return (
+            torch.FloatTensor(self.state[ind]).to(self.device),
+            torch.FloatTensor(self.action[ind]).to(self.device),
+            torch.FloatTensor(self.next_state[ind]).to(self.device),
+            torch.FloatTensor(self.reward[ind]).to(self.device),
+            torch.FloatTensor(self.not_done[ind]).to(self.device)
+        )
+
+    def convert(self, data_dir):
+        self.state = np.load(data_dir + 'states.npy')
+        self.action = np.load(data_dir + 'actions.npy')
+        self.next_state = np.load(data_dir + 'next_states.npy')
+        self.reward = np.load(data_dir + 'rewards.npy')
+        self.not_done = 1. - np.load(data_dir + 'dones.npy')
+        self.size = self.state.shape[0]
+
+
+def write_dataset(data_dir: str, args: argparse.Namespace):
+    rng = np.random.default_rng(0)
+    n = args.transitions
+    np.save(os.path.join(data_dir, 'states.npy'), rng.standard_normal((n, args.state_dim)))
+    np.save(os.path.join(data_dir, 'actions.npy'), rng.uniform(-1, 1, (n, args.action_dim)))
+    np.save(os.path.join(data_dir, 'next_states.npy'), rng.standard_normal((n, args.state_dim)))
+    np.save(os.path.join(data_dir, 'rewards.npy'), rng.standard_normal((n, 1)))
+    np.save(os.path.join(data_dir, 'dones.npy'), (rng.uniform(size=(n, 1)) < 0.01).astype(np.float64))
+
+
+def timeit(fn, repeat: int) -> float:
+    fn()  # warmup
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - t) / repeat
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Offline replay buffer load and sample benchmark')
+    parser.add_argument('--transitions', type=int, default=200000)
+    parser.add_argument('--state_dim', type=int, default=64)
+    parser.add_argument('--action_dim', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[100, 256, 1024])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_dataset(data_dir, args)
+        buffers = {'reference': ReferenceReplayBuffer(args.device),
+                   'packed': ReplayBuffer(args.state_dim, args.action_dim, args.device)}
+        for name, buffer in buffers.items():
+            t = time.perf_counter()
+            buffer.convert(data_dir + '/')
+            load_s = time.perf_counter() - t
+            for batch_size in args.batch_size:
+                sample_s = timeit(lambda: buffer.sample(batch_size), args.repeat)
+                print(json.dumps({'buffer': name, 'batch_size': batch_size, 'load_s': load_s, 'sample_us': sample_s * 1e6}))
@@ -0,0 +1,96 @@
+""" Step time of twin Q critics as two separate MLPs with a per-parameter soft update (the original
+    BCQ / IQL / TD3+BC critics) against `EnsembleMLP` with a foreach soft update.
+
+Usage (from the repository root):
+    python -m benchmarks.twin_critic --batch_size 256 --hidden 256 256
+"""
+import copy
+import json
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from algos.utils.ensemble import EnsembleMLP, soft_update
+
+
+class ReferenceTwinCritic(nn.Module):
+    """ Two independent MLP Q heads, evaluated one after the other
+    """
+    def __init__(self, input_dim, hidden_sizes):
+        super().__init__()
+        sizes = [input_dim] + list(hidden_sizes) + [1]
+        self.heads = nn.ModuleList([nn.Sequential(*[module for i in range(len(sizes) - 1) for module in
+                                                    ([nn.Linear(sizes[i], sizes[i + 1])] + ([nn.ReLU()] if i < len(sizes) - 2 else []))])
+                                    for _ in range(2)])
+
+    def forward(self, x):
+        return self.heads[0](x), self.heads[1](x)
+
+
+class EnsembleTwinCritic(nn.Module):
+    def __init__(self, input_dim, hidden_sizes):
+        super().__init__()
+        self.q = EnsembleMLP(2, input_dim, hidden_sizes, 1)
+
+    def forward(self, x):
+        q1, q2 = self.q(x)
+        return q1, q2
+
+
+def reference_soft_update(target, source, tau):
+    for param, target_param in zip(source.parameters(), target.parameters()):
+        target_param.data.copy_(tau * param.data + (1 - tau) * target_param.data)
+
+
+def make_step(critic, update, args, device):
+    target = copy.deepcopy(critic)
+    optimizer = torch.optim.Adam(critic.parameters(), lr=3e-4)
+    x = torch.randn(args.batch_size, args.input_dim, device=device)
+    y = torch.randn(args.batch_size, 1, device=device)
+
+    def step():
+        with torch.no_grad():
+            target_q = torch.min(*target(x))
+        q1, q2 = critic(x)
+        loss = F.mse_loss(q1, y + target_q) + F.mse_loss(q2, y + target_q)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        update(target, critic, 0.005)
+    return step
+
+
+def timeit(fn, repeat: int, device: torch.device) -> float:
+    for _ in range(10):
+        fn()  # warmup
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - t) / repeat
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Twin critic step time, separate heads against an ensemble')
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--input_dim', type=int, default=84)
+    parser.add_argument('--hidden', type=int, nargs='+', default=[256, 256])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    device = torch.device(args.device)
+    for name, critic_cls, update in (('reference', ReferenceTwinCritic, reference_soft_update),
+                                     ('ensemble', EnsembleTwinCritic, soft_update)):
+        torch.manual_seed(0)
+        step = make_step(critic_cls(args.input_dim, args.hidden).to(device), update, args, device)
+        print(json.dumps({'critic': name, 'batch_size': args.batch_size, 'step_ms': timeit(step, args.repeat, device) * 1e3}))
@@ -0,0 +1,252 @@
+import os
+import io
+import json
+import time
+import argparse
+import resource
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+from omegaconf import DictConfig, OmegaConf
+from loguru import logger
+
+from datasets.base import create_dataset
+from datasets.misc import collate_fn_epic_r3m
+from datasets.sampler import ClipLocalitySampler
+from models.base import create_model
+
+
+def build_synthetic_epic(data_dir: str, data_type: str, num_videos: int, frames_per_video: int,
+                         clips_per_video: int, seed: int=0) -> None:
+    """ Build a synthetic EPIC-KITCHEN like dataset on local disk, random jpeg frames,
+        hand keypoint npy files and the matching annotation csv. Skipped if the same layout exists.
+
+    Args:
+        data_dir: dataset root directory
+        data_type: frame folder type, can be 'rgb' and 'agentago'
+        num_videos: number of videos, one participant holds up to 10 videos
+        frames_per_video: number of frames per video
+        clips_per_video: number of annotated clips per video
+        seed: random seed
+    """
+    layout = {'data_type': data_type, 'num_videos': num_videos, 'frames_per_video': frames_per_video,
+              'clips_per_video': clips_per_video, 'seed': seed}
+    layout_path = os.path.join(data_dir, 'synthetic.json')
+    if os.path.exists(layout_path) and json.load(open(layout_path, 'r')) == layout:
+        return
+
+    logger.info(f'Build synthetic dataset in {data_dir}')
+    rng = np.random.default_rng(seed)
+    rows = []
+    for v in range(num_videos):
+        part_id = f'P{v // 10 + 1:02d}'
+        video_id = f'{part_id}_{v % 10 + 1:02d}'
+        frame_dir = os.path.join(data_dir, part_id, f'{data_type}_frames', video_id)
+        hand_dir = os.path.join(data_dir, part_id, 'hand_keypoints', video_id)
+        os.makedirs(frame_dir, exist_ok=True)
+        os.makedirs(hand_dir, exist_ok=True)
+        for frame_id in range(1, frames_per_video + 1):
+            img = rng.integers(0, 256, size=(256, 456, 3), dtype=np.uint8)
+            Image.fromarray(img).save(os.path.join(frame_dir, f'frame_{frame_id:010d}.jpg'), quality=90)
+            hand_num = rng.integers(0, 3)
+            if hand_num > 0:
+                hands = rng.random((hand_num, 21, 3)) * np.array([456, 256, 1])
+                np.save(os.path.join(hand_dir, f'frame_{frame_id:010d}.npy'), hands)
+        for _ in range(clips_per_video):
+            start_frame = int(rng.integers(1, frames_per_video - 2))
+            stop_frame = int(rng.integers(start_frame + 2, min(start_frame + 240, frames_per_video) + 1))
+            rows.append({'participant_id': part_id, 'video_id': video_id,
+                         'start_frame': start_frame, 'stop_frame': stop_frame})
+
+    pd.DataFrame(rows).to_csv(os.path.join(data_dir, 'EPIC100_annotations.csv'), index=False)
+    json.dump({}, open(os.path.join(data_dir, 'info.json'), 'w'))
+    json.dump(layout, open(layout_path, 'w'))
+
+
+def profile_dataset(dataset, num_items: int, batch_size: int) -> dict:
+    """ Time the dataset stages in the main process, disk read and jpeg decode per frame,
+        full getitem per sample and collation per batch.
+    """
+    read_time, decode_time, num_frames = 0., 0., 0
+    getitem_time, collate_time, num_batches = 0., 0., 0
+    batch = []
+    for index in range(min(num_items, len(dataset))):
+        mdata = dataset.metadata.iloc[index]
+        for frame_id in (mdata['start_frame'], mdata['stop_frame']):
+            path = os.path.join(dataset.data_dir, mdata['participant_id'], f'{dataset.data_type}_frames',
+                                mdata['video_id'], f"frame_{frame_id:010d}.jpg")
+            t = time.perf_counter()
+            with open(path, 'rb') as f:
+                buf = f.read()
+            read_time += time.perf_counter() - t
+            t = time.perf_counter()
+            dataset.to_tensor(Image.open(io.BytesIO(buf)).convert('RGB'))
+            decode_time += time.perf_counter() - t
+            num_frames += 1
+
+        t = time.perf_counter()
+        batch.append(dataset[index])
+        getitem_time += time.perf_counter() - t
+        if len(batch) == batch_size:
+            t = time.perf_counter()
+            collate_fn_epic_r3m(batch)
+            collate_time += time.perf_counter() - t
+            num_batches += 1
+            batch = []
+
+    num_samples = min(num_items, len(dataset))
+    return {
+        'read_ms_per_frame': 1e3 * read_time / max(num_frames, 1),
+        'decode_ms_per_frame': 1e3 * decode_time / max(num_frames, 1),
+        'getitem_ms_per_sample': 1e3 * getitem_time / max(num_samples, 1),
+        'collate_ms_per_batch': 1e3 * collate_time / max(num_batches, 1),
+    }
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+    """ Run `EpicKitchen` + `collate_fn_epic_r3m` + `AG2X2` forward/backward for a fixed number of steps
+    """
+    device = torch.device(args.device)
+    cfg = OmegaConf.create({
+        'model': OmegaConf.load(os.path.join(args.cfg_dir, 'model', 'ag2x2.yaml')),
+        'task': OmegaConf.load(os.path.join(args.cfg_dir, 'task', 'epic_kitchen.yaml')),
+    })
+    cfg.model.pretrained = not args.no_pretrained
+    cfg.task.dataset.data_dir_local = args.data_dir
+    cfg.task.dataset.clip_frames = args.clip_frames
+    cfg.task.dataset.triplets_per_clip = args.triplets_per_clip
+
+    build_synthetic_epic(args.data_dir, cfg.model.data_type, args.num_videos, args.frames_per_video,
+                         args.clips_per_video, seed=args.seed)
+    dataset = create_dataset(cfg.task.dataset, 'train', False)
+    dataset_stats = profile_dataset(dataset, args.profile_items, args.batch_size)
+
+    sampler = None
+    if args.locality_window > 0:
+        sampler = ClipLocalitySampler(dataset, window_size=args.locality_window, num_replicas=1, rank=0)
+    dataloader = dataset.get_dataloader(
+        sampler=sampler,
+        batch_size=args.batch_size,
+        collate_fn=collate_fn_epic_r3m,
+        num_workers=args.num_workers,
+        pin_memory=device.type == 'cuda',
+        shuffle=sampler is None,
+        drop_last=True,
+    )
+
+    model = create_model(cfg, slurm=False, device=device)
+    model.to(device=device)
+    params = []
+    for n, p in model.named_parameters():
+        if 'backbone' in n or 'mask_token' in n:
+            p.requires_grad = False
+        if p.requires_grad:
+            params.append(p)
+    optimizer = torch.optim.Adam([{'params': params, 'lr': cfg.model.learning_rate}])
+    model.train()
+
+    def sync() -> None:
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    stages = ['data_wait', 'h2d', 'forward', 'backward', 'optimizer']
+    times = {stage: 0. for stage in stages}
+    num_samples = 0
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+    data_iter = iter(dataloader)
+    for step in range(args.warmup + args.steps):
+        if step == args.warmup:
+            times = {stage: 0. for stage in stages}
+            num_samples = 0
+            sync()
+            start = time.perf_counter()
+        t = time.perf_counter()
+        try:
+            data = next(data_iter)
+        except StopIteration:
+            data_iter = iter(dataloader)
+            data = next(data_iter)
+        times['data_wait'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        for key in data:
+            if torch.is_tensor(data[key]):
+                data[key] = data[key].to(device, non_blocking=True)
+        sync()
+        times['h2d'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        optimizer.zero_grad()
+        data['epoch'] = 0
+        outputs = model(data)
+        sync()
+        times['forward'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        outputs['loss'].backward()
+        sync()
+        times['backward'] += time.perf_counter() - t
+
+        t = time.perf_counter()
+        optimizer.step()
+        sync()
+        times['optimizer'] += time.perf_counter() - t
+        num_samples += data['imgs'].shape[0]
+    total_time = time.perf_counter() - start
+
+    return {
+        'config': vars(args),
+        'dataset': dataset_stats,
+        'train': {
+            'steps': args.steps,
+            'total_s': total_time,
+            **{f'{stage}_s': times[stage] for stage in stages},
+            **{f'{stage}_ms_per_step': 1e3 * times[stage] / args.steps for stage in stages},
+            'triplets_per_s': num_samples / total_time,
+            'steps_per_s': args.steps / total_time,
+        },
+        'memory': {
+            'peak_host_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'peak_worker_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            'peak_device_mb': torch.cuda.max_memory_allocated(device) / 2 ** 20 if device.type == 'cuda' else 0.,
+        },
+    }
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Throughput benchmark of repre_trainer on synthetic EPIC-KITCHEN data')
+    parser.add_argument('--data_dir', type=str, default='/tmp/ag2x2_synthetic_epic', help='synthetic dataset root')
+    parser.add_argument('--cfg_dir', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cfgs'))
+    parser.add_argument('--num_videos', type=int, default=4)
+    parser.add_argument('--frames_per_video', type=int, default=600)
+    parser.add_argument('--clips_per_video', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_workers', type=int, default=0)
+    parser.add_argument('--clip_frames', type=int, default=3, help='frames decoded per annotation row')
+    parser.add_argument('--triplets_per_clip', type=int, default=1)
+    parser.add_argument('--locality_window', type=int, default=0, help='>0 uses ClipLocalitySampler')
+    parser.add_argument('--steps', type=int, default=20, help='timed training steps')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed steps before timing')
+    parser.add_argument('--profile_items', type=int, default=32, help='samples timed stage by stage in the main process')
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--no_pretrained', action='store_true', help='do not download the pretrained ViT weights')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='append the json result to this file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    result = benchmark(args)
+    result['timestamp'] = time.strftime('%Y-%m-%d_%H-%M-%S')
+    line = json.dumps(result)
+    print(line)
+    if args.output is not None:
+        with open(args.output, 'a') as f:
+            f.write(line + '\n')
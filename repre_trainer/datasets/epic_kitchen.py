@@ -15,6 +15,7 @@ from torch.utils.data import Dataset, DataLoader
 from omegaconf import DictConfig
 
 from datasets.base import DATASET
+from datasets.video import VideoReaderCache
 
 @DATASET.register()
 class EpicKitchen(Dataset):
@@ -43,10 +44,24 @@ class EpicKitchen(Dataset):
         self.data_dir = cfg.data_dir_slurm if self.slurm else cfg.data_dir_local
         self.resolution = (cfg.resolution_height, cfg.resolution_width)
         self.aug_sidewindow_size = (1 - cfg.aug_window_size) / 2
+        #* decode `clip_frames` frames once and draw `triplets_per_clip` triplets from them
+        self.clip_frames = cfg.get('clip_frames', 3)
+        self.triplets_per_clip = cfg.get('triplets_per_clip', 1)
+        if self.clip_frames < 3:
+            raise Exception(f"Unsupported clip frames: {self.clip_frames}, at least 3 frames are required")
         self.to_tensor = torchvision.transforms.ToTensor()
         self.preprocess = torch.nn.Sequential(
                     torchvision.transforms.Resize(self.resolution, antialias=True),)
         
+        #* frame backend, 'jpeg' reads extracted frames, 'video' decodes frames from the original videos
+        self.frame_backend = cfg.get('frame_backend', 'jpeg')
+        if self.frame_backend == 'video':
+            self.video_ext = cfg.get('video_ext', 'MP4')
+            self.video_readers = VideoReaderCache(max_size=cfg.get('video_cache_size', 8),
+                                                  resolution=tuple(cfg.get('video_resolution', [256, 456])))
+        elif self.frame_backend != 'jpeg':
+            raise Exception(f"Unsupported frame backend: {self.frame_backend}")
+
         #* for specify getitem func.
         self.item_type = cfg.item_type.lower()
         #* load data
@@ -68,6 +83,8 @@ class EpicKitchen(Dataset):
             #! use r3m sample way
             return self._getitem_vip(index)
         elif self.item_type.lower() in ['r3m', 'ag2x2']:
+            if self.clip_frames > 3 or self.triplets_per_clip > 1:
+                return self._getitem_r3m_window(index)
             return self._getitem_r3m(index)
         else:
             raise NotImplementedError
@@ -88,10 +105,7 @@ class EpicKitchen(Dataset):
         sample_indices = np.random.permutation(np.arange(start_frame, stop_frame + 1))[:3]
         s0_ind_r3m, s1_ind_r3m, s2_ind_r3m = np.sort(sample_indices)
 
-        img_s0 = self._load_frame(part_id, video_id, s0_ind_r3m)
-        img_s1 = self._load_frame(part_id, video_id, s1_ind_r3m)
-        img_s2 = self._load_frame(part_id, video_id, s2_ind_r3m)
-        imgs = torch.stack([img_s0, img_s1, img_s2], dim=0)
+        imgs = self._load_frames(part_id, video_id, [s0_ind_r3m, s1_ind_r3m, s2_ind_r3m])
         imgs = self.preprocess(imgs)
 
         hands_s0, hand_num_s0 = self._load_hand(part_id, video_id, s0_ind_r3m)
@@ -109,6 +123,39 @@ class EpicKitchen(Dataset):
             'hand_num': hand_num
         }
         return data
+
+    def _getitem_r3m_window(self, index: Any) -> Tuple:
+        """ Decode a window of `clip_frames` frames once and emit `triplets_per_clip` (s0, s1, s2) triplets from it
+        """
+        mdata = self.metadata.iloc[index]
+        start_frame = mdata['start_frame']
+        stop_frame = mdata['stop_frame']
+        part_id = mdata['participant_id']
+        video_id = mdata['video_id']
+
+        #* sample the frame window, then sorted triplets of window positions
+        frame_indices = np.sort(np.random.permutation(np.arange(start_frame, stop_frame + 1))[:self.clip_frames])
+        num_frames = len(frame_indices)
+        triplet_pos = np.sort(np.random.rand(self.triplets_per_clip, num_frames).argsort(axis=1)[:, :3], axis=1)
+        triplet_pos = torch.from_numpy(triplet_pos)
+
+        frames = self._load_frames(part_id, video_id, frame_indices)
+        frames = self.preprocess(frames)
+        hands, hand_num = zip(*[self._load_hand(part_id, video_id, i) for i in frame_indices])
+        hands = torch.stack(hands, dim=0)
+        hand_num = torch.stack(hand_num, dim=0)
+
+        triplet_frames = frame_indices[triplet_pos.numpy()]
+        #* dict a data sample, each field has a leading triplet dimension
+        data = {
+            'imgs': frames[triplet_pos],
+            's0_ind': triplet_frames[:, 0],
+            's1_ind': triplet_frames[:, 1],
+            's2_ind': triplet_frames[:, 2],
+            'hands': hands[triplet_pos],
+            'hand_num': hand_num[triplet_pos]
+        }
+        return data
     
     def _getitem_vip(self, index: Any) -> Tuple:
         mdata = self.metadata.iloc[index]
@@ -129,11 +176,7 @@ class EpicKitchen(Dataset):
 
         #* load images
         #! should be start_ind and stop_ind
-        img_start = self._load_frame(part_id, video_id, start_ind)
-        img_goal = self._load_frame(part_id, video_id, stop_ind)
-        img_s0 = self._load_frame(part_id, video_id, s0_ind_vip)
-        img_s1 = self._load_frame(part_id, video_id, s1_ind_vip)
-        imgs = torch.stack([img_start, img_goal, img_s0, img_s1], dim=0)
+        imgs = self._load_frames(part_id, video_id, [start_ind, stop_ind, s0_ind_vip, s1_ind_vip])
         imgs = self.preprocess(imgs)
 
         #* dict a data sample
@@ -145,6 +188,22 @@ class EpicKitchen(Dataset):
             's1_ind': s1_ind_vip,}
         return data
 
+    def _load_frames(self, part_id: str, video_id: str, frame_ids: Any) -> torch.Tensor:
+        """ Load several frames of one video as a [N, 3, H, W] tensor
+        """
+        if self.frame_backend == 'video':
+            frames = self.video_readers.get(self._video_path(part_id, video_id)).get_frames(frame_ids)
+            return torch.stack([frames[int(i)] for i in frame_ids], dim=0)
+        return torch.stack([self._load_frame(part_id, video_id, i) for i in frame_ids], dim=0)
+
+    def _video_path(self, part_id: str, video_id: str) -> str:
+        if self.data_type == 'rgb':
+            return os.path.join(self.data_dir, part_id, 'videos', f"{video_id}.{self.video_ext}")
+        elif self.data_type == 'agentago':
+            return os.path.join(self.data_dir, part_id, 'agentago_videos', f"{video_id}.{self.video_ext}")
+        else:
+            raise NotImplementedError
+
     def _load_frame(self, part_id: str, video_id: str, frame_id: int) -> torch.Tensor:
         if self.data_type == 'rgb':
             vid = os.path.join(self.data_dir, part_id, 'rgb_frames', video_id, f"frame_{frame_id:010d}.jpg")
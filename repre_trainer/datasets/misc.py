@@ -1,5 +1,6 @@
 from typing import Dict, List
 import torch
+import numpy as np
 from einops import rearrange
 
 def collate_fn_general(batch: List) -> Dict:
@@ -27,6 +28,8 @@ def collate_fn_epic_vip(batch: List) -> Dict:
 def collate_fn_epic_r3m(batch: List) -> Dict:
     """ Collate function used for EPIC-KITCHENS dataset.
     """
+    if batch[0]['imgs'].dim() == 5:
+        return collate_fn_epic_r3m_window(batch)
     batch_data = {key: [d[key] for d in batch] for key in batch[0]}
     batch_data['imgs'] = torch.stack(batch_data['imgs'])
     batch_data['s0_ind'] = torch.tensor(batch_data['s0_ind'], dtype=torch.long)
@@ -36,6 +39,18 @@ def collate_fn_epic_r3m(batch: List) -> Dict:
     batch_data['hand_num'] = torch.stack(batch_data['hand_num'])
     return batch_data
 
+def collate_fn_epic_r3m_window(batch: List) -> Dict:
+    """ Collate function used for EPIC-KITCHENS dataset with multiple triplets per clip.
+        Triplets are flattened into the batch in triplet-major order, so the rolled in-batch
+        negatives of the TCN loss come from other clips instead of the same clip.
+    """
+    batch_data = {key: [d[key] for d in batch] for key in batch[0]}
+    for key in ['imgs', 'hands', 'hand_num']:
+        batch_data[key] = rearrange(torch.stack(batch_data[key]), 'b m ... -> (m b) ...')
+    for key in ['s0_ind', 's1_ind', 's2_ind']:
+        batch_data[key] = rearrange(torch.tensor(np.stack(batch_data[key]), dtype=torch.long), 'b m -> (m b)')
+    return batch_data
+
 def collate_fn_epic_clip(batch: List) -> Dict:
     """ Collate function used for EPIC-KITCHEN Clips dataset.
     """
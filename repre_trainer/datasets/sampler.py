@@ -0,0 +1,103 @@
+from typing import Iterator, List, Optional
+import math
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+
+class ClipLocalitySampler(Sampler):
+    """ Sampler that keeps consecutive samples inside the same video.
+
+    Videos are shuffled every epoch, then the clips of each video (ordered by `start_frame`)
+    are cut into blocks of `window_size` clips. The block order and the clip order inside each
+    block are shuffled, so successive `_load_frame`/`_load_hand` calls stay in a warm directory.
+    Under DDP every rank takes one contiguous, equally sized slice of the epoch order, which
+    balances the work across ranks without breaking the locality.
+    """
+    def __init__(self, dataset, window_size: int=64, shuffle: bool=True, num_replicas: Optional[int]=None,
+                 rank: Optional[int]=None, seed: int=0, drop_last: bool=False) -> None:
+        """
+        Args:
+            dataset: dataset object, must expose a `metadata` dataframe with `video_id` and `start_frame`
+            window_size: number of neighbouring clips in one randomized block
+            shuffle: shuffle videos, blocks and clips or not
+            num_replicas: number of DDP processes, default to the world size if distributed
+            rank: rank of current process, default to the global rank if distributed
+            seed: random seed shared by all ranks
+            drop_last: drop the tail to make the samples evenly divisible instead of padding
+        """
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        if window_size < 1:
+            raise ValueError(f"Invalid window size: {window_size}")
+        if rank >= num_replicas or rank < 0:
+            raise ValueError(f"Invalid rank {rank}, rank should be in the interval [0, {num_replicas - 1}]")
+
+        self.window_size = window_size
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+        #* group annotation rows by video, ordered by time inside the video
+        metadata = dataset.metadata.reset_index(drop=True)
+        metadata = metadata.sort_values(['video_id', 'start_frame'], kind='stable')
+        self.videos = [torch.tensor(rows.index.tolist(), dtype=torch.long)
+                       for _, rows in metadata.groupby('video_id', sort=True)]
+
+        total_size = len(metadata)
+        if self.drop_last and total_size % self.num_replicas != 0:
+            self.num_samples = total_size // self.num_replicas
+        else:
+            self.num_samples = math.ceil(total_size / self.num_replicas)
+        self.total_size = self.num_samples * self.num_replicas
+
+    def _epoch_order(self) -> List[int]:
+        """ Build the global sample order of current epoch, identical on every rank
+        """
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+
+        video_order = torch.randperm(len(self.videos), generator=g).tolist() if self.shuffle else range(len(self.videos))
+        indices = []
+        for v in video_order:
+            clips = self.videos[v]
+            blocks = list(torch.split(clips, self.window_size))
+            if self.shuffle:
+                blocks = [blocks[b] for b in torch.randperm(len(blocks), generator=g).tolist()]
+                blocks = [block[torch.randperm(len(block), generator=g)] for block in blocks]
+            for block in blocks:
+                indices.extend(block.tolist())
+        return indices
+
+    def __iter__(self) -> Iterator[int]:
+        indices = self._epoch_order()
+        if not self.drop_last:
+            padding_size = self.total_size - len(indices)
+            if padding_size <= len(indices):
+                indices += indices[:padding_size]
+            else:
+                indices += (indices * math.ceil(padding_size / len(indices)))[:padding_size]
+        else:
+            indices = indices[:self.total_size]
+        assert len(indices) == self.total_size
+
+        #* contiguous slice per rank to keep the video locality
+        offset = self.rank * self.num_samples
+        return iter(indices[offset:offset + self.num_samples])
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def set_epoch(self, epoch: int) -> None:
+        """ Set the epoch for this sampler, so all ranks use the same different ordering every epoch.
+
+        Args:
+            epoch: epoch number
+        """
+        self.epoch = epoch
@@ -0,0 +1,141 @@
+from typing import Dict, List, Optional, Tuple
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+class VideoFrameReader():
+    """ Random access frame reader over an encoded video file.
+
+    A keyframe index (presentation timestamps of all frames and of the keyframes) is built once
+    per video by demuxing packets without decoding, and cached next to the video. Requested frames
+    are decoded from the nearest preceding keyframe only, and sorted requests that fall in the same
+    group of pictures reuse the running decoder instead of seeking again.
+    """
+    def __init__(self, path: str, resolution: Optional[Tuple[int, int]]=None) -> None:
+        """
+        Args:
+            path: video file path
+            resolution: (height, width) of the returned frames, None keeps the decoded size
+        """
+        import av  # optional dependency, only required by the video backend
+
+        self.path = path
+        self.resolution = resolution
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.frame_pts, self.key_pts = self._load_index()
+        self._decoder = None
+        self._decoded_pts = None
+
+    def _load_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Load the keyframe index from cache or build it by demuxing the video
+        """
+        index_path = self.path + '.index.npz'
+        if os.path.exists(index_path):
+            index = np.load(index_path)
+            return index['frame_pts'], index['key_pts']
+
+        frame_pts = []
+        key_pts = []
+        for packet in self.container.demux(self.stream):
+            if packet.pts is None:
+                continue
+            frame_pts.append(packet.pts)
+            if packet.is_keyframe:
+                key_pts.append(packet.pts)
+        frame_pts = np.sort(np.array(frame_pts, dtype=np.int64))
+        key_pts = np.sort(np.array(key_pts, dtype=np.int64))
+        try:
+            #* write then rename, several workers may index the same video concurrently
+            tmp_path = f'{index_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, frame_pts=frame_pts, key_pts=key_pts)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            pass  # read-only dataset directory, keep the index in memory only
+        return frame_pts, key_pts
+
+    def __len__(self) -> int:
+        return len(self.frame_pts)
+
+    def _to_tensor(self, frame) -> torch.Tensor:
+        """ Convert a decoded frame to a float tensor in [0, 1], same as `ToTensor` on a RGB image
+        """
+        if self.resolution is not None:
+            frame = frame.reformat(width=self.resolution[1], height=self.resolution[0])
+        img = torch.from_numpy(frame.to_ndarray(format='rgb24'))
+        return img.permute(2, 0, 1).float().div(255)
+
+    def get_frames(self, frame_ids: List[int]) -> Dict[int, torch.Tensor]:
+        """ Decode the given frames.
+
+        Args:
+            frame_ids: 1-based frame numbers, same numbering as the extracted `frame_%010d.jpg` files
+
+        Return:
+            A dict mapping each frame number to a [3, H, W] float tensor
+        """
+        frames = {}
+        for frame_id in sorted(set(int(i) for i in frame_ids)):
+            if frame_id < 1 or frame_id > len(self.frame_pts):
+                raise IndexError(f"Frame {frame_id} out of range [1, {len(self.frame_pts)}] in {self.path}")
+            target_pts = self.frame_pts[frame_id - 1]
+            key_pts = self.key_pts[np.searchsorted(self.key_pts, target_pts, side='right') - 1]
+
+            #* seek only if the running decoder cannot reach the target without passing a keyframe
+            if self._decoder is None or not (key_pts <= self._decoded_pts < target_pts):
+                self.container.seek(int(key_pts), stream=self.stream, backward=True, any_frame=False)
+                self._decoder = self.container.decode(self.stream)
+                self._decoded_pts = None
+
+            for frame in self._decoder:
+                if frame.pts is None:
+                    continue
+                self._decoded_pts = frame.pts
+                if frame.pts >= target_pts:
+                    frames[frame_id] = self._to_tensor(frame)
+                    break
+            else:
+                self._decoder = None
+                raise IndexError(f"Frame {frame_id} can not be decoded from {self.path}")
+        return frames
+
+    def close(self) -> None:
+        self._decoder = None
+        self.container.close()
+
+
+class VideoReaderCache():
+    """ LRU cache of opened `VideoFrameReader`, one cache lives in each dataloader worker
+    """
+    def __init__(self, max_size: int=8, resolution: Optional[Tuple[int, int]]=None) -> None:
+        """
+        Args:
+            max_size: max number of videos kept opened
+            resolution: (height, width) of the returned frames
+        """
+        self.max_size = max_size
+        self.resolution = resolution
+        self.readers = OrderedDict()
+        self.pid = os.getpid()
+
+    def get(self, path: str) -> VideoFrameReader:
+        #* decoders can not be shared with forked workers, drop readers inherited from the parent
+        if self.pid != os.getpid():
+            self.readers = OrderedDict()
+            self.pid = os.getpid()
+
+        if path in self.readers:
+            self.readers.move_to_end(path)
+            return self.readers[path]
+
+        reader = VideoFrameReader(path, resolution=self.resolution)
+        self.readers[path] = reader
+        if len(self.readers) > self.max_size:
+            _, evicted = self.readers.popitem(last=False)
+            evicted.close()
+        return reader
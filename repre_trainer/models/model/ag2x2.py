@@ -4,6 +4,7 @@ import torch
 import torchvision
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.distributed as dist
 from torchvision import transforms
 from omegaconf import DictConfig
 from PIL import Image
@@ -24,6 +25,14 @@ class AG2X2(nn.Module):
         self.num_negatives = cfg.num_negatives
         self.loss_weight = cfg.loss_weight
 
+        #* FIFO queue of (s0, s2) embeddings from recent batches, used as extra TCN negatives
+        #* it is a plain tensor rather than a buffer, so DDP does not broadcast it and ckpts do not store it
+        self.queue_size = cfg.get('queue_size', 0)
+        self.queue_negatives = cfg.get('queue_negatives', 0)
+        self.queue = None
+        self.queue_ptr = 0
+        self.queue_len = 0
+
         self.mlp = nn.Sequential(
             nn.Linear(2, 16),
             nn.ReLU(),
@@ -39,7 +48,7 @@ class AG2X2(nn.Module):
 
         self.normlayer = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
         if self.backbone_type == 'vit':
-            vit_model = timm.create_model('vit_large_patch16_224_in21k', pretrained=True)
+            vit_model = timm.create_model('vit_large_patch16_224_in21k', pretrained=cfg.get('pretrained', True))
             self.backbone = LoRA_ViT_timm(vit_model=vit_model, r=4, alpha=4, num_classes=1024)
             self.last = nn.Linear(1056, self.d_emb)
         else:
@@ -76,7 +85,7 @@ class AG2X2(nn.Module):
             hand_num = torch.stack(hand_num)
         hand_num = hand_num.reshape(B*T, *hand_num.shape[2:])
         hands_flat = hands.view(B*T, 2, -1).float()
-        hand_indices = torch.arange(2).unsqueeze(0).expand(B*T, -1).to(hands_flat.get_device())  # Shape: [B, 2]
+        hand_indices = torch.arange(2).unsqueeze(0).expand(B*T, -1).to(hands_flat.device)  # Shape: [B, 2]
         mask = (hand_indices < hand_num).unsqueeze(-1).float()  # Shape: [B, 2, 1]
         missing_hand_mask = 1. - mask  # Shape: [B, 2, 1]
         missing_hand_embedding = self.missing_hand_embedding.expand(B*T*2, 2)
@@ -119,6 +128,10 @@ class AG2X2(nn.Module):
             sim_s2_neg.append(self.similarity(emb_s2_shuf, emb_s2))
         sim_s0_neg = torch.stack(sim_s0_neg, dim=-1)
         sim_s2_neg = torch.stack(sim_s2_neg, dim=-1)
+        if self.queue_size > 0 and self.queue_len > 0:
+            queue = self.sample_queue()
+            sim_s0_neg = torch.cat([sim_s0_neg, self.similarity_matrix(emb_s0, queue[:, 0])], dim=-1)
+            sim_s2_neg = torch.cat([sim_s2_neg, self.similarity_matrix(emb_s2, queue[:, 1])], dim=-1)
 
         tcn_loss_1 = -torch.log(1e-6 + (torch.exp(sim_1_2) / (1e-6 + torch.exp(sim_0_2) + torch.exp(sim_1_2) + torch.exp(sim_s2_neg).sum(-1))))
         tcn_loss_2 = -torch.log(1e-6 + (torch.exp(sim_0_1) / (1e-6 + torch.exp(sim_0_1) + torch.exp(sim_0_2) + torch.exp(sim_s0_neg).sum(-1))))
@@ -131,8 +144,41 @@ class AG2X2(nn.Module):
         full_loss += self.loss_weight.tcn * tcn_loss
         metrics['full_loss'] = full_loss.item()
 
+        if self.queue_size > 0 and self.training:
+            self.enqueue(emb_s0.detach(), emb_s2.detach())
+            metrics['queue_len'] = self.queue_len
+
         return {'loss': full_loss, 'metrics': metrics}
     
+    def sample_queue(self) -> torch.Tensor:
+        """ Draw `queue_negatives` queued (s0, s2) embedding pairs, all of them if it is 0.
+            A copy is returned since the queue is updated in place before backward.
+        """
+        if 0 < self.queue_negatives < self.queue_len:
+            return self.queue[torch.randperm(self.queue_len, device=self.queue.device)[:self.queue_negatives]]
+        return self.queue[:self.queue_len].clone()
+
+    @torch.no_grad()
+    def enqueue(self, emb_s0: torch.Tensor, emb_s2: torch.Tensor) -> None:
+        """ Push the embeddings of current batch into the queue, gathered from all ranks under DDP
+        """
+        embs = torch.stack([emb_s0, emb_s2], dim=1)
+        if dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1:
+            gathered = [torch.zeros_like(embs) for _ in range(dist.get_world_size())]
+            dist.all_gather(gathered, embs)
+            embs = torch.cat(gathered, dim=0)
+        if self.queue is None or self.queue.device != embs.device:
+            self.queue = embs.new_zeros(self.queue_size, *embs.shape[1:])
+            self.queue_ptr = 0
+            self.queue_len = 0
+
+        embs = embs[-self.queue_size:]
+        n = embs.shape[0]
+        indices = (self.queue_ptr + torch.arange(n, device=embs.device)) % self.queue_size
+        self.queue[indices] = embs
+        self.queue_ptr = (self.queue_ptr + n) % self.queue_size
+        self.queue_len = min(self.queue_len + n, self.queue_size)
+
     def embedding(self, imgs: torch.Tensor) -> torch.Tensor:
         """ Embedding function
         """
@@ -162,3 +208,13 @@ class AG2X2(nn.Module):
             return d
         else:
             raise NotImplementedError
+
+    def similarity_matrix(self, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        """ Pairwise similarity between [B, D] and [N, D] embeddings, same measure as `similarity`
+        """
+        if self.similarity_type == 'l2':
+            return -torch.cdist(x, y)
+        elif self.similarity_type == 'cosine':
+            return F.normalize(x, dim=-1) @ F.normalize(y, dim=-1).t()
+        else:
+            raise NotImplementedError
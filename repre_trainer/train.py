@@ -11,6 +11,7 @@ from utils.io import mkdir_if_not_exists
 from utils.plot import Ploter
 from datasets.base import create_dataset
 from datasets.misc import collate_fn_general, collate_fn_epic_vip, collate_fn_epic_r3m
+from datasets.sampler import ClipLocalitySampler
 from models.base import create_model
 # from models.visualizer import create_visualizer
 
@@ -37,18 +38,23 @@ def train(cfg: DictConfig) -> None:
     
     if cfg.model.name.lower() in ['vip']:
         collate_fn = collate_fn_epic_vip
-    elif cfg.model.name.lower() in ['r3m', 'ag2manip']:
+    elif cfg.model.name.lower() in ['r3m', 'ag2manip', 'ag2x2']:
         collate_fn = collate_fn_epic_r3m
     else:
         collate_fn = collate_fn_general
     
+    train_sampler = None
+    if cfg.task.train.get('locality_window', 0) > 0:
+        train_sampler = ClipLocalitySampler(datasets['train'], window_size=cfg.task.train.locality_window,
+                                            num_replicas=1, rank=0)
     dataloaders = {
         'train': datasets['train'].get_dataloader(
+            sampler=train_sampler,
             batch_size=cfg.task.train.batch_size,
             collate_fn=collate_fn,
             num_workers=cfg.task.train.num_workers,
             pin_memory=False,
-            shuffle=True,
+            shuffle=train_sampler is None,
         ),
     }
     if 'test_for_vis' in datasets:
@@ -100,6 +106,8 @@ def train(cfg: DictConfig) -> None:
 
     ## start training
     for epoch in range(current_epoch, cfg.task.train.num_epochs):
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         model.train()
         for it, data in enumerate(dataloaders['train']):
             for key in data:
@@ -12,6 +12,7 @@ from utils.io import mkdir_if_not_exists
 from utils.plot import Ploter
 from datasets.base import create_dataset
 from datasets.misc import collate_fn_general, collate_fn_epic_vip, collate_fn_epic_r3m
+from datasets.sampler import ClipLocalitySampler
 from models.base import create_model
 # from models.visualizer import create_visualizer
 
@@ -39,12 +40,15 @@ def train(cfg: DictConfig) -> None:
     
     if cfg.model.name.lower() in ['vip', 'livip']:
         collate_fn = collate_fn_epic_vip
-    elif cfg.model.name.lower() in ['r3m', 'lir3m']:
+    elif cfg.model.name.lower() in ['r3m', 'lir3m', 'ag2x2']:
         collate_fn = collate_fn_epic_r3m
     else:
         collate_fn = collate_fn_general
     
-    train_sampler = DistributedSampler(datasets['train'])
+    if cfg.task.train.get('locality_window', 0) > 0:
+        train_sampler = ClipLocalitySampler(datasets['train'], window_size=cfg.task.train.locality_window)
+    else:
+        train_sampler = DistributedSampler(datasets['train'])
     dataloaders = {
         'train': datasets['train'].get_dataloader(
             sampler=train_sampler,
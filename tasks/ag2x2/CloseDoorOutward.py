@@ -1181,6 +1181,11 @@ class CloseDoorOutward(BaseTask):
         self.another_attached_body_handle = torch.where(another_refresh_attached_body_index, another_local_attached_handle, self.another_attached_body_handle)
         self.another_attached_info_indices = torch.where(another_refresh_attached_body_index, another_local_attached_indices, self.another_attached_info_indices)
     
+    @property
+    def trajectory_body_handles(self):
+        # rigid bodies read back by the planner from saved trajectories, the attachable parts
+        return sorted(set(self._attachable_handles.tolist()))
+
     def get_states(self):
         panda_hand_body_handle = self.gym.find_actor_rigid_body_handle(self.envs[0], self.robots[0], 'robot0:sphere_link')
         another_panda_hand_body_handle = self.gym.find_actor_rigid_body_handle(self.envs[0], self.robots_another[0], 'robot1:sphere_link')
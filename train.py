@@ -1,30 +1,58 @@
 import wandb
 import numpy as np
 import os
+import copy
+import functools
 
 from utils.config import set_np_formatting, set_seed, get_args, parse_sim_params, load_cfg
 from utils.parse_task import parse_task
-from utils.process_sarl import process_sarl
+from utils.process_sarl import process_sarl, process_appo
 from utils.process_offrl import *
+from algos.offrl.ppo_collect import collect_shards
 import torch
 
+def make_env(args, cfg, cfg_train, worker_id):
+    """ Build the vec env of an APPO rollout worker, runs inside the worker process """
+    cfg = copy.deepcopy(cfg)
+    cfg_train = copy.deepcopy(cfg_train)
+    if cfg_train.get("seed", -1) >= 0:
+        cfg_train["seed"] = cfg_train["seed"] + worker_id
+    set_seed(cfg_train.get("seed", -1), cfg_train.get("torch_deterministic", False))
+    sim_params = parse_sim_params(args, cfg, cfg_train)
+    task, env = parse_task(args, cfg, cfg_train, sim_params, agent_index=None)
+    return env
+
+def collect_shard(args, cfg, cfg_train, logdir, worker_id, shard_dir, shard_size):
+    """ Collect one shard of a ppo_collect dataset, runs inside the collection worker process """
+    cfg_train = copy.deepcopy(cfg_train)
+    cfg_train["learn"]["data_size"] = shard_size
+    env = make_env(args, cfg, cfg_train, worker_id)
+    collector = process_ppo_collect(args, env, cfg_train, logdir)
+    collector.data_save = shard_dir
+    collector.run(num_learning_iterations=0)
+
 def train(args):
     print(f"Algorithm: {args.algo}")
 
     if args.algo in ['ppo', 'ddpg', 'sac', 'td3', 'trpo']:
         if args.save_traj:
-            cfg['env']['numEnvs'] = 1
+            #* trajectories are recorded in parallel, no more envs than trajectories are needed
+            cfg['env']['numEnvs'] = min(cfg['env']['numEnvs'], args.num_trajs)
         task, env = parse_task(args, cfg, cfg_train, sim_params, agent_index=None)
 
         cfg_train['save_traj'] = args.save_traj
+        cfg_train['num_trajs'] = args.num_trajs
+        cfg_train['traj_topk'] = args.traj_topk if args.traj_topk > 0 else None
+        cfg_train['eval_episodes'] = args.eval_episodes
+        cfg_train['eval_models'] = [path for path in args.eval_models.split(',') if path]
         sarl = eval('process_sarl')(args, env, cfg_train, logdir)
 
         iterations = cfg_train["learn"]["max_iterations"]
         if args.max_iterations > 0:
             iterations = args.max_iterations
 
-        ## initialize wandb
-        if not args.disable_wandb and not args.test:
+        ## initialize wandb, multi-seed runs only log to the tensorboard dir of each seed
+        if not args.disable_wandb and not args.test and args.num_seeds <= 1:
             task_env, task_name, repre_name = args.task.split("@")
             camera_name = args.camera
             wandb.init(
@@ -42,6 +70,37 @@ def train(args):
             sarl.run(num_learning_iterations=iterations, log_interval=cfg_train["learn"]["save_interval"], ckpt=args.model_dir)
         else:
             sarl.run(num_learning_iterations=iterations, log_interval=cfg_train["learn"]["save_interval"])
+    elif args.algo == 'appo':
+        #* the envs are built inside the rollout worker processes
+        env_fn = functools.partial(make_env, args, cfg, cfg_train)
+        appo = process_appo(args, env_fn, cfg_train, logdir)
+
+        iterations = cfg_train["learn"]["max_iterations"]
+        if args.max_iterations > 0:
+            iterations = args.max_iterations
+
+        ## initialize wandb
+        if not args.disable_wandb:
+            task_env, task_name, repre_name = args.task.split("@")
+            camera_name = args.camera
+            wandb.init(
+                project=f'ag2x2',
+                name=f'{camera_name}@{repre_name}.seed{cfg_train.get("seed", -1)}',
+                config={
+                    'cfg': cfg,
+                    'cfg_train': cfg_train,
+                    'cfg_repre': cfg_repre,
+                    'args': args
+                }
+            )
+
+        appo.run(num_learning_iterations=iterations, log_interval=cfg_train["learn"]["save_interval"])
+    elif args.algo == "ppo_collect" and args.model_dir != "":
+        #* the dataset of the checkpoint is collected by independent workers, one shard and env seed each
+        data_dir = args.model_dir.split('.pt')[0]
+        collect_fn = functools.partial(collect_shard, args, cfg, cfg_train, logdir)
+        manifest = collect_shards(collect_fn, data_dir, cfg_train["learn"]["data_size"], args.collect_workers)
+        print(f'Collected {cfg_train["learn"]["data_size"]} transitions in {args.collect_workers} shards, see {manifest}')
     elif args.algo in ["td3_bc", "bcq", "iql", "ppo_collect"]:
         raise NotImplementedError
     
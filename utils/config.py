@@ -286,6 +286,10 @@ def get_args(benchmark=False, use_rlg_config=False, task_name="", algo=""):
         ##* START for TEST SAVING
         {"name": "--save_traj", "action": "store_true", "default": False,
             "help": "Run trained policy, no training, save the test result"},
+        {"name": "--num_trajs", "type": int, "default": 1,
+            "help": "Number of trajectories recorded with --save_traj, spread over min(numEnvs, num_trajs) envs"},
+        {"name": "--traj_topk", "type": int, "default": 0,
+            "help": "Only keep the k trajectories with the best success score, 0 keeps all"},
         #* End of TEST SAVING
 
         ##* START for TRAIN setting
@@ -307,6 +311,10 @@ def get_args(benchmark=False, use_rlg_config=False, task_name="", algo=""):
 
         {"name": "--test", "action": "store_true", "default": False,
             "help": "Run trained policy, no training"},
+        {"name": "--eval_episodes", "type": int, "default": 100,
+            "help": "Number of episodes evaluated per checkpoint in --test mode"},
+        {"name": "--eval_models", "type": str, "default": "",
+            "help": "Comma-separated checkpoints evaluated together with --model_dir, the envs are sharded between them"},
         {"name": "--play", "action": "store_true", "default": False,
             "help": "Run trained policy, the same as test, can be used only by rl_games RL library"},
         {"name": "--resume", "type": int, "default": 0,
@@ -334,6 +342,10 @@ def get_args(benchmark=False, use_rlg_config=False, task_name="", algo=""):
         {"name": "--episode_length", "type": int, "default": 0,
             "help": "Episode length, by default is read from yaml config"},
         {"name": "--seed", "type": int, "help": "Random seed"},
+        {"name": "--num_seeds", "type": int, "default": 1,
+            "help": "Number of PPO seeds (seed, seed + 1, ...) trained together in one process, numEnvs is split evenly between them"},
+        {"name": "--collect_workers", "type": int, "default": 1,
+            "help": "Number of processes collecting a ppo_collect dataset, each with its own env and seed writes one shard"},
         {"name": "--max_iterations", "type": int, "default": -1,
             "help": "Set a maximum number of training iterations"},
         {"name": "--steps_num", "type": int, "default": -1,
@@ -1,6 +1,6 @@
 
 def process_td3_bc(args, env, cfg_train, logdir):
-    from bidexhands.algorithms.offrl.td3_bc import TD3_BC
+    from algos.offrl.td3_bc import TD3_BC
     learn_cfg = cfg_train["learn"]
     is_testing = learn_cfg["test"]
     # is_testing = True
@@ -32,7 +32,7 @@ def process_td3_bc(args, env, cfg_train, logdir):
     return td3_bc
 
 def process_bcq(args, env, cfg_train, logdir):
-    from bidexhands.algorithms.offrl.bcq import BCQ
+    from algos.offrl.bcq import BCQ
     learn_cfg = cfg_train["learn"]
     is_testing = learn_cfg["test"]
     # is_testing = True
@@ -48,6 +48,8 @@ def process_bcq(args, env, cfg_train, logdir):
                 tau = learn_cfg["tau"],
                 lmbda = learn_cfg["lmbda"],
                 phi = learn_cfg["phi"],
+                num_candidates = learn_cfg.get("num_candidates", 100),
+                select_chunk_size = learn_cfg.get("select_chunk_size", None),
                 batch_size = learn_cfg["batch_size"],
                 max_timesteps = learn_cfg["max_timesteps"],
                 iterations =  learn_cfg["iterations"],
@@ -64,7 +66,7 @@ def process_bcq(args, env, cfg_train, logdir):
     return bcq
 
 def process_iql(args, env, cfg_train, logdir):
-    from bidexhands.algorithms.offrl.iql import IQL
+    from algos.offrl.iql import IQL
     learn_cfg = cfg_train["learn"]
     is_testing = learn_cfg["test"]
     # is_testing = True
@@ -97,7 +99,7 @@ def process_iql(args, env, cfg_train, logdir):
     return iql
 
 def process_ppo_collect(args, env, cfg_train, logdir):
-    from bidexhands.algorithms.offrl.ppo_collect import PPO, ActorCritic
+    from algos.offrl.ppo_collect import PPO, ActorCritic
     learn_cfg = cfg_train["learn"]
     is_testing = learn_cfg["test"]
     # is_testing = True
@@ -1,4 +1,5 @@
-from algos.rl.ppo import PPO
+from algos.rl.ppo import PPO, MultiSeedPPO
+from algos.rl.appo import APPO
 # from algos.rl.sac import SAC
 # from algos.rl.td3 import TD3
 # from algos.rl.ddpg import DDPG
@@ -16,6 +17,21 @@ def process_sarl(args, env, cfg_train, logdir):
     if args.max_iterations != -1:
         cfg_train["learn"]["max_iterations"] = args.max_iterations
 
+    if args.algo == "ppo" and args.num_seeds > 1 and not is_testing:
+        if args.model_dir != "":
+            raise NotImplementedError("Multi-seed PPO does not support resuming from a checkpoint")
+        #* one agent per seed on its slice of the envs, each logs to {logdir}.{seed}
+        base_seed = env.task.cfg["seed"]
+        return MultiSeedPPO(vec_env=env,
+                            cfg_train=cfg_train,
+                            seeds=[base_seed + i for i in range(args.num_seeds)],
+                            device=env.rl_device,
+                            sampler=learn_cfg.get("sampler", 'sequential'),
+                            log_dir=logdir,
+                            print_log=learn_cfg["print_log"],
+                            asymmetric=(env.num_states > 0)
+                            )
+
     logdir = logdir + ".{}".format(env.task.cfg["seed"])
 
     """Set up the algo system for training or inferencing."""
@@ -38,4 +54,26 @@ def process_sarl(args, env, cfg_train, logdir):
         print("Loading model from {}".format(chkpt_path))
         model.load(chkpt_path)
 
-    return model
\ No newline at end of file
+    return model
+
+
+def process_appo(args, env_fn, cfg_train, logdir):
+    learn_cfg = cfg_train["learn"]
+    if learn_cfg["test"] or args.model_dir != "":
+        raise NotImplementedError("APPO only supports training, test the checkpoint with --algo=ppo")
+
+    if args.max_iterations != -1:
+        cfg_train["learn"]["max_iterations"] = args.max_iterations
+
+    logdir = logdir + ".{}".format(cfg_train.get("seed", -1))
+
+    """Set up the asynchronous actor-learner system, the rollout workers build their envs with env_fn."""
+    model = APPO(env_fn=env_fn,
+                 cfg_train=cfg_train,
+                 device=args.rl_device,
+                 sampler=learn_cfg.get("sampler", 'sequential'),
+                 log_dir=logdir,
+                 print_log=learn_cfg["print_log"],
+                 )
+
+    return model